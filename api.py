@@ -0,0 +1,430 @@
+import hashlib
+import json
+
+import numpy
+import pandas
+import requests
+from flask import Blueprint, abort, current_app, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from cache import LRUCache
+from columns import station_columns
+from filters import StationFilter, local_minutes, station_timezone
+from functions import find_routes, route_stations, trip_legs
+from routing import NoRouteError, RoutingError, encode_polyline
+from service_areas import service_area_minutes, service_areas
+from spatial import batch_nearest, ground_distances, project_points, station_index
+from systems import system_for, system_named, system_router
+
+# default number of stations of a nearest station request
+nearest_k_default = 5
+# max number of stations of a nearest station request
+nearest_k_max = 100
+# max number of points of one batch nearest station request
+batch_points_max = 100000
+# number of serialized responses kept, by system, snapshot version and request parameters
+api_cache_size = 256
+# station columns of the responses, besides the position
+api_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressZipCode', 'bikesAvailable',
+               'classicBikesAvailable', 'smartBikesAvailable', 'electricBikesAvailable', 'docksAvailable',
+               'totalDocks', 'kioskPublicStatus']
+# decimals of the distances in the responses (meters)
+distance_decimals = 1
+# travel time of a reachable station request without minutes
+reachable_minutes_default = 5
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api')
+# serialized response bodies: (endpoint, (system, snapshot version), format, parameters) -> bytes
+api_responses = LRUCache(api_cache_size)
+
+
+@api_blueprint.errorhandler(HTTPException)
+def api_error(error):
+    # errors of the API are JSON as well
+    return jsonify(error=error.description), error.code
+
+
+@api_blueprint.route('/stations')
+def stations():
+    """
+        The stations passing the filters of the query.
+
+        Query:
+            min_bikes, min_classic_bikes, min_smart_bikes, min_electric_bikes, min_docks (int): Minimum counts.
+            active (bool): Active stations only. open_now (bool): Stations open now only.
+            format (str): 'json' (default, one array per column) or 'geojson' (a FeatureCollection of points).
+            system (str): The bike-share system (default: the default system).
+        """
+    system = query_system()
+    station_filter, response_format = query_station_filter(system.timezone), query_format()
+
+    def build(snapshot):
+        positions = numpy.flatnonzero(station_filter.mask(snapshot))
+        return station_document(snapshot, positions, response_format)
+
+    return cached_response('stations', (station_filter.key(),), build, response_format, system)
+
+
+@api_blueprint.route('/nearest')
+def nearest():
+    """
+        The k stations passing the filters of the query nearest to a position, ordered by distance.
+
+        Query:
+            latitude, longitude (float): The position. k (int): The number of stations (default: 5).
+            The filters, the format and the system of /api/stations, the system defaults to the one of the
+            position.
+        """
+    latitude, longitude = query_float('latitude'), query_float('longitude')
+    k = query_int('k', nearest_k_default)
+    if not 0 < k <= nearest_k_max:
+        abort(400, f'k must be between 1 and {nearest_k_max}')
+    system = query_system(latitude, longitude)
+    station_filter, response_format = query_station_filter(system.timezone), query_format()
+
+    def build(snapshot):
+        x, y = project_points(latitude, longitude)
+        index = station_index(snapshot)
+        positions, _ = index.query(float(x), float(y), k, station_filter.mask(snapshot))
+        return station_document(snapshot, positions, response_format,
+                                distance=numpy.round(ground_distances(index, positions, latitude, longitude),
+                                                     distance_decimals))
+
+    return cached_response('nearest', (latitude, longitude, k, station_filter.key()), build, response_format,
+                           system)
+
+
+@api_blueprint.route('/route')
+def route():
+    """
+        The trip from a position to a destination: the chosen start and end station and the routes of the walk
+        to the start station, the ride and the walk to the destination.
+
+        Query:
+            latitude, longitude (float): The start position. dest_latitude, dest_longitude (float): The destination.
+            polyline (bool): Legs as encoded polylines instead of coordinate arrays (json format only).
+            The filters, the format and the system of /api/stations, the system defaults to the one of the
+            start position.
+        """
+    latitude, longitude = query_float('latitude'), query_float('longitude')
+    dest_latitude, dest_longitude = query_float('dest_latitude'), query_float('dest_longitude')
+    polyline = query_bool('polyline')
+    system = query_system(latitude, longitude)
+    station_filter, response_format = query_station_filter(system.timezone), query_format()
+    # the station choice depends on the forecast model of the system as well
+    model = system.forecast.get()
+
+    def build(snapshot):
+        df = snapshot.view()
+        try:
+            s_station, d_station, estimated_seconds = route_stations(
+                df, latitude, longitude, dest_latitude, dest_longitude, station_index(snapshot),
+                station_filter.mask(snapshot), snapshot, system.forecast)
+        except ValueError as e:
+            abort(404, str(e))
+        legs = trip_legs(df, latitude, longitude, dest_latitude, dest_longitude, s_station, d_station)
+        try:
+            routes = find_routes(legs, current_app.extensions.get('route_backend'))
+        except NoRouteError as e:
+            # the stations were found, the road network does not connect them
+            abort(422, str(e))
+        except (requests.RequestException, RoutingError, KeyError, IndexError) as e:
+            # an unreachable routing service, an error response or a response without a route; the message of
+            # a request error holds the URL with the API key
+            abort(502, f'routing failed ({type(e).__name__})')
+        positions = numpy.array([df.index.get_loc(s_station), df.index.get_loc(d_station)])
+        return route_document(snapshot, positions, legs, routes, estimated_seconds, response_format, polyline)
+
+    return cached_response('route', (latitude, longitude, dest_latitude, dest_longitude, polyline,
+                                     station_filter.key(), model and model.trained_at), build, response_format,
+                           system)
+
+
+@api_blueprint.route('/reachable')
+def reachable():
+    """
+        The stations passing the filters of the query reachable from a position within a walk or ride of some
+        minutes along the road network, ordered by travel time. Answered from the precomputed service areas of
+        the snapshot, without routing.
+
+        Query:
+            latitude, longitude (float): The position. minutes (float): The travel time (default: 5).
+            profile (str): 'foot-walking' (default) or 'cycling-regular'.
+            The filters, the format and the system of /api/stations, the system defaults to the one of the
+            position.
+        """
+    latitude, longitude = query_float('latitude'), query_float('longitude')
+    profile = request.args.get('profile', 'foot-walking')
+    if profile not in service_area_minutes:
+        abort(400, f"profile must be one of {', '.join(service_area_minutes)}")
+    try:
+        minutes = float(request.args.get('minutes', reachable_minutes_default))
+    except ValueError:
+        abort(400, 'minutes must be a number')
+    if not 0 < minutes <= service_area_minutes[profile]:
+        abort(400, f'minutes must be between 0 and {service_area_minutes[profile]} for {profile}')
+    system = query_system(latitude, longitude)
+    station_filter, response_format = query_station_filter(system.timezone), query_format()
+    graph_file = system_road_graph(system, current_app)
+    if graph_file is None:
+        abort(404, f'no road network for {system.name}')
+
+    def build(snapshot):
+        areas = service_areas(snapshot, profile, graph_file)
+        positions, seconds = areas.reachable(latitude, longitude, minutes)
+        keep = station_filter.mask(snapshot)[positions]
+        return station_document(snapshot, positions[keep], response_format, seconds=seconds[keep])
+
+    return cached_response('reachable', (latitude, longitude, minutes, profile, station_filter.key()), build,
+                           response_format, system)
+
+
+@api_blueprint.route('/nearest/batch', methods=['POST'])
+def nearest_batch():
+    # JSON body: {"latitude": [...], "longitude": [...], "k": 5, "system": optional name}; without a system every
+    # point is answered by the system of its position, version and system are then given per system and point
+    body = request.get_json(silent=True) or {}
+    latitudes = body.get('latitude')
+    longitudes = body.get('longitude')
+    if not isinstance(latitudes, list) or not isinstance(longitudes, list) \
+            or len(latitudes) != len(longitudes):
+        return jsonify(error='latitude and longitude must be lists of the same length'), 400
+    if len(latitudes) > batch_points_max:
+        return jsonify(error=f'at most {batch_points_max} points per request'), 413
+    try:
+        k = int(body.get('k', nearest_k_default))
+        latitudes = numpy.asarray(latitudes, dtype=float)
+        longitudes = numpy.asarray(longitudes, dtype=float)
+    except (TypeError, ValueError):
+        return jsonify(error='k must be an integer and coordinates numbers'), 400
+    if not 0 < k <= nearest_k_max:
+        return jsonify(error=f'k must be between 1 and {nearest_k_max}'), 400
+    if not (numpy.isfinite(latitudes).all() and numpy.isfinite(longitudes).all()):
+        # null becomes NaN above, the KD-tree only takes finite coordinates
+        return jsonify(error='coordinates must be finite numbers'), 400
+    if body.get('system') is not None:
+        try:
+            systems = [system_named(str(body['system']))]
+        except KeyError:
+            return jsonify(error=f"unknown system {body['system']}"), 404
+        shards = numpy.zeros(len(latitudes), dtype=numpy.intp)
+    else:
+        systems = system_router.systems
+        shards = system_router.locate_many(latitudes, longitudes) if len(systems) > 1 \
+            else numpy.zeros(len(latitudes), dtype=numpy.intp)
+
+    # one batch search per system in the index of its snapshot, a system with less than k stations returns all
+    kiosk_ids = [None] * len(latitudes)
+    distances = [None] * len(latitudes)
+    versions = {}
+    shard_list = numpy.unique(shards).tolist() or [0]
+    for shard in shard_list:
+        snapshot = systems[shard].store.get()
+        versions[snapshot.system] = snapshot.version
+        points = numpy.flatnonzero(shards == shard) if len(shard_list) > 1 else slice(None)
+        index = station_index(snapshot)
+        positions, _ = batch_nearest(index, latitudes[points], longitudes[points], k)
+        shard_ids = snapshot.frame['kioskId'].to_numpy()[positions].tolist()
+        shard_distances = ground_distances(index, positions, latitudes[points][:, None], longitudes[points][:, None])
+        shard_distances = numpy.round(shard_distances, distance_decimals).tolist()
+        if len(shard_list) == 1:
+            kiosk_ids, distances = shard_ids, shard_distances
+            continue
+        for point, ids, point_distances in zip(points.tolist(), shard_ids, shard_distances):
+            kiosk_ids[point], distances[point] = ids, point_distances
+
+    if len(versions) == 1:
+        (system, version), = versions.items()
+        return jsonify(version=version, system=system, kioskId=kiosk_ids, distance=distances)
+    return jsonify(version=versions, system=[systems[shard].name for shard in shards.tolist()],
+                   kioskId=kiosk_ids, distance=distances)
+
+
+def cached_response(endpoint, parameters, build, response_format='json', system=None):
+    """
+        Answers a request from the serialized response cache, with an ETag of the system, the feed file and the
+        request parameters. A client sending the ETag back gets a 304 without a body while nothing changed. The
+        ETag does not use the snapshot version, which is numbered per process: every worker of a server and a
+        restarted server give the same feed the same ETag.
+
+        Args:
+            endpoint (str): The name of the endpoint.
+            parameters (tuple): The parsed request parameters the response depends on.
+            build (callable): build(snapshot) returning the response document.
+            response_format (str): 'json' or 'geojson' (default: 'json').
+            system (BikeSystem): The system answering the request (default: None, the default system).
+
+        Returns:
+            Response: The response, 304 if the client's copy is current.
+        """
+    snapshot = (system or system_named(None)).store.get()
+    key = (endpoint, snapshot.key, response_format) + tuple(parameters)
+    etag = hashlib.sha1(repr((endpoint, snapshot.source_key, response_format) + tuple(parameters)).encode())
+    etag = etag.hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        body = api_responses.get(key)
+        if body is None:
+            body = json.dumps(build(snapshot), separators=(',', ':')).encode()
+            api_responses.put(key, body)
+        response = current_app.response_class(
+            body, mimetype='application/geo+json' if response_format == 'geojson' else 'application/json')
+    response.set_etag(etag)
+    # clients may keep the response, but must revalidate it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def station_document(snapshot, positions, response_format, **extra):
+    """
+        Serializes stations of a snapshot.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+            positions (ndarray): The row positions of the stations.
+            response_format (str): 'json' for one array per column, 'geojson' for a FeatureCollection.
+            **extra (ndarray): Further per-station arrays, e.g. distance.
+
+        Returns:
+            dict: The document.
+        """
+    columns = station_properties(snapshot, positions)
+    columns.update({name: values.tolist() for name, values in extra.items()})
+    latitude, longitude = columns.pop('latitude'), columns.pop('longitude')
+    if response_format == 'geojson':
+        names = list(columns)
+        return {'type': 'FeatureCollection', 'system': snapshot.system, 'version': snapshot.version, 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [long, lat]},
+             'properties': dict(zip(names, values))}
+            for lat, long, *values in zip(latitude, longitude, *columns.values())]}
+    return dict(system=snapshot.system, version=snapshot.version, count=len(positions), latitude=latitude,
+                longitude=longitude, **columns)
+
+
+def route_document(snapshot, positions, legs, routes, estimated_seconds, response_format, polyline):
+    """
+        Serializes a trip.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot the stations were chosen from.
+            positions (ndarray): The row positions of the start and the end station.
+            legs (list): The find_route() arguments of the three legs.
+            routes (list): The (lat, long) coordinates of the three legs.
+            estimated_seconds (float): The estimated trip time.
+            response_format (str): 'json' or 'geojson'.
+            polyline (bool): Whether the legs of the json format are encoded polylines.
+
+        Returns:
+            dict: The document.
+        """
+    columns = station_properties(snapshot, positions)
+    start, end = ({name: values[row] for name, values in columns.items()} for row in range(2))
+    profiles = [leg[4] for leg in legs]
+    if response_format == 'geojson':
+        features = [{'type': 'Feature', 'geometry': {'type': 'LineString',
+                                                     'coordinates': route[:, ::-1].round(6).tolist()},
+                     'properties': {'leg': number, 'profile': profile}}
+                    for number, (profile, route) in enumerate(zip(profiles, routes))]
+        features += [{'type': 'Feature',
+                      'geometry': {'type': 'Point', 'coordinates': [station['longitude'], station['latitude']]},
+                      'properties': dict(station, role=role)} for role, station in (('start', start), ('end', end))]
+        return {'type': 'FeatureCollection', 'system': snapshot.system, 'version': snapshot.version,
+                'estimatedSeconds': round(estimated_seconds), 'features': features}
+
+    return {'system': snapshot.system, 'version': snapshot.version, 'estimatedSeconds': round(estimated_seconds),
+            'start': start, 'end': end,
+            'legs': [dict(profile=profile, **({'polyline': encode_polyline(route)} if polyline else
+                                              {'coordinates': route.round(6).tolist()}))
+                     for profile, route in zip(profiles, routes)]}
+
+
+def station_properties(snapshot, positions):
+    # api_columns, the position and the opening hours of stations as lists of plain values
+    frame = snapshot.frame
+    columns = {}
+    for name in api_columns:
+        values = frame[name].to_numpy()[positions]
+        if values.dtype.kind == 'O':
+            # missing text is null, not NaN
+            values = numpy.where(pandas.isna(values), None, values)
+        columns[name] = values.tolist()
+    columns['latitude'] = frame['latitude'].to_numpy()[positions].tolist()
+    columns['longitude'] = frame['longitude'].to_numpy()[positions].tolist()
+    typed = station_columns(snapshot)
+    columns['openTime'] = [format_minutes(minutes) for minutes in typed.open_minutes[positions].tolist()]
+    columns['closeTime'] = [format_minutes(minutes) for minutes in typed.close_minutes[positions].tolist()]
+    return columns
+
+
+def format_minutes(minutes):
+    # minutes after midnight as HH:MM, None if unknown
+    return f'{minutes // 60:02d}:{minutes % 60:02d}' if minutes >= 0 else None
+
+
+def query_station_filter(timezone=station_timezone):
+    # the station filter of the query parameters, opening hours in the time zone of the system
+    return StationFilter(min_bikes=query_int('min_bikes', 0), min_classic_bikes=query_int('min_classic_bikes', 0),
+                         min_smart_bikes=query_int('min_smart_bikes', 0),
+                         min_electric_bikes=query_int('min_electric_bikes', 0),
+                         min_docks=query_int('min_docks', 0), active=query_bool('active'),
+                         open_at=local_minutes(timezone=timezone) if query_bool('open_now') else None)
+
+
+def query_system(latitude=None, longitude=None):
+    # the system named by the query, else the one of the position, else the default system
+    name = request.args.get('system')
+    if name:
+        try:
+            return system_named(name)
+        except KeyError:
+            abort(404, f'unknown system {name}')
+    if latitude is not None and longitude is not None:
+        return system_for(latitude, longitude)
+    return system_named(None)
+
+
+def system_road_graph(system, app):
+    """
+        Returns the road network of the service areas of a system.
+
+        Args:
+            system (BikeSystem): The system.
+            app (Flask): The application, its road_graph_file extension is the network of the default system.
+
+        Returns:
+            str: The road graph file, None if the system has none.
+        """
+    if system.road_graph_file is not None:
+        return system.road_graph_file
+    return app.extensions['road_graph_file'] if system is system_named(None) else None
+
+
+def query_format():
+    response_format = request.args.get('format', 'json')
+    if response_format not in ('json', 'geojson'):
+        abort(400, 'format must be json or geojson')
+    return response_format
+
+
+def query_float(name):
+    try:
+        value = float(request.args[name])
+    except KeyError:
+        abort(400, f'{name} is required')
+    except ValueError:
+        abort(400, f'{name} must be a number')
+    if not numpy.isfinite(value):
+        abort(400, f'{name} must be a finite number')
+    return value
+
+
+def query_int(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        abort(400, f'{name} must be an integer')
+
+
+def query_bool(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,249 @@
+"""
+    Asynchronous entry point of the map viewer, for an ASGI server:
+
+        uvicorn asgi:app
+        gunicorn -c gunicorn.conf.py -k uvicorn_worker.UvicornWorker asgi:app
+
+    A route search (a POST of the search form with a destination) runs as a coroutine: the station choice and
+    the rendering run in a small thread pool, the three legs are requested from the routing service at the same
+    time and awaited with a timeout per leg. A request waiting for the routing service holds no thread, so one
+    worker keeps hundreds of route searches in flight. When the client disconnects, the legs still running are
+    cancelled. The change stream (/changes) is served on the event loop as well, so open pages hold no thread
+    either. Every other request is served by the Flask app of wsgi.py (loaded and warmed up the same way)
+    in a thread pool.
+"""
+import asyncio
+import urllib.parse
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from flask import render_template
+
+import metrics
+from main import change_keepalive, change_messages, change_retry, search_key, search_request, \
+    search_stations_async
+from routing import NoRouteError, RoutingError, create_async_client
+from systems import system_named
+from wsgi import app as flask_app
+
+# threads choosing the stations and rendering the maps of route searches, the work is CPU bound
+render_workers = 4
+# threads serving the Flask app
+wsgi_workers = 32
+# seconds between two checks of a change stream for a new snapshot
+change_poll_interval = 1.0
+# max size of a posted search form in bytes
+form_size_max = 64 * 1024
+
+render_executor = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix='render')
+wsgi_app = WSGIMiddleware(flask_app, workers=wsgi_workers)
+# clients of the routing service by event loop, a client can not be shared between loops
+routing_clients = weakref.WeakKeyDictionary()
+
+
+async def app(scope, receive, send):
+    """
+        The ASGI application: route searches on the event loop, everything else through the Flask app.
+        """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/' \
+            and content_type(scope) == 'application/x-www-form-urlencoded':
+        await search(scope, receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/changes':
+        await changes(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            client = routing_clients.pop(asyncio.get_running_loop(), None)
+            if client is not None:
+                await client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def search(scope, receive, send):
+    """
+        Serves a POST of the search form. Searches without a destination need no routing service and are
+        passed on to the Flask app.
+        """
+    body = await read_body(receive)
+    if body is None:
+        return
+    if metrics.server_timing:
+        metrics.start_request()
+    if len(body) > form_size_max:
+        await respond(send, 413, b'The form is too large.')
+        return
+    try:
+        # the system of the position, the parameters in its time zone
+        system, parameters = search_request(dict(urllib.parse.parse_qsl(body.decode('utf-8', 'replace'))))
+    except ValueError:
+        await respond(send, 400, b'Invalid number in the form.')
+        return
+    if not (parameters['dest_latitude'] and parameters['dest_longitude']):
+        await wsgi_app(scope, replay(body, receive), send)
+        return
+
+    loop = asyncio.get_running_loop()
+    # the snapshot of the system of the position; a snapshot reload parses the feed, keep it off the event loop
+    snapshot = await loop.run_in_executor(render_executor, system.store.get)
+
+    # identical requests on the same snapshot get the already rendered result
+    rendered_maps = flask_app.extensions['rendered_maps']
+    request_key = search_key(snapshot, parameters)
+    result = rendered_maps.get(request_key)
+    if result is None:
+        pipeline = asyncio.ensure_future(search_stations_async(
+            snapshot, client=routing_client(), backend=flask_app.extensions['route_backend'],
+            executor=render_executor, forecast=system.forecast, **parameters))
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        await asyncio.wait({pipeline, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        disconnect.cancel()
+        if not pipeline.done():
+            # nobody waits for the result anymore, cancel the legs still waiting for the routing service
+            pipeline.cancel()
+            return
+        try:
+            result = pipeline.result()
+        except asyncio.TimeoutError:
+            await respond(send, 504, b'The routing service did not answer in time.')
+            return
+        except (httpx.HTTPError, RoutingError):
+            await respond(send, 502, b'The routing service is not available.')
+            return
+        except NoRouteError:
+            await respond(send, 422, b'No route found between the chosen stations, try other positions.')
+            return
+        rendered_maps.put(request_key, result)
+
+    table_html, map_html = result
+    page = await loop.run_in_executor(render_executor, metrics.bound(render_page), parameters, table_html,
+                                      map_html, snapshot)
+    timing = metrics.server_timing_header()
+    await respond(send, 200, page.encode(), 'text/html; charset=utf-8',
+                  [(b'server-timing', timing.encode())] if timing else ())
+
+
+async def changes(scope, receive, send):
+    """
+        Serves the change stream of a system's snapshots without holding a thread: the store is checked for a
+        new feed file every change_poll_interval seconds in the render executor, the events are sent as they
+        come until the client disconnects.
+        """
+    query = dict(urllib.parse.parse_qsl(scope['query_string'].decode('latin-1')))
+    try:
+        store = system_named(query.get('system')).store
+    except KeyError:
+        await respond(send, 404, b'Unknown system.', endpoint='station_change_stream')
+        return
+    # clients resume after the last event they got, new clients start at the current snapshot
+    last_event = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1') or query.get('since')
+    if last_event and not last_event.isdigit():
+        await respond(send, 400, b'since must be a snapshot version', endpoint='station_change_stream')
+        return
+
+    loop = asyncio.get_running_loop()
+    version = int(last_event) if last_event else (await loop.run_in_executor(render_executor, store.get)).version
+    metrics.count('requests_total', endpoint='station_change_stream', status=200)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    await send({'type': 'http.response.body', 'body': f"retry: {change_retry}\n\n".encode(), 'more_body': True})
+
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    idle = 0.0
+    try:
+        while True:
+            await asyncio.wait({disconnect}, timeout=change_poll_interval)
+            if disconnect.done():
+                return
+            # reloads the snapshot if the feed file changed, publishing its diff
+            await loop.run_in_executor(render_executor, store.get)
+            diffs = store.changes.since(version, timeout=0)
+            if diffs:
+                messages, version = await loop.run_in_executor(render_executor, change_messages, diffs, version)
+                idle = 0.0
+            else:
+                idle += change_poll_interval
+                if idle < change_keepalive:
+                    continue
+                messages, idle = ": keep-alive\n\n", 0.0
+            await send({'type': 'http.response.body', 'body': messages.encode(), 'more_body': True})
+    finally:
+        disconnect.cancel()
+
+
+def routing_client():
+    # the client of the running event loop, created on first use
+    loop = asyncio.get_running_loop()
+    client = routing_clients.get(loop)
+    if client is None:
+        client = routing_clients[loop] = create_async_client()
+    return client
+
+
+def render_page(parameters, table_html, map_html, snapshot):
+    # the page around the map, the same template the Flask view renders
+    with flask_app.test_request_context('/', method='POST'), metrics.span('template_render'):
+        return render_template('index.html', latitude=parameters['latitude'], longitude=parameters['longitude'],
+                               search_bikes=parameters['search_bikes'], search_docks=parameters['search_docks'],
+                               df_html=table_html, map_html=map_html,
+                               snapshot_version=snapshot.version, system=snapshot.system)
+
+
+def content_type(scope):
+    # the media type of the request body, without parameters
+    for name, value in scope['headers']:
+        if name == b'content-type':
+            return value.split(b';')[0].strip().decode('latin-1').lower()
+    return None
+
+
+async def read_body(receive):
+    """
+        Reads the body of a request.
+
+        Returns:
+            bytes: The body, or None if the client disconnected before sending it.
+        """
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def replay(body, receive):
+    # a receive callable handing out the already read body first
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive_again():
+        return pending.pop() if pending else await receive()
+
+    return receive_again
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def respond(send, status, body, media_type='text/plain; charset=utf-8', headers=(), endpoint='index'):
+    metrics.count('requests_total', endpoint=endpoint, status=status)
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', media_type.encode()), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,132 @@
+"""
+    Benchmarks route searches against a routing service with a fixed latency per leg: the asynchronous pipeline
+    of asgi.py against the Flask view served by a fixed number of threads (gunicorn's gthread worker).
+
+    Searches arrive at a fixed rate, their latency is counted from their arrival. The routing service is a local
+    stand-in answering every leg with a straight line after `latency` seconds, every search uses new positions,
+    so no route comes from the cache.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_async_routes
+"""
+import asyncio
+import json
+import multiprocessing
+import socket
+import time
+import timeit
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy
+import uvicorn
+
+import functions
+import routing
+
+# port of the stand-in routing service
+fake_ors_port = 8799
+
+
+def fake_ors(latency):
+    # ASGI app answering /{profile}?start=long,lat&end=long,lat with a two point GeoJSON route
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        query = urllib.parse.parse_qs(scope['query_string'].decode())
+        start = [float(value) for value in query['start'][0].split(',')]
+        end = [float(value) for value in query['end'][0].split(',')]
+        await asyncio.sleep(latency)
+        body = json.dumps({'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [start, end]}}]}).encode()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/geo+json')]})
+        await send({'type': 'http.response.body', 'body': body})
+    return app
+
+
+def serve_fake_ors(latency):
+    uvicorn.run(fake_ors(latency), port=fake_ors_port, log_level='warning', backlog=4096)
+
+
+def start_fake_ors(latency):
+    # a process of its own, so the stand-in does not compete with the searches for the interpreter
+    server = multiprocessing.Process(target=serve_fake_ors, args=(latency,), daemon=True)
+    server.start()
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', fake_ors_port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+
+
+def route_forms(count, seed):
+    # searches between random positions in downtown Los Angeles
+    rng = numpy.random.default_rng(seed)
+    positions = rng.normal([34.05, -118.25, 34.05, -118.25], 0.02, (count, 4))
+    return [{'latitude': f'{s_lat:.5f}', 'longitude': f'{s_long:.5f}', 'destLat': f'{d_lat:.5f}',
+             'destLong': f'{d_long:.5f}', 'rankings': '5'} for s_lat, s_long, d_lat, d_long in positions]
+
+
+def report(name, latencies, elapsed, errors):
+    latencies = numpy.asarray(latencies) * 1000
+    p50, p99 = numpy.percentile(latencies, [50, 99])
+    print(f"    {name:28s} {len(latencies) / elapsed:7.1f} searches/s   p50 {p50:7.0f} ms   p99 {p99:7.0f} ms   "
+          f"{errors} errors")
+
+
+def run_threads(flask_app, forms, rate, threads):
+    # the Flask view, each thread serving one search at a time, the others wait in the queue
+    client = flask_app.test_client()
+
+    def post(form, arrival):
+        status = client.post('/', data=form).status_code
+        return timeit.default_timer() - arrival, status != 200
+
+    start = timeit.default_timer()
+    futures = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for number, form in enumerate(forms):
+            time.sleep(max(start + number / rate - timeit.default_timer(), 0))
+            futures.append(executor.submit(post, form, timeit.default_timer()))
+        results = [future.result() for future in futures]
+    report(f"flask, {threads} threads", [latency for latency, _ in results], timeit.default_timer() - start,
+           sum(error for _, error in results))
+
+
+async def run_async(asgi_app, forms, rate):
+    # the asynchronous pipeline, every search in flight as soon as it arrives
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+        async def post(form, arrival):
+            status = (await client.post('/', data=form)).status_code
+            return timeit.default_timer() - arrival, status != 200
+
+        start = timeit.default_timer()
+        tasks = []
+        for number, form in enumerate(forms):
+            await asyncio.sleep(max(start + number / rate - timeit.default_timer(), 0))
+            tasks.append(asyncio.ensure_future(post(form, timeit.default_timer())))
+        results = await asyncio.gather(*tasks)
+    report("asgi", [latency for latency, _ in results], timeit.default_timer() - start,
+           sum(error for _, error in results))
+
+
+def main(searches=160, rate=8.0, latency=1.0, threads=8):
+    # route the ORS backend to the stand-in, keep the archived sample routes untouched
+    functions.ors_directions_url = f'http://127.0.0.1:{fake_ors_port}'
+    functions.archive_routes = False
+    routing.route_cache.folder = None
+    server = start_fake_ors(latency)
+
+    import asgi
+    print(f"{searches} route searches arriving at {rate:.0f}/s, routing service latency {latency:.1f} s per leg")
+    run_threads(asgi.flask_app, route_forms(searches, seed=1), rate, threads)
+    asyncio.run(run_async(asgi.app, route_forms(searches, seed=2), rate))
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+    Benchmarks the typed station columns: memory of the columns against the GeoDataFrame and the availability
+    filters of the form as boolean masks against the select_bikes()/select_docks() copies.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_columnar
+"""
+import timeit
+
+import numpy
+
+from benchmarks.synthetic import sample_stations, synthetic_stations
+from columns import StationColumns
+from functions import select_bikes, select_docks
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def run(label, stations, drop_numbers=2, repeat=20):
+    build = median_ms(lambda: StationColumns.from_frame(stations), 3)
+    columns = StationColumns.from_frame(stations)
+
+    frame_bytes = stations.memory_usage(deep=True).sum()
+    # the typed columns share the strings with the frame, count the numeric arrays and the pointers
+    columns_bytes = columns.nbytes()
+
+    copies = median_ms(lambda: select_docks(select_bikes(stations, drop_numbers), drop_numbers), repeat)
+    masks = median_ms(lambda: columns.bikes_mask(drop_numbers) & columns.docks_mask(drop_numbers), repeat)
+
+    expected = select_docks(select_bikes(stations, drop_numbers), drop_numbers)
+    mask = columns.bikes_mask(drop_numbers) & columns.docks_mask(drop_numbers)
+    assert numpy.array_equal(stations.index[mask], expected.index)
+
+    print(f"{label}: {len(stations)} stations, columns build {build:.2f} ms")
+    print(f"    memory    frame {frame_bytes / 2 ** 20:9.2f} MiB   columns {columns_bytes / 2 ** 20:7.2f} MiB   "
+          f"x{frame_bytes / columns_bytes:.1f}")
+    print(f"    filter    copies {copies:8.3f} ms   masks {masks:9.3f} ms   x{copies / masks:.1f}")
+
+
+def main():
+    run('bundled feed', sample_stations())
+    run('synthetic city', synthetic_stations(1_000_000), repeat=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+    Benchmarks the station filters: chained pandas copies like select_bikes()/select_docks() against the fused
+    mask scan and the availability index of StationFilter, for filters of growing selectivity.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_filters
+"""
+import timeit
+
+import numpy
+
+from benchmarks.synthetic import sample_stations, synthetic_stations
+from columns import StationColumns
+from filters import AvailabilityIndex, StationFilter
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def chained_copies(stations, station_filter):
+    # one threshold comparison and one copied frame per condition, the way select_bikes()/select_docks() chain
+    for attribute, minimum in station_filter.thresholds.items():
+        if minimum > 0:
+            column = StationColumns.count_columns[attribute]
+            stations = stations.drop(stations[stations[column] < minimum].index)
+    if station_filter.active:
+        stations = stations.drop(stations[stations['kioskPublicStatus'] != 'Active'].index)
+    return stations
+
+
+def run(label, stations, repeat=20):
+    columns = StationColumns.from_frame(stations)
+    build = median_ms(lambda: AvailabilityIndex(columns), 3)
+    availability = AvailabilityIndex(columns)
+
+    print(f"{label}: {len(stations)} stations, availability index build {build:.2f} ms")
+    queries = [
+        ('bikes and docks', StationFilter(min_bikes=2, min_docks=2)),
+        ('active, 3 electric', StationFilter(min_electric_bikes=3, active=True)),
+        ('15 classic, 10 docks', StationFilter(min_classic_bikes=15, min_docks=10, active=True)),
+    ]
+    for name, station_filter in queries:
+        expected = chained_copies(stations, station_filter)
+        assert numpy.array_equal(stations.index[station_filter.evaluate(columns, availability)], expected.index)
+
+        copies = median_ms(lambda: chained_copies(stations, station_filter), repeat)
+        fused = median_ms(lambda: station_filter.evaluate(columns), repeat)
+        indexed = median_ms(lambda: station_filter.evaluate(columns, availability), repeat)
+        print(f"    {name:22} {len(expected) / len(stations):6.1%} kept   copies {copies:8.3f} ms   "
+              f"fused {fused:7.3f} ms   indexed {indexed:7.3f} ms   x{copies / indexed:.0f}")
+
+
+def main():
+    run('bundled feed', sample_stations())
+    run('synthetic city', synthetic_stations(1_000_000), repeat=5)
+
+
+if __name__ == '__main__':
+    main()
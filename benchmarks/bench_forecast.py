@@ -0,0 +1,93 @@
+"""
+    Benchmarks the availability forecast on synthetic history: training time, inference throughput, the
+    latency of the per-request prediction of choose_station_pair() and the error against keeping the current
+    counts.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_forecast
+"""
+import os
+import tempfile
+import timeit
+
+import numpy
+
+from forecast import AvailabilityForecast, forecast_columns
+from history import AvailabilityHistory, history_columns
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def synthetic_history(stations, days, interval=60, seed=0, start=1_767_600_000):
+    # a daily cycle with a random phase and size per station, plus autocorrelated noise
+    rng = numpy.random.default_rng(seed)
+    times = start + numpy.arange(days * 24 * 3600 // interval) * interval
+    phase = rng.uniform(0, 2 * numpy.pi, stations)
+    size = rng.uniform(2, 8, stations)
+    capacity = rng.integers(12, 30, stations)
+    cycle = numpy.sin(2 * numpy.pi * times[:, None] / 86400 + phase[None, :]) * size[None, :]
+    noise = numpy.zeros((len(times), stations))
+    shocks = rng.normal(0, 0.6, (len(times), stations))
+    for poll in range(1, len(times)):
+        noise[poll] = 0.97 * noise[poll - 1] + shocks[poll]
+    bikes = numpy.clip(numpy.round(capacity / 2 + cycle + noise), 0, capacity).astype(numpy.int16)
+    return times, numpy.arange(3000, 3000 + stations), {'bikes': bikes, 'docks': (capacity - bikes)
+                                                        .astype(numpy.int16)}
+
+
+def run(stations, days, repeat=5):
+    times, kiosk_ids, counts = synthetic_history(stations, days)
+    train_polls = len(times) - 1440
+
+    with tempfile.TemporaryDirectory() as folder:
+        history = AvailabilityHistory(os.path.join(folder, 'history'))
+        for poll in range(train_polls):
+            history.append(int(times[poll]), kiosk_ids, {column: counts[column if column in counts else 'bikes']
+                                                         [poll] for column in history_columns})
+        now = times[train_polls - 1]
+        load = median_ms(lambda: history.matrix(forecast_columns, kiosk_ids, now - days * 86400, now + 1), repeat)
+        train = median_ms(lambda: AvailabilityForecast.from_history(history, now=now), repeat)
+        model = AvailabilityForecast.from_history(history, now=now)
+
+    # per request: 5 start stations after the walk, 5 x 5 end stations after the ride
+    starts, ends = kiosk_ids[:5], kiosk_ids[5:10]
+    walk, ride = numpy.full(5, 400.0), numpy.full((5, 5), 900.0)
+    request = median_ms(lambda: (model.predict('bikes', starts, numpy.ones(5), walk, now),
+                                 model.predict('docks', ends[None, :], numpy.ones((1, 5)), walk[:, None] + ride,
+                                               now)), 50)
+    batch = median_ms(lambda: model.predict('bikes', kiosk_ids, counts['bikes'][train_polls - 1], 1800, now), repeat)
+
+    print(f"{stations} stations, {days} days of minute polls ({train_polls * stations / 1e6:.1f}M counts)")
+    print(f"    training    history load {load:8.1f} ms   fit {train - load:8.1f} ms")
+    print(f"    inference   per request {request:6.3f} ms   all stations {batch:6.3f} ms   "
+          f"{stations / batch * 1000 / 1e6:.2f}M predictions/s")
+
+    # error on the held-out last day, forecasting from every poll of it
+    for minutes in (15, 30, 60):
+        steps = minutes
+        origins = numpy.arange(train_polls, len(times) - steps, 30)
+        model_error = persistence_error = 0.0
+        for origin in origins:
+            actual = counts['bikes'][origin + steps]
+            current = counts['bikes'][origin]
+            predicted = model.predict('bikes', kiosk_ids, current, steps * 60.0, times[origin])
+            model_error += numpy.abs(predicted - actual).mean()
+            persistence_error += numpy.abs(current - actual).mean()
+        print(f"    {minutes:3d} min ahead   mean abs error   forecast {model_error / len(origins):5.2f}   "
+              f"current counts {persistence_error / len(origins):5.2f} bikes")
+
+
+def main():
+    run(stations=223, days=28)
+    run(stations=2000, days=14)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+    Benchmarks the availability history: appending polls and querying one station or one time window, against
+    an appended CSV log read back with pandas.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_history
+"""
+import os
+import tempfile
+import timeit
+
+import numpy
+import pandas
+
+from history import AvailabilityHistory, history_columns
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def synthetic_polls(stations, polls, seed=0, start=1_700_000_000, interval=60):
+    # counts of every poll, a random walk per station
+    rng = numpy.random.default_rng(seed)
+    kiosk_ids = numpy.arange(3000, 3000 + stations)
+    counts = {column: numpy.clip(rng.integers(0, 20, stations) + rng.integers(-1, 2, (polls, stations))
+                                 .cumsum(axis=0), 0, 40).astype(numpy.int16)
+              for column in history_columns}
+    return kiosk_ids, [start + poll * interval for poll in range(polls)], counts
+
+
+def run(stations, polls, csv_polls, repeat=5):
+    kiosk_ids, times, counts = synthetic_polls(stations, polls)
+    with tempfile.TemporaryDirectory() as folder:
+        history = AvailabilityHistory(os.path.join(folder, 'history'))
+        start = timeit.default_timer()
+        for poll, timestamp in enumerate(times):
+            history.append(timestamp, kiosk_ids, {column: values[poll] for column, values in counts.items()})
+        append = (timeit.default_timer() - start) / polls * 1000
+
+        csv_file = os.path.join(folder, 'history.csv')
+        start = timeit.default_timer()
+        for poll, timestamp in enumerate(times[:csv_polls]):
+            frame = pandas.DataFrame({'time': timestamp, 'kioskId': kiosk_ids,
+                                      **{column: values[poll] for column, values in counts.items()}})
+            frame.to_csv(csv_file, mode='a', header=poll == 0, index=False)
+        csv_append = (timeit.default_timer() - start) / csv_polls * 1000
+
+        kiosk_id, day = kiosk_ids[stations // 2], 24 * 3600
+        station = median_ms(lambda: history.station(kiosk_id), repeat)
+        station_day = median_ms(lambda: history.station(kiosk_id, times[-1] - day, times[-1]), repeat)
+        hour = median_ms(lambda: history.window(times[-1] - 3600, times[-1]), repeat)
+        csv_station = median_ms(lambda: (lambda log: log[log['kioskId'] == kiosk_id])(pandas.read_csv(csv_file)),
+                                repeat)
+
+        recorded = history.station(kiosk_id)
+        assert numpy.array_equal(recorded['bikes'], counts['bikes'][:, stations // 2])
+        assert len(history.window(times[-1] - 3600, times[-1])) == 60 * stations
+
+        stats = history.stats()
+        print(f"{stations} stations, {polls} polls ({polls // 1440} days of minute polls), "
+              f"{stats['bytes'] / 2 ** 20:.1f} MiB, csv {os.path.getsize(csv_file) / csv_polls * polls / 2 ** 20:.1f}"
+              f" MiB (extrapolated)")
+        print(f"    append per poll    history {append:8.3f} ms   csv {csv_append:8.3f} ms")
+        print(f"    one station        all {station:8.3f} ms   last day {station_day:8.3f} ms   "
+              f"csv ({csv_polls} polls only) {csv_station:8.2f} ms")
+        print(f"    all stations       last hour {hour:8.3f} ms")
+
+
+def main():
+    run(stations=223, polls=30 * 1440, csv_polls=1440)
+    run(stations=2000, polls=7 * 1440, csv_polls=300)
+
+
+if __name__ == '__main__':
+    main()
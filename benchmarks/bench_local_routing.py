@@ -0,0 +1,74 @@
+"""
+    Benchmarks the local routing engine on the bundled test graph (routes/test_graph.geojson) and on a
+    synthetic city-sized grid, next to a round trip to a local OpenRouteService stand-in.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_local_routing
+"""
+import json
+import os
+import tempfile
+import timeit
+
+import numpy
+
+import functions
+from benchmarks.fake_servers import FakeORSServer, routes_folder
+from benchmarks.synthetic import grid_road_network
+from local_routing import LocalBackend, load_road_graph
+
+test_graph_file = os.path.join(routes_folder, 'test_graph.geojson')
+
+
+def random_legs(graph, n, seed=0):
+    rng = numpy.random.default_rng(seed)
+    low, high = graph.lonlat.min(axis=0), graph.lonlat.max(axis=0)
+    points = rng.uniform(low, high, size=(n, 2, 2))
+    return [(a[1], a[0], b[1], b[0]) for a, b in points]
+
+
+def time_backend(backend, legs, profile):
+    timings = []
+    for leg in legs:
+        start = timeit.default_timer()
+        backend.route(*leg, profile)
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000, numpy.percentile(timings, 99) * 1000
+
+
+def report(label, path, n=50):
+    start = timeit.default_timer()
+    graph = load_road_graph(path)
+    load = (timeit.default_timer() - start) * 1000
+    backend = LocalBackend(graph)
+    legs = random_legs(graph, n)
+    print(f"{label}: {len(graph)} nodes, {len(graph.indices)} edges, load {load:.1f} ms")
+    for profile in (functions.by_foot, functions.by_bike):
+        median, p99 = time_backend(backend, legs, profile)
+        print(f"    {profile:<16} median {median:7.2f} ms   p99 {p99:7.2f} ms")
+    return legs
+
+
+def main():
+    legs = report('bundled test graph', test_graph_file)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'grid.geojson')
+        with open(path, 'w') as file:
+            json.dump(grid_road_network(150, 150, spacing=120.0), file)
+        report('synthetic city grid (parse)', path, n=20)
+        report('synthetic city grid (cached)', path, n=20)
+
+    # remote backend against a local stand-in with 50 ms latency, without the route cache
+    with FakeORSServer(latency=0.05) as server:
+        ors_directions_url, archive_routes = functions.ors_directions_url, functions.archive_routes
+        functions.ors_directions_url, functions.archive_routes = server.url, False
+        try:
+            median, p99 = time_backend(functions.ORSBackend(), legs[:10], functions.by_foot)
+        finally:
+            functions.ors_directions_url, functions.archive_routes = ors_directions_url, archive_routes
+    print(f"remote backend (50 ms latency)   median {median:7.2f} ms   p99 {p99:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
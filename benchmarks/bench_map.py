@@ -0,0 +1,114 @@
+"""
+    Benchmarks the per-request map render: the former full folium rebuild against the cached station layer.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_map
+"""
+import timeit
+
+import folium
+import numpy
+
+import functions
+from benchmarks.synthetic import sample_stations
+from snapshot import StationSnapshot
+from spatial import StationIndex
+
+
+def icon_color(row, df_nearest):
+    """
+        Determines the color and icon for a station marker based on its status and availability, one row at a time.
+
+        The former per-row implementation of functions.station_styles(), kept as its reference.
+
+        Args:
+            row (Series): The row containing station information.
+            df_nearest (DataFrame): The dataframe containing the nearest stations.
+
+        Returns:
+            color (str): The color for the station marker.
+            icon (str): The icon for the station marker.
+        """
+    # station is active and has enough available bikes and docks
+    if 'Active' in row['kioskPublicStatus'] and int(row['bikesAvailable']) > 5 and int(row['docksAvailable']) > 5:
+        # the nearest stations are highlighted
+        if row['kioskId'] in df_nearest['kioskId'].values:
+            color = 'darkgreen'
+        else:
+            color = 'green'
+        icon = 'bicycle'
+
+    # station is active and has some bikes and docks
+    elif 'Active' in row['kioskPublicStatus'] and int(row['bikesAvailable']) >= 2 and int(
+            row['docksAvailable']) >= 2:
+        # the nearest stations are highlighted
+        if row['kioskId'] in df_nearest['kioskId'].values:
+            color = 'darkblue'
+        else:
+            color = 'blue'
+        icon = 'bicycle'
+
+    # Station is unavailable or active but has low or no availability of bikes and docks
+    elif 'Unavailable' in row['kioskPublicStatus'] or 'Active' in row['kioskPublicStatus']:
+        # the nearest stations are highlighted
+        if row['kioskId'] in df_nearest['kioskId'].values:
+            color = 'darkred'
+        else:
+            color = 'red'
+        icon = 'bicycle'
+
+    # anything else, (error handling)
+    else:
+        color = 'gray'
+        icon = 'magnifying-glass'
+
+    return color, icon
+
+
+def legacy_map(dataframe, poslat, poslong, k_nearest, index):
+    # the implementation before the cached layer: one marker object per station and request
+    m = folium.Map(location=[poslat, poslong], zoom_start=15, control_scale=True, crs='EPSG3857')
+    folium.Marker(location=[poslat, poslong], tooltip='My Position',
+                  icon=folium.Icon(color='black', icon="user")).add_to(m)
+    df_nearest = functions.get_nearest_dataframe(dataframe, poslong, poslat, k_nearest, index)
+    for idx, row in dataframe.iterrows():
+        long, lat = row['geometry'].x, row['geometry'].y
+        color, icon = icon_color(row, df_nearest)
+        functions.create_markers(row, lat, long, color, icon).add_to(m)
+    m.add_child(folium.ClickForLatLng())
+    return m.get_root().render()
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def main(repeat=10):
+    stations = sample_stations()
+    snapshot = StationSnapshot(1, stations)
+    index = StationIndex.from_frame(stations)
+    lat, long = 34.05, -118.25
+
+    def render(snapshot=None):
+        df_nearest, m = functions.create_local_html_map(stations, lat, long, 5, index=index, snapshot=snapshot)
+        return functions.render_map(m)
+
+    legacy = median_ms(lambda: legacy_map(stations, lat, long, 5, index), repeat)
+    uncached = median_ms(lambda: render(), repeat)
+    first = median_ms(lambda: render(StationSnapshot(1, stations)), 1)
+    cached = median_ms(lambda: render(snapshot), repeat)
+
+    print(f"{len(stations)} stations, per request map render")
+    print(f"    legacy rebuild          {legacy:8.2f} ms")
+    print(f"    layer rendered per call {uncached:8.2f} ms")
+    print(f"    first call of snapshot  {first:8.2f} ms")
+    print(f"    cached station layer    {cached:8.2f} ms   x{legacy / cached:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+    Benchmarks the feed refresh path against a local fake feed server.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_refresh
+"""
+import contextlib
+import io
+import os
+import tempfile
+import timeit
+
+import functions
+from benchmarks.fake_servers import FakeFeedServer
+from benchmarks.synthetic import sample_feed_payload, sample_stations
+from snapshot import SnapshotStore
+
+
+def reset_validators():
+    for key in functions.feed_validators:
+        functions.feed_validators[key] = None
+
+
+def time_refresh(label, server, data_file, store, change_payload=None, n=20):
+    timings = []
+    for i in range(n):
+        if change_payload is not None:
+            server.set_payload(change_payload(i))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = timeit.default_timer()
+            functions.get_GeoJSON(url=server.url, data_file=data_file, store=store)
+            timings.append(timeit.default_timer() - start)
+    timings.sort()
+    print(f"{label:<32} median {timings[len(timings) // 2] * 1000:8.2f} ms   "
+          f"max {timings[-1] * 1000:8.2f} ms")
+
+
+def main():
+    stations = sample_stations()
+    payload = sample_feed_payload(stations)
+
+    with tempfile.TemporaryDirectory() as folder, FakeFeedServer(payload) as server:
+        data_file = os.path.join(folder, 'geo_data.json')
+        store = SnapshotStore(data_file)
+        reset_validators()
+        functions.get_GeoJSON(url=server.url, data_file=data_file, store=store)
+
+        # 304 answered by the server
+        time_refresh('not modified (304)', server, data_file, store)
+
+        # server without validators: the body is downloaded but its hash matches
+        server.validators = False
+        time_refresh('unchanged payload (hash)', server, data_file, store)
+
+        # every poll carries new counts: write, swap and parse
+        def changed(i):
+            stations['bikesAvailable'] = (stations['bikesAvailable'] + 1) % 20
+            return sample_feed_payload(stations)
+
+        time_refresh('changed payload (parse)', server, data_file, store, changed)
+        print(f"server requests: {server.requests}, not modified: {server.not_modified}, "
+              f"store: {store.stats()}")
+        reset_validators()
+
+
+if __name__ == '__main__':
+    main()
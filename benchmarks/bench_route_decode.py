@@ -0,0 +1,52 @@
+"""
+    Microbenchmark of route decoding on the bundled samples (routes/geo_data_route_*.json): the former
+    parse / write / re-read / parse round trip against decode_route_coordinates().
+
+    Run from the repository root with:
+        python -m benchmarks.bench_route_decode
+"""
+import json
+import os
+import tempfile
+import timeit
+
+import numpy
+
+from benchmarks.fake_servers import routes_folder
+from routing import decode_route_coordinates
+
+
+def legacy_decode(text, data_file):
+    # the implementation before the decoder: two full parses and one write per leg
+    data = json.loads(text)
+    with open(data_file, "w") as file:
+        json.dump(data, file)
+    with open(data_file, 'r') as f:
+        geojson_data = json.load(f)
+    coordinates = geojson_data['features'][0]['geometry']['coordinates']
+    return [(coord[1], coord[0]) for coord in coordinates]
+
+
+def median_us(func, repeat):
+    timings = timeit.repeat(func, number=1, repeat=repeat)
+    return numpy.median(timings) * 1e6
+
+
+def main(repeat=500):
+    with tempfile.TemporaryDirectory() as folder:
+        for profile in ('foot-walking', 'cycling-regular'):
+            with open(os.path.join(routes_folder, f'geo_data_route_{profile}.json'), 'rb') as file:
+                payload = file.read()
+            data_file = os.path.join(folder, f'geo_data_route_{profile}.json')
+
+            expected = numpy.asarray(legacy_decode(payload.decode(), data_file))
+            assert numpy.array_equal(decode_route_coordinates(payload), expected)
+
+            legacy = median_us(lambda: legacy_decode(payload.decode(), data_file), repeat)
+            decoded = median_us(lambda: decode_route_coordinates(payload), repeat)
+            print(f"{profile:<16} {len(payload):6d} bytes, {len(expected):4d} points   "
+                  f"legacy {legacy:8.1f} us   decoder {decoded:7.1f} us   x{legacy / decoded:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+    Benchmarks full_route() against a local stand-in of the OpenRouteService API with simulated latency:
+    sequential uncached legs as before, concurrent legs over pooled connections, and cached legs.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_routing
+"""
+import contextlib
+import io
+import tempfile
+import timeit
+
+import numpy
+import requests
+
+import functions
+from benchmarks.fake_servers import FakeORSServer
+from benchmarks.synthetic import sample_stations
+from spatial import StationIndex
+
+
+def sequential_route(df, s_lat, s_long, d_lat, d_long, index):
+    # the implementation before the route cache: three blocking requests without connection reuse
+    df = functions.select_docks(functions.select_bikes(df, 1), 1)
+    start = functions.get_nearest_dataframe(df, s_long, s_lat, 1, index)
+    end = functions.get_nearest_dataframe(df, d_long, d_lat, 1, index)
+    legs = [(s_lat, s_long, start['latitude'].item(), start['longitude'].item(), functions.by_foot),
+            (start['latitude'].item(), start['longitude'].item(), end['latitude'].item(), end['longitude'].item(),
+             functions.by_bike),
+            (end['latitude'].item(), end['longitude'].item(), d_lat, d_long, functions.by_foot)]
+    for s_la, s_lo, d_la, d_lo, travel_type in legs:
+        requests.get(f'{functions.ors_directions_url}/{travel_type}?api_key=x&start={s_lo},{s_la}&end={d_lo},{d_la}')
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def main(latency=0.05, repeat=10):
+    stations = sample_stations()
+    index = StationIndex.from_frame(stations)
+    rng = numpy.random.default_rng(0)
+    trips = [tuple(rng.normal((34.05, -118.25, 34.05, -118.25), 0.02)) for _ in range(repeat)]
+
+    ors_directions_url = functions.ors_directions_url
+    with FakeORSServer(latency) as server, tempfile.TemporaryDirectory() as folder, \
+            contextlib.redirect_stdout(io.StringIO()):
+        functions.ors_directions_url = server.url
+        try:
+            route_cache, cache_folder = functions.route_cache, functions.route_cache.folder
+            sequential = median_ms(lambda: sequential_route(stations, *trips[0], index), repeat)
+
+            def concurrent_uncached():
+                route_cache.memory.clear()
+                functions.full_route(stations, *trips[0], index)
+
+            # keep the benchmark routes out of the on-disk cache of the app
+            route_cache.folder = None
+            concurrent = median_ms(concurrent_uncached, repeat)
+
+            route_cache.folder = folder
+            route_cache.memory.clear()
+            requests_before = server.requests
+            cached = median_ms(lambda: functions.full_route(stations, *trips[0], index), repeat)
+            cached_requests = server.requests - requests_before
+        finally:
+            functions.ors_directions_url = ors_directions_url
+            route_cache.memory.clear()
+            route_cache.folder = cache_folder
+
+    print(f"full route with {latency * 1000:.0f} ms routing latency per leg")
+    print(f"    sequential, uncached    {sequential:8.2f} ms")
+    print(f"    concurrent, pooled      {concurrent:8.2f} ms")
+    print(f"    cached                  {cached:8.2f} ms   ({cached_requests} routing requests)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+    Benchmarks "stations within 5 minutes' walk" of a position: the grid lookup of the precomputed service areas
+    against a network search from the position and against routing every station within the straight-line
+    distance, the way per-pair routing service requests would. Also times building the service areas in this
+    process and in the process pool, and loading them from the disk cache.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_service_areas
+"""
+import json
+import os
+import tempfile
+import timeit
+
+import numpy
+
+import service_areas
+from benchmarks.synthetic import grid_road_network, synthetic_stations
+from spatial import StationIndex, project_points
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def network_search(graph, station_nodes, lat, long, max_distance):
+    # one Dijkstra from the position's nearest node, then the stations on reached nodes
+    distances = graph.travel_distances(graph.nearest_node(lat, long), 'foot-walking', max_distance)
+    return [position for position, node in enumerate(station_nodes) if node in distances]
+
+
+def pair_routing(graph, index, lonlat, lat, long, max_distance):
+    # a route to every station within the straight-line distance, the way per-pair requests would answer it
+    x, y = project_points(lat, long)
+    # projected units per meter (Web Mercator)
+    candidates, _ = index.query_radius(float(x), float(y), max_distance / numpy.cos(numpy.radians(lat)))
+    reachable = []
+    for position in candidates:
+        try:
+            _, length = graph.route(lat, long, lonlat[position, 1], lonlat[position, 0], 'foot-walking')
+        except ValueError:
+            continue
+        if length <= max_distance:
+            reachable.append(position)
+    return reachable
+
+
+def main(size=120, stations=4000, repeat=50, minutes=5):
+    with tempfile.TemporaryDirectory() as folder:
+        graph_file = os.path.join(folder, 'grid.geojson')
+        with open(graph_file, 'w') as file:
+            json.dump(grid_road_network(size, size), file)
+        graph, reversed_graph = service_areas.road_graph(graph_file)
+        frame = synthetic_stations(stations, spread=0.03)
+        lonlat = frame[['longitude', 'latitude']].to_numpy(dtype=numpy.float64)
+
+        build = median_ms(lambda: service_areas.load_service_areas(graph_file, lonlat, 'foot-walking',
+                                                                   folder=None, workers=1), 1)
+        workers = max(service_areas.service_area_workers, 2)
+        pooled = median_ms(lambda: service_areas.load_service_areas(graph_file, lonlat, 'foot-walking',
+                                                                    folder=None, workers=workers), 1)
+        service_areas.load_service_areas(graph_file, lonlat, 'foot-walking', folder=folder)
+        cached = median_ms(lambda: service_areas.load_service_areas(graph_file, lonlat, 'foot-walking',
+                                                                    folder=folder), repeat)
+        areas = service_areas.load_service_areas(graph_file, lonlat, 'foot-walking', folder=folder)
+
+        rng = numpy.random.default_rng(0)
+        positions = iter(rng.normal((34.05, -118.24), 0.02, (3 * repeat, 2)).tolist())
+        max_distance = minutes * 60 * service_areas.profile_speeds['foot-walking']
+        station_nodes = [int(node) for node in graph.tree.query(numpy.column_stack(
+            project_points(lonlat[:, 1], lonlat[:, 0])))[1]]
+        index = StationIndex.from_frame(frame)
+        lookup = median_ms(lambda: areas.reachable(*next(positions), minutes), repeat)
+        search = median_ms(lambda: network_search(graph, station_nodes, *next(positions), max_distance), repeat)
+        pairs = median_ms(lambda: pair_routing(graph, index, lonlat, *next(positions), max_distance),
+                          max(repeat // 10, 1))
+
+    print(f"{len(graph)} node road grid, {stations} stations, {areas.shape[0]} x {areas.shape[1]} cells, "
+          f"{len(areas)} station entries")
+    print(f"    build, 1 process            {build:10.1f} ms")
+    print(f"    build, pool of {workers} processes  {pooled:10.1f} ms")
+    print(f"    load from disk cache        {cached:10.1f} ms")
+    print(f"stations within {minutes} minutes' walk")
+    print(f"    routing every candidate     {pairs:10.3f} ms")
+    print(f"    network search              {search:10.3f} ms")
+    print(f"    grid lookup                 {lookup:10.3f} ms   x{search / lookup:.0f} / x{pairs / lookup:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+    Benchmarks a feed refresh changing a handful of stations: rebuilding the derived structures of the new
+    snapshot against diffing it and updating them for the changed stations only.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_snapshot_diff
+"""
+import timeit
+
+import numpy
+
+from benchmarks.synthetic import sample_stations, synthetic_stations
+from columns import StationColumns
+from functions import marker_fragments, render_station_layer
+from snapshot import diff_frames
+from spatial import StationIndex
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def refreshed(stations, changes, seed=0):
+    # the next poll of the feed: a few stations got or lost some bikes
+    rng = numpy.random.default_rng(seed)
+    stations = stations.copy()
+    rows = rng.choice(len(stations), changes, replace=False)
+    column = stations.columns.get_loc('bikesAvailable')
+    stations.iloc[rows, column] = stations.iloc[rows, column] + 1
+    return stations
+
+
+def run(label, stations, changes=10, repeat=5, layer=False):
+    new = refreshed(stations, changes)
+    columns = StationColumns.from_frame(stations)
+
+    diff = median_ms(lambda: diff_frames(stations, new), repeat)
+    changed = diff_frames(stations, new)
+    assert changed.same_layout and len(changed.changed) == changes
+
+    index_build = median_ms(lambda: StationIndex.from_frame(new), repeat)
+    columns_build = median_ms(lambda: StationColumns.from_frame(new), repeat)
+    columns_patch = median_ms(lambda: columns.patched(new, changed.positions), repeat)
+    assert numpy.array_equal(columns.patched(new, changed.positions).bikes, StationColumns.from_frame(new).bikes)
+
+    print(f"{label}: {len(stations)} stations, {changes} changed, diff {diff:.2f} ms")
+    print(f"    spatial index   rebuild {index_build:9.2f} ms   kept")
+    print(f"    columns         rebuild {columns_build:9.2f} ms   patched {columns_patch:8.2f} ms")
+
+    if layer:
+        marker_fragments.clear()
+        cold = median_ms(lambda: (marker_fragments.clear(), render_station_layer(stations)), 3)
+        render_station_layer(stations)
+        warm = median_ms(lambda: render_station_layer(new), repeat)
+        print(f"    station layer   rebuild {cold:9.2f} ms   changed markers only {warm:8.2f} ms")
+
+
+def main():
+    run('bundled feed', sample_stations(), layer=True)
+    run('synthetic city', synthetic_stations(1_000_000))
+
+
+if __name__ == '__main__':
+    main()
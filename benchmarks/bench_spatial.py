@@ -0,0 +1,67 @@
+"""
+    Benchmarks the nearest station search: the former full sort per call against the prebuilt StationIndex.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_spatial
+"""
+import timeit
+
+import geopandas
+import numpy
+from shapely.geometry import Point
+
+from benchmarks.synthetic import sample_stations, synthetic_stations
+from functions import crs_map_format, crs_routing_format, get_nearest_dataframe
+from spatial import StationIndex
+
+
+def legacy_nearest(dataframe, poslong, poslat, k_nearest):
+    # the implementation before the spatial index: reproject, measure and sort every station per call
+    my_position_point = geopandas.GeoSeries([Point(poslong, poslat)], crs=crs_routing_format) \
+        .to_crs(crs_map_format).iloc[0]
+    gdf = dataframe.loc[:, ('kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                            'latitude', 'longitude', 'geometry')]
+    gdf['geometry'] = gdf['geometry'].to_crs(crs_map_format)
+    gdf['distance'] = gdf['geometry'].distance(my_position_point)
+    gdf = gdf.sort_values(by='distance')
+    return dataframe[dataframe['kioskId'].isin(gdf['kioskId'].head(k_nearest))]
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def run(label, stations, k=5, repeat=20):
+    rng = numpy.random.default_rng(1)
+    lat, long = 34.05 + rng.normal(0, 0.05), -118.25 + rng.normal(0, 0.05)
+
+    build = median_ms(lambda: StationIndex.from_frame(stations), 3)
+    index = StationIndex.from_frame(stations)
+    filtered = stations[stations['bikesAvailable'] > 1]
+
+    legacy = median_ms(lambda: legacy_nearest(stations, long, lat, k), repeat)
+    indexed = median_ms(lambda: get_nearest_dataframe(stations, long, lat, k, index), repeat)
+    legacy_filtered = median_ms(lambda: legacy_nearest(filtered, long, lat, k), repeat)
+    indexed_filtered = median_ms(lambda: get_nearest_dataframe(filtered, long, lat, k, index), repeat)
+
+    assert set(legacy_nearest(stations, long, lat, k)['kioskId']) == \
+           set(get_nearest_dataframe(stations, long, lat, k, index)['kioskId'])
+
+    print(f"{label}: {len(stations)} stations, index build {build:.2f} ms")
+    print(f"    all stations   legacy {legacy:9.2f} ms   indexed {indexed:7.2f} ms   x{legacy / indexed:.1f}")
+    print(f"    filtered       legacy {legacy_filtered:9.2f} ms   indexed {indexed_filtered:7.2f} ms   "
+          f"x{legacy_filtered / indexed_filtered:.1f}")
+
+
+def main():
+    run('bundled feed', sample_stations())
+    run('synthetic city', synthetic_stations(100_000), repeat=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+    Benchmark suite of the request path, from the bundled feed (saved_datas/geo_station_live.csv) up to
+    synthetic city-sized feeds: feed loading, create_dataframe, get_nearest_dataframe, select_bikes /
+    select_docks, icon_color / station_styles, create_local_html_map, find_route against a local stand-in of the
+    OpenRouteService API and the index() POST of a search and of a route search through Flask's test client.
+
+    Every case reports the p50 / p90 / p99 call time and the peak memory one call allocates. Results can be
+    written as JSON and compared with an earlier run, the exit status is 1 if a case got slower than the
+    threshold allows:
+
+        python -m benchmarks.bench_suite --output before.json
+        python -m benchmarks.bench_suite --output after.json --baseline before.json
+        python -m benchmarks.bench_suite --compare before.json after.json
+
+    Feeds: 'bundled' and synthetic station counts, e.g. --feeds bundled 5000 20000.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+
+import numpy
+
+import functions
+import main as viewer
+from benchmarks import harness
+from benchmarks.bench_map import icon_color
+from benchmarks.fake_servers import FakeORSServer
+from benchmarks.synthetic import sample_feed_payload, sample_stations, synthetic_stations
+from snapshot import SnapshotStore, station_store
+from spatial import station_index
+
+# feeds of a default run
+default_feeds = ('bundled', '5000')
+# timed calls per case of a default run
+default_repeat = 50
+# number of nearest stations of the searches
+rankings = 5
+# rows icon_color() is called for in one timed call
+icon_color_rows = 100
+# positions of the searches, cycled, more than the calls of a case so no result comes from a cache
+search_positions = 5000
+# latency of the routing stand-in per leg (s)
+routing_latency = 0.0
+
+
+def feed_stations(feed):
+    # 'bundled' or a station count
+    return sample_stations() if feed == 'bundled' else synthetic_stations(int(feed))
+
+
+def feed_cases(snapshot, feed_file, positions, app):
+    """
+        The cases of one feed.
+
+        Args:
+            snapshot (StationSnapshot): The snapshot of the feed.
+            feed_file (str): The GeoJSON file of the feed.
+            positions (iterator): Endless (latitude, longitude, dest latitude, dest longitude) tuples.
+            app (Flask): The app serving the feed.
+
+        Returns:
+            dict: Case name -> callable.
+        """
+    df = snapshot.view()
+    index = station_index(snapshot)
+    df_nearest = functions.get_nearest_dataframe(df, -118.25, 34.05, rankings, index)
+    rows = [row for _, row in df.head(icon_color_rows).iterrows()]
+    client = app.test_client()
+
+    def nearest():
+        lat, long, _, _ = next(positions)
+        functions.get_nearest_dataframe(df, long, lat, rankings, index)
+
+    def local_map():
+        lat, long, _, _ = next(positions)
+        _, m = functions.create_local_html_map(df, lat, long, rankings, index=index, snapshot=snapshot)
+        functions.render_map(m)
+
+    def route():
+        lat, long, d_lat, d_long = next(positions)
+        functions.find_route(lat, long, d_lat, d_long, functions.by_bike, cache=None)
+
+    def post(destination):
+        def index_post():
+            lat, long, d_lat, d_long = next(positions)
+            form = {'latitude': f'{lat:.6f}', 'longitude': f'{long:.6f}', 'rankings': str(rankings),
+                    'searchBike': 'on', 'available_pieces': '1'}
+            if destination:
+                form.update(destLat=f'{d_lat:.6f}', destLong=f'{d_long:.6f}')
+            response = client.post('/', data=form)
+            assert response.status_code == 200, response.status_code
+        return index_post
+
+    return {
+        'feed load': lambda: SnapshotStore(feed_file).get(),
+        'create_dataframe': functions.create_dataframe,
+        'get_nearest_dataframe': nearest,
+        'select_bikes': lambda: functions.select_bikes(df, 1),
+        'select_docks': lambda: functions.select_docks(df, 1),
+        f'icon_color x{len(rows)}': lambda: [icon_color(row, df_nearest) for row in rows],
+        'station_styles': lambda: functions.station_styles(df, df_nearest['kioskId']),
+        'create_local_html_map': local_map,
+        'find_route': route,
+        'index POST search': post(destination=False),
+        'index POST route': post(destination=True),
+    }
+
+
+def run(feeds, repeat, cases=None):
+    """
+        Runs the suite.
+
+        Args:
+            feeds (list): 'bundled' and synthetic station counts.
+            repeat (int): The number of timed calls per case.
+            cases (list): Substrings of the case names to run (default: None, all cases).
+
+        Returns:
+            dict: '<feed>/<case>' -> harness.measure() result.
+        """
+    rng = numpy.random.default_rng(0)
+    positions = itertools.cycle([tuple(position) for position in
+                                 rng.normal((34.05, -118.25, 34.05, -118.25), 0.02, (search_positions, 4))])
+    results = {}
+    data_file, ors_directions_url = station_store.data_file, functions.ors_directions_url
+    archive_routes, cache_folder = functions.archive_routes, functions.route_cache.folder
+    with FakeORSServer(routing_latency) as server, tempfile.TemporaryDirectory() as folder:
+        # the routes of the stand-in stay out of the route cache and the archived sample routes
+        functions.ors_directions_url = server.url
+        functions.archive_routes = False
+        functions.route_cache.folder = None
+        app = viewer.create_app(backend=functions.ORSBackend())
+        try:
+            for feed in feeds:
+                feed_file = os.path.join(folder, f'{feed}.geojson')
+                with open(feed_file, 'wb') as file:
+                    file.write(sample_feed_payload(feed_stations(feed)))
+                # the app and create_dataframe() read the process-wide store
+                station_store.data_file = feed_file
+                snapshot = station_store.get()
+                print(f"feed {feed}: {len(snapshot.frame)} stations", file=sys.stderr)
+                for case, func in feed_cases(snapshot, feed_file, positions, app).items():
+                    if cases and not any(part in case for part in cases):
+                        continue
+                    functions.route_cache.memory.clear()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        results[f'{feed}/{case}'] = harness.measure(func, repeat)
+        finally:
+            station_store.data_file = data_file
+            functions.ors_directions_url = ors_directions_url
+            functions.archive_routes = archive_routes
+            functions.route_cache.folder = cache_folder
+            functions.route_cache.memory.clear()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--feeds', nargs='+', default=list(default_feeds), help="'bundled' or station counts")
+    parser.add_argument('--repeat', type=int, default=default_repeat, help='timed calls per case')
+    parser.add_argument('--cases', nargs='+', help='run only the cases whose names contain one of these')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='only compare two JSON files')
+    parser.add_argument('--threshold', type=float, default=harness.regression_threshold,
+                        help='relative p50 slowdown counting as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = (harness.read_results(path) for path in args.compare)
+    else:
+        current = run(args.feeds, args.repeat, args.cases)
+        harness.print_results(current)
+        if args.output:
+            harness.write_results(args.output, current)
+        if not args.baseline:
+            return
+        baseline = harness.read_results(args.baseline)
+
+    rows = harness.compare(baseline, current, args.threshold)
+    harness.print_comparison(rows)
+    if any(regression for *_, regression in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
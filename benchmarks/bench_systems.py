@@ -0,0 +1,141 @@
+"""
+    Benchmarks serving several bike-share systems from one deployment: routing a position to the system of its
+    bounding box and searching the nearest stations in that system's index, against one index over the stations
+    of all systems, for a growing number of systems; and refreshing the GBFS feeds of all systems one after the
+    other against the worker pool of systems.refresh_systems(), with a local GBFS stand-in answering every
+    document after a latency.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_systems
+"""
+import contextlib
+import io
+import itertools
+import os
+import tempfile
+import timeit
+
+import numpy
+import pandas
+
+import systems
+from benchmarks.fake_servers import FakeGBFSServer
+from benchmarks.synthetic import gbfs_documents, sample_feed_payload, synthetic_stations
+from snapshot import StationSnapshot
+from spatial import StationIndex, project_points, station_index
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def city_stations(number, stations):
+    # the synthetic stations of a city, the cities 2 degrees apart on a grid
+    frame = synthetic_stations(stations, seed=number, spread=0.03)
+    frame['kioskId'] += number * stations
+    frame['latitude'] += 2.0 * (number // 10)
+    frame['longitude'] += 2.0 * (number % 10)
+    return frame
+
+
+def create_systems(count, stations, feed_url=None):
+    # systems of synthetic cities in systems.systems_folder, fetched from feed_url or written to their feed files
+    bike_systems = [systems.BikeSystem(f'city-{number}', feed_url or '', 'gbfs') for number in range(count)]
+    if feed_url is None:
+        for number, system in enumerate(bike_systems):
+            os.makedirs(os.path.dirname(system.data_file), exist_ok=True)
+            with open(system.data_file, 'wb') as file:
+                file.write(sample_feed_payload(city_stations(number, stations)))
+    return bike_systems
+
+
+def routing(folder, counts, stations, repeat):
+    rng = numpy.random.default_rng(0)
+    rows = []
+    for count in counts:
+        systems.systems_folder = os.path.join(folder, str(count))
+        bike_systems = create_systems(count, stations)
+        router = systems.SystemRouter(bike_systems)
+        router.areas()
+        # positions near the stations of random cities
+        cities = rng.integers(0, count, repeat)
+        positions = itertools.cycle((numpy.column_stack([34.05 + 2.0 * (cities // 10),
+                                                         -118.25 + 2.0 * (cities % 10)])
+                                     + rng.normal(0, 0.02, (repeat, 2))).tolist())
+
+        def sharded():
+            lat, long = next(positions)
+            snapshot = router.locate(lat, long).store.get()
+            x, y = project_points(lat, long)
+            station_index(snapshot).query(float(x), float(y), 5)
+
+        locate = median_ms(lambda: router.locate(*next(positions)), repeat)
+        shard = median_ms(sharded, repeat)
+
+        # one index over the stations of all systems
+        merged = pandas.concat([system.store.get().frame for system in bike_systems], ignore_index=True)
+        merged_snapshot = StationSnapshot(1, merged)
+        merged_index = station_index(merged_snapshot)
+
+        def single():
+            lat, long = next(positions)
+            x, y = project_points(lat, long)
+            merged_index.query(float(x), float(y), 5)
+
+        one_index = median_ms(single, repeat)
+        build = median_ms(lambda: StationIndex.from_frame(merged), 3)
+        rows.append((count, count * stations, locate, shard, one_index, build))
+    return rows
+
+
+def refresh(folder, counts, stations, latency):
+    rows = []
+    for count in counts:
+        documents = gbfs_documents(city_stations(0, stations), uuid_ids=True)
+        with FakeGBFSServer(documents, latency) as server:
+            timings = {}
+            for workers in (1, systems.refresh_workers):
+                systems.systems_folder = os.path.join(folder, f'{count}-{workers}')
+                bike_systems = create_systems(count, stations, server.url)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    first = median_ms(lambda: systems.refresh_systems(bike_systems, workers), 1)
+                    # a new status, every feed changed
+                    for station in documents['station_status']['data']['stations']:
+                        station['num_bikes_available'] += 1
+                    server.set_documents(documents)
+                    changed = median_ms(lambda: systems.refresh_systems(bike_systems, workers), 1)
+                    unchanged = median_ms(lambda: systems.refresh_systems(bike_systems, workers), 1)
+                timings[workers] = first, changed, unchanged
+        rows.append((count, timings))
+    return rows
+
+
+def main(counts=(1, 10, 100), stations=500, repeat=500, refresh_counts=(1, 8, 32), latency=0.05):
+    folder_default = systems.systems_folder
+    with tempfile.TemporaryDirectory() as folder:
+        systems.systems_folder = folder
+        try:
+            routed = routing(folder, counts, stations, repeat)
+            refreshed = refresh(folder, refresh_counts, stations, latency)
+        finally:
+            systems.systems_folder = folder_default
+
+    print(f"nearest 5 stations of a position, {stations} stations per system")
+    print("    systems  stations   route to system   route + nearest   one index of all   building it")
+    for count, total, locate, shard, one_index, build in routed:
+        print(f"    {count:7d}  {total:8d}  {locate:13.4f} ms  {shard:13.4f} ms  {one_index:14.4f} ms"
+              f"  {build:9.1f} ms")
+    print(f"refreshing the GBFS feeds, {latency * 1000:.0f} ms per document, {stations} stations per system")
+    print("    systems  workers   first poll   changed feeds   unchanged feeds")
+    for count, timings in refreshed:
+        for workers, (first, changed, unchanged) in timings.items():
+            print(f"    {count:7d}  {workers:7d}  {first:8.0f} ms  {changed:11.0f} ms  {unchanged:13.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+    Benchmarks the nearest stations table of a route search: DataFrame.to_html() of the nearest stations against
+    the pre-rendered rows of table.py, on the first request of a snapshot and on a repeated request.
+
+    Run from the repository root with:
+        python -m benchmarks.bench_table
+"""
+import timeit
+
+import numpy
+import pandas
+
+from benchmarks.synthetic import sample_stations, synthetic_stations
+from snapshot import StationSnapshot
+from spatial import StationIndex, project_points
+from table import bike_table_columns, render_station_table, station_table, station_tables
+
+
+def median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return numpy.median(timings) * 1000
+
+
+def route_positions(stations, rankings):
+    # the nearest stations of the start and of the destination, like the frame of a route search
+    index = StationIndex.from_frame(stations)
+    positions = []
+    for lat, long in ((34.05, -118.25), (34.045, -118.255)):
+        x, y = project_points(lat, long)
+        positions.append(index.query(float(x), float(y), rankings)[0])
+    return numpy.concatenate(positions)
+
+
+def run(stations, rankings, repeat):
+    positions = route_positions(stations, rankings)
+    columns = [name for name in bike_table_columns if name in stations.columns]
+    nearest = pandas.concat([stations.iloc[positions[:rankings]], stations.iloc[positions[rankings:]]])
+
+    to_html = median_ms(lambda: nearest.loc[:, columns].to_html(index=False), repeat)
+    # a new snapshot renders all rows once, later tables of the snapshot only join them
+    build = median_ms(lambda: station_table(StationSnapshot(1, stations), columns), max(repeat // 10, 1))
+    snapshot = StationSnapshot(1, stations)
+    station_table(snapshot, columns)
+
+    def uncached():
+        station_tables.clear()
+        render_station_table(snapshot, positions, columns)
+
+    rows = median_ms(uncached, repeat)
+    cached = median_ms(lambda: render_station_table(snapshot, positions, columns), repeat)
+
+    print(f"{len(stations)} stations, table of {len(positions)} nearest stations ({rankings} per end)")
+    print(f"    DataFrame.to_html           {to_html:8.3f} ms")
+    print(f"    rows of a new snapshot      {build:8.3f} ms   (once per snapshot)")
+    print(f"    pre-rendered rows           {rows:8.3f} ms   x{to_html / rows:.0f}")
+    print(f"    cached table                {cached:8.3f} ms   x{to_html / cached:.0f}")
+
+
+def main(repeat=200):
+    run(sample_stations(), 5, repeat)
+    run(synthetic_stations(5000), 20, repeat)
+
+
+if __name__ == '__main__':
+    main()
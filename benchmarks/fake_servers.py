@@ -0,0 +1,250 @@
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# bundled sample routes served by FakeORSServer
+routes_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'routes')
+
+
+class FakeFeedServer:
+    """
+        Local stand-in for the Metro Bike Share station feed.
+
+        Serves a configurable payload with ETag and Last-Modified headers and answers conditional requests
+        with 304, so the refresh path can be exercised without network access. Usable as a context manager:
+
+            with FakeFeedServer(payload) as server:
+                get_GeoJSON(url=server.url, data_file=...)
+
+        Args:
+            payload (bytes): The feed body to serve.
+            latency (float): Seconds to sleep before every response (default: 0.0).
+            validators (bool): Whether ETag / Last-Modified are sent and honoured (default: True).
+        """
+
+    def __init__(self, payload=b'{}', latency=0.0, validators=True):
+        self.latency = latency
+        self.validators = validators
+        self.requests = 0
+        self.not_modified = 0
+        self.set_payload(payload)
+        self._server = None
+        self._thread = None
+
+    def set_payload(self, payload):
+        """
+            Replaces the served payload, changing its ETag and Last-Modified date.
+
+            Args:
+                payload (bytes): The new feed body.
+            """
+        self.payload = payload
+        self.etag = '"{}"'.format(hashlib.sha1(payload).hexdigest())
+        self.last_modified = email.utils.formatdate(time.time(), usegmt=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/stations/json'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.validators and (self.headers.get('If-None-Match') == fake.etag
+                                        or self.headers.get('If-Modified-Since') == fake.last_modified):
+                    fake.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(fake.payload)))
+                if fake.validators:
+                    self.send_header('ETag', fake.etag)
+                    self.send_header('Last-Modified', fake.last_modified)
+                self.end_headers()
+                self.wfile.write(fake.payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeORSServer:
+    """
+        Local stand-in for the OpenRouteService directions API.
+
+        Answers GET /v2/directions/<profile>?start=..&end=.. with the bundled sample route of the profile
+        (routes/geo_data_route_<profile>.json) after an optional latency, so routing can be exercised and
+        benchmarked without network access or API quota. Set `functions.ors_directions_url` to `url` to
+        route the app through it.
+
+        Args:
+            latency (float): Seconds to sleep before every response (default: 0.0).
+        """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.profiles = {}
+        for profile in ('foot-walking', 'cycling-regular'):
+            with open(os.path.join(routes_folder, f'geo_data_route_{profile}.json'), 'rb') as file:
+                self.profiles[profile] = file.read()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v2/directions'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                profile = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+                body = fake.profiles.get(profile)
+                if body is None:
+                    body = b'{"error": {"code": 2003, "message": "unknown profile"}}'
+                    self.send_response(400)
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/geo+json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeGBFSServer:
+    """
+        Local stand-in for a GBFS system.
+
+        Serves a version 2 discovery file at /gbfs.json pointing at /station_information.json and
+        /station_status.json, after an optional latency per document. Set a BikeSystem's feed_url to `url`.
+
+        Args:
+            documents (dict): The station_information and station_status documents, e.g. from
+                              synthetic.gbfs_documents().
+            latency (float): Seconds to sleep before every response (default: 0.0).
+        """
+
+    def __init__(self, documents, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.set_documents(documents)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def set_documents(self, documents):
+        # the served feeds by name
+        self.bodies = {name: json.dumps(document).encode() for name, document in documents.items()}
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/gbfs.json'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                name = self.path.split('?')[0].strip('/').rsplit('.', 1)[0]
+                if name == 'gbfs':
+                    base = fake.url.rsplit('/', 1)[0]
+                    body = json.dumps({'data': {'en': {'feeds': [{'name': feed, 'url': f'{base}/{feed}.json'}
+                                                                 for feed in fake.bodies]}}}).encode()
+                else:
+                    body = fake.bodies.get(name)
+                if body is None:
+                    body = b'{}'
+                    self.send_response(404)
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
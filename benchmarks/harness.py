@@ -0,0 +1,136 @@
+"""
+    Measurement and result handling of the benchmark suite (benchmarks/bench_suite.py).
+
+    A case is timed with functions.timeit_decorator, then run once more under tracemalloc for the memory it
+    allocates. Results are written as JSON, with the environment they were measured in, and two result files
+    can be compared to find regressions.
+"""
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+import numpy
+import pandas
+
+from functions import timeit_decorator
+
+# percentiles of the timings kept in the results
+percentiles = (50, 90, 99)
+# relative slowdown of the median above which a case counts as a regression
+regression_threshold = 0.2
+# cases faster than this (ms) are not compared, their timings are mostly noise
+comparison_floor_ms = 0.05
+
+
+def measure(func, repeat, warmup=1):
+    """
+        Times a benchmark case and measures its memory use.
+
+        Args:
+            func (callable): The case, called without arguments.
+            repeat (int): The number of timed calls.
+            warmup (int): The number of calls before timing, filling caches and pools (default: 1).
+
+        Returns:
+            dict: repeat, mean, min, max and the percentiles of the call time in ms, and peak_kib, the peak
+                  memory allocated by one call in KiB.
+        """
+    for _ in range(warmup):
+        func()
+    timed = timeit_decorator(n=repeat, verbose=False)(func)
+    timed()
+    timings = numpy.asarray(timed.timings) * 1000
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {'repeat': repeat, 'mean': float(timings.mean()), 'min': float(timings.min()),
+              'max': float(timings.max()), 'peak_kib': peak / 1024}
+    result.update({f'p{p}': float(v) for p, v in zip(percentiles, numpy.percentile(timings, percentiles))})
+    return result
+
+
+def environment():
+    """
+        Describes where the results were measured.
+
+        Returns:
+            dict: Time, commit, Python, platform and library versions, CPU count and peak RSS.
+        """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        commit = ''
+    # ru_maxrss is in KiB on Linux, in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': numpy.__version__, 'pandas': pandas.__version__, 'cpus': os.cpu_count(),
+            'max_rss_mib': max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)}
+
+
+def write_results(path, results):
+    """
+        Writes the results of a run as JSON.
+
+        Args:
+            path (str): The file to write.
+            results (dict): Case name -> measure() result.
+        """
+    with open(path, 'w') as file:
+        json.dump({'environment': environment(), 'results': results}, file, indent=1, sort_keys=True)
+
+
+def read_results(path):
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def compare(baseline, current, threshold=regression_threshold, statistic='p50'):
+    """
+        Compares two runs case by case.
+
+        Args:
+            baseline (dict): Case name -> result of the reference run.
+            current (dict): Case name -> result of the new run.
+            threshold (float): Relative slowdown counting as a regression (default: regression_threshold).
+            statistic (str): The compared timing statistic (default: 'p50').
+
+        Returns:
+            list: (case, baseline ms, current ms, relative change, regression) of the cases in both runs.
+        """
+    rows = []
+    for case in sorted(set(baseline) & set(current)):
+        before, after = baseline[case][statistic], current[case][statistic]
+        change = after / before - 1 if before else 0.0
+        regression = change > threshold and after >= comparison_floor_ms
+        rows.append((case, before, after, change, regression))
+    return rows
+
+
+def print_results(results):
+    width = max(len(case) for case in results)
+    print(f"    {'case':{width}s}  {'p50 ms':>9s}  {'p90 ms':>9s}  {'p99 ms':>9s}  {'peak KiB':>9s}")
+    for case, result in results.items():
+        print(f"    {case:{width}s}  {result['p50']:9.3f}  {result['p90']:9.3f}  {result['p99']:9.3f}  "
+              f"{result['peak_kib']:9.0f}")
+
+
+def print_comparison(rows, statistic='p50'):
+    if not rows:
+        print("    no common cases")
+        return
+    width = max(len(row[0]) for row in rows)
+    print(f"    {'case':{width}s}  {'before':>9s}  {'after':>9s}  {'change':>7s}   ({statistic}, ms)")
+    for case, before, after, change, regression in rows:
+        print(f"    {case:{width}s}  {before:9.3f}  {after:9.3f}  {change:+7.1%}{'   REGRESSION' if regression else ''}")
@@ -0,0 +1,150 @@
+"""
+    Load test of the map viewer: concurrent clients request pages for a fixed time, the script reports requests
+    per second and latency percentiles.
+
+    Against a running server:
+        python -m benchmarks.load_test --url http://127.0.0.1:8000
+
+    Or let the script start the server, the production setup or the Flask development server:
+        python -m benchmarks.load_test --serve gunicorn
+        python -m benchmarks.load_test --serve flask
+
+    Scenarios: 'default' requests the default map (GET /), 'search' posts searches around random positions
+    (no destination, so no routing service is involved), 'mixed' alternates both.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import timeit
+
+import numpy
+import requests
+
+# repository root, the working directory of a started server
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def search_form(rng):
+    # a search around a random position in the service area, with some of the optional filters
+    form = {'latitude': f"{34.05 + rng.normal(0, 0.03):.5f}", 'longitude': f"{-118.25 + rng.normal(0, 0.03):.5f}",
+            'rankings': str(rng.integers(3, 10))}
+    if rng.random() < 0.5:
+        form['searchBike'] = 'on'
+        form['available_pieces'] = str(rng.integers(1, 4))
+    if rng.random() < 0.3:
+        form['activeOnly'] = 'on'
+    return form
+
+
+def client(url, scenario, deadline, seed, results):
+    rng = numpy.random.default_rng(seed)
+    session = requests.Session()
+    latencies, errors = [], 0
+    while timeit.default_timer() < deadline:
+        search = scenario == 'search' or (scenario == 'mixed' and rng.random() < 0.5)
+        start = timeit.default_timer()
+        try:
+            if search:
+                response = session.post(url + '/', data=search_form(rng), timeout=60)
+            else:
+                response = session.get(url + '/', timeout=60)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        latencies.append(timeit.default_timer() - start)
+        errors += not ok
+    results.append((latencies, errors))
+
+
+def run(url, scenario, concurrency, duration):
+    """
+        Runs the load test.
+
+        Args:
+            url (str): Base URL of the server.
+            scenario (str): 'default', 'search' or 'mixed'.
+            concurrency (int): The number of concurrent clients.
+            duration (float): Seconds to run for.
+
+        Returns:
+            dict: requests, errors, rps and the p50, p90, p99 and max latency in ms.
+        """
+    results = []
+    deadline = timeit.default_timer() + duration
+    threads = [threading.Thread(target=client, args=(url, scenario, deadline, seed, results))
+               for seed in range(concurrency)]
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timeit.default_timer() - start
+
+    latencies = numpy.concatenate([numpy.asarray(latency) for latency, _ in results]) * 1000
+    errors = sum(error for _, error in results)
+    p50, p90, p99 = numpy.percentile(latencies, [50, 90, 99]) if len(latencies) else (0, 0, 0)
+    return {'requests': len(latencies), 'errors': errors, 'rps': len(latencies) / elapsed,
+            'p50': p50, 'p90': p90, 'p99': p99, 'max': latencies.max() if len(latencies) else 0}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, workers):
+    # starts the server in the background and waits until it answers
+    port = free_port()
+    if kind == 'gunicorn':
+        env = dict(os.environ, BIKE_MAP_BIND=f'127.0.0.1:{port}', BIKE_MAP_WORKERS=str(workers))
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    else:
+        # the former way of serving: the Flask development server with the debugger
+        env = dict(os.environ)
+        command = [sys.executable, '-c', f"from main import create_app; "
+                                         f"create_app().run(port={port}, debug=True, use_reloader=False)"]
+    process = subprocess.Popen(command, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        try:
+            requests.get(url + '/favicon.ico', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='base URL of a running server')
+    parser.add_argument('--serve', choices=['gunicorn', 'flask'], help='start this server for the test')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='gunicorn workers (--serve)')
+    parser.add_argument('--scenario', choices=['default', 'search', 'mixed'], default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    args = parser.parse_args()
+    if not args.url and not args.serve:
+        parser.error('either --url or --serve is required')
+
+    process, url = start_server(args.serve, args.workers) if args.serve else (None, args.url.rstrip('/'))
+    try:
+        result = run(url, args.scenario, args.concurrency, args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(30)
+
+    print(f"{args.serve or url}, scenario {args.scenario}, {args.concurrency} clients, {args.duration:.0f} s")
+    print(f"    {result['requests']} requests, {result['errors']} errors, {result['rps']:.1f} requests/s")
+    print(f"    latency p50 {result['p50']:.1f} ms   p90 {result['p90']:.1f} ms   p99 {result['p99']:.1f} ms   "
+          f"max {result['max']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import os
+
+import geopandas
+import numpy
+import pandas
+import shapely.wkt
+
+# station data bundled with the repository
+sample_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'saved_datas',
+                          'geo_station_live.csv')
+
+
+def sample_stations():
+    """
+        Loads the bundled station snapshot (saved_datas/geo_station_live.csv) as a GeoDataFrame.
+
+        Returns:
+            GeoDataFrame: The bundled stations in EPSG:4326.
+        """
+    df = pandas.read_csv(sample_csv, index_col=0)
+    df['geometry'] = df['geometry'].apply(shapely.wkt.loads)
+    return geopandas.GeoDataFrame(df, geometry='geometry', crs='EPSG:4326')
+
+
+def sample_feed_payload(stations=None):
+    """
+        Serializes stations to a GeoJSON payload shaped like the live feed.
+
+        Args:
+            stations (GeoDataFrame): The stations to serialize (default: the bundled snapshot).
+
+        Returns:
+            bytes: The GeoJSON payload.
+        """
+    if stations is None:
+        stations = sample_stations()
+    return stations.to_json().encode()
+
+
+def synthetic_stations(n, seed=0, spread=0.15):
+    """
+        Generates a synthetic city-sized station feed from the bundled snapshot.
+
+        Rows of the bundled stations are sampled with replacement, moved by a random offset around the
+        Los Angeles service area and given unique kioskIds, so every column the app reads is present with
+        realistic values.
+
+        Args:
+            n (int): The number of stations to generate.
+            seed (int): Seed of the random generator (default: 0).
+            spread (float): Standard deviation of the coordinate offset in degrees (default: 0.15).
+
+        Returns:
+            GeoDataFrame: The synthetic stations in EPSG:4326.
+        """
+    rng = numpy.random.default_rng(seed)
+    base = sample_stations()
+    df = base.iloc[rng.integers(0, len(base), n)].reset_index(drop=True)
+    df['latitude'] = 34.05 + rng.normal(0.0, spread, n)
+    df['longitude'] = -118.25 + rng.normal(0.0, spread, n)
+    df['kioskId'] = numpy.arange(100000, 100000 + n)
+    df['bikesAvailable'] = rng.integers(0, 30, n)
+    df['docksAvailable'] = rng.integers(0, 30, n)
+    return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df['longitude'], df['latitude']),
+                                  crs='EPSG:4326')
+
+
+def grid_road_network(rows, cols, spacing=250.0, origin=(34.035, -118.27)):
+    """
+        Generates a street grid as a GeoJSON FeatureCollection of OSM-tagged LineStrings.
+
+        Every third street is a primary road, streets in between alternate between two-way and one-way
+        residential streets, every fifth column is a footway closed to bikes, and a motorway closed to
+        pedestrians and bikes runs along the diagonal.
+
+        Args:
+            rows (int): The number of east-west streets.
+            cols (int): The number of north-south streets.
+            spacing (float): The distance between two streets in meters (default: 250.0).
+            origin (tuple): (latitude, longitude) of the south-west corner (default: south-west of DTLA).
+
+        Returns:
+            dict: The GeoJSON FeatureCollection.
+        """
+    lat0, long0 = origin
+    dlat = spacing / 111320.0
+    dlong = spacing / (111320.0 * numpy.cos(numpy.radians(lat0)))
+    lats = [round(lat0 + i * dlat, 7) for i in range(rows)]
+    longs = [round(long0 + j * dlong, 7) for j in range(cols)]
+
+    def street(coordinates, **tags):
+        return {'type': 'Feature', 'properties': tags,
+                'geometry': {'type': 'LineString', 'coordinates': coordinates}}
+
+    features = []
+    for i, lat in enumerate(lats):
+        coordinates = [[long, lat] for long in longs]
+        if i % 3 == 0:
+            features.append(street(coordinates, highway='primary', name=f'Street {i}'))
+        else:
+            features.append(street(coordinates, highway='residential', name=f'Street {i}',
+                                   oneway='yes' if i % 2 else 'no'))
+    for j, long in enumerate(longs):
+        coordinates = [[long, lat] for lat in lats]
+        if j % 5 == 4:
+            features.append(street(coordinates, highway='footway', name=f'Walk {j}'))
+        else:
+            features.append(street(coordinates, highway='residential' if j % 3 else 'secondary',
+                                   name=f'Avenue {j}'))
+    diagonal = [[longs[k], lats[k]] for k in range(min(rows, cols))]
+    features.append(street(diagonal, highway='motorway', name='Freeway'))
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def gbfs_documents(stations, uuid_ids=False, timezone=None):
+    """
+        Converts stations to the station_information and station_status documents of a GBFS version 2 feed.
+
+        Args:
+            stations (GeoDataFrame): The stations, e.g. synthetic_stations().
+            uuid_ids (bool): Whether the station ids are UUID-like strings instead of the kioskIds
+                             (default: False).
+            timezone (str): The time zone of a system_information document (default: None, no such document).
+
+        Returns:
+            dict: The documents by feed name.
+        """
+    station_ids = [f'{kiosk_id:08x}-0aca-11e7-82f6-3863bb44ef7c' if uuid_ids else str(kiosk_id)
+                   for kiosk_id in stations['kioskId'].tolist()]
+    information = [{'station_id': station_id, 'name': name, 'lat': lat, 'lon': long, 'capacity': int(docks)}
+                   for station_id, name, lat, long, docks in
+                   zip(station_ids, stations['name'], stations['latitude'], stations['longitude'],
+                       stations['totalDocks'])]
+    status = [{'station_id': station_id, 'num_bikes_available': int(bikes), 'num_ebikes_available': 0,
+               'num_docks_available': int(docks), 'is_installed': True, 'is_renting': True, 'is_returning': True}
+              for station_id, bikes, docks in zip(station_ids, stations['bikesAvailable'], stations['docksAvailable'])]
+    documents = {'station_information': {'data': {'stations': information}},
+                 'station_status': {'data': {'stations': status}}}
+    if timezone is not None:
+        documents['system_information'] = {'data': {'system_id': 'synthetic', 'name': 'Synthetic Bikes',
+                                                    'timezone': timezone}}
+    return documents
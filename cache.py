@@ -0,0 +1,80 @@
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    """
+        Thread-safe least-recently-used cache with an optional time to live.
+
+        Args:
+            maxsize (int): The max number of entries; the least recently used entry is evicted first.
+            ttl (float): Seconds an entry stays valid (default: None, entries never expire).
+        """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, count=True):
+        """
+            Returns the cached value of a key and marks it as recently used.
+
+            Args:
+                key (hashable): The cache key.
+                count (bool): Whether the lookup is counted as hit or miss (default: True).
+
+            Returns:
+                The cached value, or None if the key is missing or expired.
+            """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and entry[1] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+            Stores a value, evicting the least recently used entries if the cache is full.
+
+            Args:
+                key (hashable): The cache key.
+                value: The value to cache, must not be None.
+            """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+            Returns the counters of the cache.
+
+            Returns:
+                dict: hits, misses and the current number of entries.
+            """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,207 @@
+import numpy
+import pandas
+
+
+class StationColumns:
+    """
+        Compact struct-of-arrays copy of the station feed.
+
+        Only the columns the app works with are kept, with fixed dtypes: int32 ids, int16 counts, float64
+        coordinates, int8 status codes with a category table and opening hours as int16 minutes after midnight
+        (-1 if unknown). Display strings stay object arrays shared with the source frame. Filters return boolean
+        masks over the station positions (the row order of the source frame) instead of copied frames.
+
+        Build it with from_frame(), or station_columns() for the cached columns of a snapshot.
+        """
+
+    # count columns: attribute name -> feed column
+    count_columns = {
+        'bikes': 'bikesAvailable',
+        'classic_bikes': 'classicBikesAvailable',
+        'smart_bikes': 'smartBikesAvailable',
+        'electric_bikes': 'electricBikesAvailable',
+        'docks': 'docksAvailable',
+        'total_docks': 'totalDocks',
+    }
+    # display columns: attribute name -> feed column
+    text_columns = {
+        'name': 'name',
+        'street': 'addressStreet',
+        'city': 'addressCity',
+        'state': 'addressState',
+        'zip_code': 'addressZipCode',
+    }
+
+    def __init__(self, kiosk_id, latitude, longitude, counts, status_codes, status_categories, open_minutes,
+                 close_minutes, texts):
+        self.kiosk_id = kiosk_id
+        self.latitude = latitude
+        self.longitude = longitude
+        for attribute, values in counts.items():
+            setattr(self, attribute, values)
+        self.status_codes = status_codes
+        self.status_categories = status_categories
+        self.open_minutes = open_minutes
+        self.close_minutes = close_minutes
+        for attribute, values in texts.items():
+            setattr(self, attribute, values)
+
+    def __len__(self):
+        return len(self.kiosk_id)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+            Builds the columns from a station (Geo)DataFrame.
+
+            Args:
+                frame (DataFrame): The station feed.
+
+            Returns:
+                StationColumns: The typed columns, in the row order of the frame.
+            """
+        counts = {}
+        for attribute, column in cls.count_columns.items():
+            values = frame[column] if column in frame else pandas.Series(0, index=frame.index)
+            counts[attribute] = pandas.to_numeric(values, errors='coerce').fillna(0).to_numpy().astype(numpy.int16)
+
+        status = pandas.Categorical(frame['kioskPublicStatus'].astype(str))
+        texts = {attribute: frame[column].to_numpy(dtype=object) for attribute, column in cls.text_columns.items()
+                 if column in frame}
+
+        return cls(kiosk_id=frame['kioskId'].to_numpy().astype(numpy.int32),
+                   latitude=frame['latitude'].to_numpy(dtype=numpy.float64),
+                   longitude=frame['longitude'].to_numpy(dtype=numpy.float64),
+                   counts=counts,
+                   status_codes=status.codes.astype(numpy.int8),
+                   status_categories=numpy.asarray(status.categories, dtype=object),
+                   open_minutes=parse_minutes(frame['openTime']) if 'openTime' in frame
+                   else numpy.full(len(frame), -1, dtype=numpy.int16),
+                   close_minutes=parse_minutes(frame['closeTime']) if 'closeTime' in frame
+                   else numpy.full(len(frame), -1, dtype=numpy.int16),
+                   texts=texts)
+
+    def patched(self, frame, positions):
+        """
+            Returns a copy of the columns with the rows at some positions replaced by the rows of a frame.
+
+            Args:
+                frame (DataFrame): The new station feed, with the same stations in the same order.
+                positions (ndarray): Positions of the changed stations.
+
+            Returns:
+                StationColumns: The patched columns, or None if the rows bring a status the columns do not know.
+            """
+        rows = StationColumns.from_frame(frame.iloc[positions])
+        known = pandas.Index(self.status_categories)
+        status_codes = known.get_indexer(rows.status_categories)
+        if (status_codes < 0).any():
+            return None
+
+        patched = StationColumns.__new__(StationColumns)
+        for attribute, values in vars(self).items():
+            if isinstance(values, numpy.ndarray) and attribute != 'status_categories':
+                values = values.copy()
+                values[positions] = getattr(rows, attribute)
+            setattr(patched, attribute, values)
+        patched.status_codes[positions] = status_codes[rows.status_codes].astype(numpy.int8)
+        return patched
+
+    @property
+    def status(self):
+        """
+            Returns the status of every station as strings.
+
+            Returns:
+                ndarray: The kioskPublicStatus values.
+            """
+        return self.status_categories[self.status_codes]
+
+    def status_mask(self, text, positions=None):
+        """
+            Returns the mask of the stations whose status contains a text, evaluated once per category.
+
+            Args:
+                text (str): The text to look for, e.g. 'Active'.
+                positions (ndarray): Positions of the stations to check (default: None, all stations).
+
+            Returns:
+                ndarray: Boolean mask over the station positions, or over positions if given.
+            """
+        codes = self.status_codes if positions is None else self.status_codes[positions]
+        matching = numpy.array([text in category for category in self.status_categories], dtype=bool)
+        if not len(matching):
+            return numpy.zeros(len(codes), dtype=bool)
+        return matching[codes]
+
+    def bikes_mask(self, drop_numbers):
+        """
+            Returns the mask of the stations select_bikes() keeps: more than drop_numbers available bikes.
+
+            Args:
+                drop_numbers (int): Stations with this number of bikes or less are dropped.
+
+            Returns:
+                ndarray: Boolean mask over the station positions.
+            """
+        return self.bikes > drop_numbers
+
+    def docks_mask(self, drop_numbers):
+        """
+            Returns the mask of the stations select_docks() keeps: more than drop_numbers available docks.
+
+            Args:
+                drop_numbers (int): Stations with this number of docks or less are dropped.
+
+            Returns:
+                ndarray: Boolean mask over the station positions.
+            """
+        return self.docks > drop_numbers
+
+    def nbytes(self):
+        """
+            Returns the memory used by the arrays; object arrays count their pointers only, the strings are shared
+            with the source frame.
+
+            Returns:
+                int: The size in bytes.
+            """
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, numpy.ndarray))
+
+
+def parse_minutes(times):
+    """
+        Converts 'HH:MM[:SS]' strings to minutes after midnight.
+
+        Args:
+            times (Series): The time strings.
+
+        Returns:
+            ndarray: int16 minutes, -1 where the time is missing or invalid.
+        """
+    # feeds repeat a handful of opening hours, parse each distinct value once
+    codes, uniques = pandas.factorize(times.astype(str))
+    uniques = pandas.Series(uniques)
+    hours = pandas.to_numeric(uniques.str.slice(0, 2), errors='coerce')
+    minutes = pandas.to_numeric(uniques.str.slice(3, 5), errors='coerce')
+    parsed = numpy.append((hours * 60 + minutes).fillna(-1).to_numpy(), -1).astype(numpy.int16)
+    # missing times have the code -1, the appended last entry
+    return parsed[codes]
+
+
+def station_columns(snapshot):
+    """
+        Returns the typed columns of a station snapshot, building them once per snapshot.
+
+        If only station counts or texts changed since the previous snapshot, its columns are patched for the
+        changed stations instead.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+
+        Returns:
+            StationColumns: The columns of the snapshot's stations.
+        """
+    return snapshot.derived('station_columns', lambda s: StationColumns.from_frame(s.frame),
+                            update=lambda columns, s: columns.patched(s.frame, s.diff.positions)
+                            if s.diff.same_layout else None)
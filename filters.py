@@ -0,0 +1,270 @@
+import datetime
+import zoneinfo
+
+import numpy
+
+from cache import LRUCache
+from columns import StationColumns, station_columns
+
+# time zone of the opening hours of the default feed, systems.py sets one per system
+station_timezone = "America/Los_Angeles"
+# below this share of stations left by the most selective threshold, its positions are gathered from the
+# sorted counts instead of combining whole-snapshot masks
+gather_ratio = 0.01
+# number of threshold masks kept per availability index
+threshold_masks = 64
+
+
+class AvailabilityIndex:
+    """
+        Bucketed and sorted counts of every count column of StationColumns.
+
+        Counts are small integers, so the stations with at least n bikes of a kind form a handful of distinct
+        masks per snapshot. These threshold masks are built once and kept, a repeated filter only combines
+        them. The stations are also sorted by every count with the offset of every count value: the size of
+        a threshold's result is one lookup, and a very selective threshold yields its stations directly
+        without touching the others.
+
+        Args:
+            columns (StationColumns): The columns to index.
+        """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.size = len(columns)
+        self.order = {}
+        self.offsets = {}
+        for attribute in StationColumns.count_columns:
+            values = getattr(columns, attribute)
+            order = numpy.argsort(values, kind='stable').astype(numpy.int32)
+            self.order[attribute] = order
+            # offsets[n]: position in the order of the first station with a count of at least n
+            top = int(values.max(initial=0)) + 1
+            self.offsets[attribute] = numpy.searchsorted(values[order], numpy.arange(top + 1), side='left')
+        self.masks = LRUCache(threshold_masks)
+
+    def count_at_least(self, attribute, minimum):
+        """
+            Returns the number of stations with a count of at least minimum.
+
+            Args:
+                attribute (str): The count attribute, e.g. 'electric_bikes'.
+                minimum (int): The threshold.
+
+            Returns:
+                int: The number of matching stations.
+            """
+        return self.size - self._start(attribute, minimum)
+
+    def at_least(self, attribute, minimum):
+        """
+            Returns the positions of the stations with a count of at least minimum.
+
+            Args:
+                attribute (str): The count attribute, e.g. 'electric_bikes'.
+                minimum (int): The threshold.
+
+            Returns:
+                ndarray: The station positions, ordered by count.
+            """
+        return self.order[attribute][self._start(attribute, minimum):]
+
+    def at_least_mask(self, attribute, minimum):
+        """
+            Returns the mask of the stations with a count of at least minimum, built once per threshold.
+
+            Args:
+                attribute (str): The count attribute, e.g. 'electric_bikes'.
+                minimum (int): The threshold.
+
+            Returns:
+                ndarray: Read-only boolean mask over the station positions.
+            """
+        return self._cached((attribute, minimum), lambda: getattr(self.columns, attribute) >= minimum)
+
+    def status_mask(self, text):
+        """
+            Returns the mask of the stations whose status contains a text, built once per text.
+
+            Args:
+                text (str): The text to look for, e.g. 'Active'.
+
+            Returns:
+                ndarray: Read-only boolean mask over the station positions.
+            """
+        return self._cached(('status', text), lambda: self.columns.status_mask(text))
+
+    def _start(self, attribute, minimum):
+        offsets = self.offsets[attribute]
+        return int(offsets[min(max(minimum, 0), len(offsets) - 1)])
+
+    def _cached(self, key, build):
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = build()
+            mask.flags.writeable = False
+            self.masks.put(key, mask)
+        return mask
+
+
+class StationFilter:
+    """
+        Combined station predicate, evaluated as one boolean mask over the station positions of a snapshot.
+
+        Thresholds of 0 are inactive. Filters combine with & into a filter keeping the stations both keep.
+
+        Args:
+            min_bikes (int): Minimum number of available bikes (default: 0).
+            min_classic_bikes (int): Minimum number of available classic bikes (default: 0).
+            min_smart_bikes (int): Minimum number of available smart bikes (default: 0).
+            min_electric_bikes (int): Minimum number of available electric bikes (default: 0).
+            min_docks (int): Minimum number of available docks (default: 0).
+            active (bool): Keep only stations whose kioskPublicStatus is Active (default: False).
+            open_at (int): Keep only stations open at this minute after midnight, e.g. local_minutes()
+                           (default: None, opening hours are ignored).
+        """
+
+    def __init__(self, min_bikes=0, min_classic_bikes=0, min_smart_bikes=0, min_electric_bikes=0, min_docks=0,
+                 active=False, open_at=None):
+        self.thresholds = {
+            'bikes': min_bikes,
+            'classic_bikes': min_classic_bikes,
+            'smart_bikes': min_smart_bikes,
+            'electric_bikes': min_electric_bikes,
+            'docks': min_docks,
+        }
+        self.active = active
+        self.open_at = open_at
+
+    def __and__(self, other):
+        if self.open_at is not None and other.open_at is not None and self.open_at != other.open_at:
+            raise ValueError("cannot combine filters for different opening times")
+        combined = StationFilter(active=self.active or other.active,
+                                 open_at=self.open_at if self.open_at is not None else other.open_at)
+        combined.thresholds = {attribute: max(minimum, other.thresholds[attribute])
+                               for attribute, minimum in self.thresholds.items()}
+        return combined
+
+    def __repr__(self):
+        return f"StationFilter{self.key()}"
+
+    def key(self):
+        """
+            Returns a hashable key of the filter, equal for filters keeping the same stations.
+
+            Returns:
+                tuple: The thresholds, the status and the opening time of the filter.
+            """
+        return tuple(self.thresholds.values()) + (self.active, self.open_at)
+
+    def evaluate(self, columns, availability=None):
+        """
+            Evaluates the filter on station columns.
+
+            Without an availability index all predicates are fused into one pass over the columns. With one,
+            a very selective threshold gathers its stations from the sorted counts and the other predicates
+            only run on them; otherwise the cached threshold and status masks of the index are combined.
+
+            Args:
+                columns (StationColumns): The station columns.
+                availability (AvailabilityIndex): The availability index of the columns (default: None).
+
+            Returns:
+                ndarray: Boolean mask over the station positions.
+            """
+        thresholds = [(attribute, minimum) for attribute, minimum in self.thresholds.items() if minimum > 0]
+
+        if availability is None:
+            mask = numpy.ones(len(columns), dtype=bool)
+            for attribute, minimum in thresholds:
+                mask &= getattr(columns, attribute) >= minimum
+            if self.active:
+                mask &= columns.status_mask('Active')
+        elif thresholds and min(availability.count_at_least(*item) for item in thresholds) \
+                <= gather_ratio * len(columns):
+            # start from the threshold leaving the fewest stations
+            attribute, minimum = min(thresholds, key=lambda item: availability.count_at_least(*item))
+            candidates = availability.at_least(attribute, minimum)
+            for other, other_minimum in thresholds:
+                if other != attribute:
+                    candidates = candidates[getattr(columns, other)[candidates] >= other_minimum]
+            if self.active:
+                candidates = candidates[columns.status_mask('Active', candidates)]
+            if self.open_at is not None:
+                candidates = candidates[open_mask(columns.open_minutes[candidates],
+                                                  columns.close_minutes[candidates], self.open_at)]
+            mask = numpy.zeros(len(columns), dtype=bool)
+            mask[candidates] = True
+            return mask
+        else:
+            mask = numpy.ones(len(columns), dtype=bool)
+            for attribute, minimum in thresholds:
+                mask &= availability.at_least_mask(attribute, minimum)
+            if self.active:
+                mask &= availability.status_mask('Active')
+
+        if self.open_at is not None:
+            mask &= open_mask(columns.open_minutes, columns.close_minutes, self.open_at)
+        return mask
+
+    def mask(self, snapshot):
+        """
+            Evaluates the filter on the stations of a snapshot, using the snapshot's availability index.
+
+            Args:
+                snapshot (StationSnapshot): The station snapshot.
+
+            Returns:
+                ndarray: Boolean mask over the rows of the snapshot (and the positions of its station_index()).
+            """
+        return self.evaluate(station_columns(snapshot), availability_index(snapshot))
+
+
+def open_mask(open_minutes, close_minutes, minute):
+    """
+        Returns which stations are open at a minute of the day.
+
+        Opening hours may wrap past midnight (close before open). Stations with unknown hours (-1) or with the
+        same opening and closing time count as always open.
+
+        Args:
+            open_minutes (ndarray): The opening times in minutes after midnight.
+            close_minutes (ndarray): The closing times in minutes after midnight.
+            minute (int): The minute after midnight to check.
+
+        Returns:
+            ndarray: Boolean mask, True for open stations.
+        """
+    unknown = (open_minutes < 0) | (close_minutes < 0) | (open_minutes == close_minutes)
+    same_day = (open_minutes <= minute) & (minute <= close_minutes)
+    overnight = (minute >= open_minutes) | (minute <= close_minutes)
+    return unknown | numpy.where(open_minutes < close_minutes, same_day, overnight)
+
+
+def local_minutes(now=None, timezone=station_timezone):
+    """
+        Returns the current minute of the day in the time zone of the stations.
+
+        Args:
+            now (datetime): The time to convert (default: None, the current time).
+            timezone (str): The time zone of the stations, an IANA name (default: station_timezone).
+
+        Returns:
+            int: The minutes after midnight.
+        """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    local = now.astimezone(zoneinfo.ZoneInfo(timezone))
+    return local.hour * 60 + local.minute
+
+
+def availability_index(snapshot):
+    """
+        Returns the availability index of a station snapshot, building it once per snapshot.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+
+        Returns:
+            AvailabilityIndex: The index over the counts of the snapshot's stations.
+        """
+    return snapshot.derived('availability_index', lambda s: AvailabilityIndex(station_columns(s)))
@@ -0,0 +1,273 @@
+import datetime
+import functools
+import threading
+import time
+import zoneinfo
+
+import numpy
+
+from filters import station_timezone
+from history import availability_history
+
+# length of one time-of-week slot of the station profiles in seconds
+slot_seconds = 30 * 60
+# number of time-of-week slots
+week_slots = 7 * 24 * 3600 // slot_seconds
+# number of time-of-day slots
+day_slots = 24 * 3600 // slot_seconds
+# weight, in polls, of the time-of-day mean in the mean of a time-of-week slot; a few weeks of history hold
+# too few polls per weekly slot for its own mean
+profile_prior = 120
+# counts the model predicts
+forecast_columns = ['bikes', 'docks']
+# days of history a model is trained on
+training_days = 28
+# a model is retrained once it is older than this many seconds
+retrain_seconds = 3600
+# below this number of recorded polls no model is trained and the current counts are used as they are
+min_training_polls = 60
+
+
+class AvailabilityForecast:
+    """
+        Per-station availability forecast: a time-of-week profile plus the decaying deviation from it.
+
+        For every station and count the model holds the mean count of every half hour of the week, shrunk
+        towards the mean of the same half hour over all days, and the lag-one autocorrelation of the deviations
+        from that profile. A forecast h seconds ahead starts from the
+        current deviation, lets it decay with the autocorrelation per poll interval and adds the profile of the
+        target slot:
+
+            count(t + h) = profile[slot(t + h)] + (count(t) - profile[slot(t)]) * phi ** (h / interval)
+
+        Training and inference are array operations over all stations at once.
+
+        Attributes:
+            kiosk_ids (ndarray): The kioskIds of the modelled stations.
+            profiles (dict): (week_slots, stations) float32 mean counts by column.
+            phi (dict): Per-station autocorrelation of the deviations by column.
+            interval (float): The median seconds between two training polls.
+            timezone (str): The time zone of the time-of-week slots.
+            trained_at (float): Unix time the model was trained.
+        """
+
+    def __init__(self, kiosk_ids, profiles, phi, interval, timezone=station_timezone):
+        self.kiosk_ids = kiosk_ids
+        self.profiles = profiles
+        self.phi = phi
+        self.interval = interval
+        self.timezone = timezone
+        self.trained_at = time.time()
+        self._sorter = numpy.argsort(kiosk_ids, kind='stable')
+
+    @classmethod
+    def train(cls, times, counts, kiosk_ids, timezone=station_timezone):
+        """
+            Trains the models of all stations from poll x station count matrices.
+
+            Args:
+                times (ndarray): Unix times of the polls, increasing.
+                counts (dict): (polls, stations) counts by forecast column, negative where unknown.
+                kiosk_ids (ndarray): The kioskIds of the matrix columns.
+                timezone (str): The time zone of the stations (default: station_timezone).
+
+            Returns:
+                AvailabilityForecast: The trained model.
+            """
+        slots = week_slot(times, timezone)
+        stations = len(kiosk_ids)
+        profiles, phi = {}, {}
+        for column in forecast_columns:
+            values = counts[column].astype(numpy.float32)
+            known = values >= 0
+            values = numpy.where(known, values, 0)
+
+            # mean per slot and station through one bincount over slot * stations + station
+            cells = (slots[:, None] * stations + numpy.arange(stations)[None, :]).ravel()
+            sums = numpy.bincount(cells, weights=values.ravel(), minlength=week_slots * stations)
+            hits = numpy.bincount(cells, weights=known.ravel(), minlength=week_slots * stations)
+            sums, hits = sums.reshape(week_slots, stations), hits.reshape(week_slots, stations)
+            overall = sums.sum(axis=0) / numpy.maximum(hits.sum(axis=0), 1)
+            # time-of-day means, the weekly slots of a day folded onto each other
+            day_sums = sums.reshape(7, day_slots, stations).sum(axis=0)
+            day_hits = hits.reshape(7, day_slots, stations).sum(axis=0)
+            daily = numpy.where(day_hits > 0, day_sums / numpy.maximum(day_hits, 1), overall[None, :])
+            prior = numpy.tile(daily, (7, 1))
+            profile = ((sums + profile_prior * prior) / (hits + profile_prior)).astype(numpy.float32)
+
+            # lag-one autocorrelation of the deviations, over pairs of consecutive known polls
+            deviation = numpy.where(known, values - profile[slots], 0)
+            pairs = known[1:] & known[:-1]
+            lagged = (deviation[1:] * deviation[:-1] * pairs).sum(axis=0)
+            energy = (deviation[:-1] ** 2 * pairs).sum(axis=0)
+            phi[column] = numpy.clip(lagged / numpy.maximum(energy, 1e-9), 0.0, 0.999).astype(numpy.float32)
+            profiles[column] = profile
+
+        interval = float(numpy.median(numpy.diff(times))) if len(times) > 1 else 60.0
+        return cls(numpy.asarray(kiosk_ids), profiles, phi, max(interval, 1.0), timezone)
+
+    @classmethod
+    def from_history(cls, history=availability_history, kiosk_ids=None, days=training_days, now=None,
+                     timezone=station_timezone):
+        """
+            Trains the models on the recent polls of an availability history.
+
+            Args:
+                history (AvailabilityHistory): The recorded polls (default: availability_history).
+                kiosk_ids (ndarray): The stations to model (default: None, the stations of the last poll).
+                days (int): Days of history to train on (default: training_days).
+                now (float): Unix time the window ends at (default: None, now).
+                timezone (str): The time zone of the stations (default: station_timezone).
+
+            Returns:
+                AvailabilityForecast: The trained model, or None if the history has too few polls.
+            """
+        now = now if now is not None else time.time()
+        if kiosk_ids is None:
+            kiosk_ids = history.last_layout()
+        times, counts = history.matrix(forecast_columns, kiosk_ids, now - days * 24 * 3600, now + 1)
+        if len(times) < min_training_polls:
+            return None
+        return cls.train(times, counts, kiosk_ids, timezone)
+
+    def positions(self, kiosk_ids):
+        """
+            Returns the model positions of stations.
+
+            Args:
+                kiosk_ids (ndarray): The kioskIds.
+
+            Returns:
+                ndarray: The positions, -1 for stations the model does not know.
+            """
+        kiosk_ids = numpy.asarray(kiosk_ids)
+        if not len(self.kiosk_ids):
+            return numpy.full(kiosk_ids.shape, -1)
+        found = self._sorter[numpy.minimum(numpy.searchsorted(self.kiosk_ids, kiosk_ids, sorter=self._sorter),
+                                           len(self.kiosk_ids) - 1)]
+        return numpy.where(self.kiosk_ids[found] == kiosk_ids, found, -1)
+
+    def predict(self, column, kiosk_ids, current, horizon, now=None):
+        """
+            Predicts counts of stations some seconds ahead, broadcasting over the arguments.
+
+            Args:
+                column (str): The forecast column, 'bikes' or 'docks'.
+                kiosk_ids (array-like): The kioskIds of the stations.
+                current (array-like): The current counts of the stations.
+                horizon (array-like): The seconds ahead to predict.
+                now (float): Unix time of the current counts (default: None, now).
+
+            Returns:
+                ndarray: The predicted counts, never below 0; the current counts for unknown stations.
+            """
+        now = now if now is not None else time.time()
+        positions = self.positions(kiosk_ids)
+        current = numpy.asarray(current, dtype=numpy.float32)
+        horizon = numpy.maximum(numpy.asarray(horizon, dtype=numpy.float32), 0)
+        known = positions >= 0
+        positions = numpy.where(known, positions, 0)
+
+        profile = self.profiles[column]
+        slot_now = week_slot(numpy.array([now]), self.timezone)[0]
+        slot_then = week_slot(now + horizon.astype(numpy.float64), self.timezone)
+        decay = self.phi[column][positions] ** (horizon / self.interval)
+        predicted = profile[slot_then, positions] + (current - profile[slot_now, positions]) * decay
+        return numpy.where(known, numpy.maximum(predicted, 0), current)
+
+
+def week_slot(times, timezone=station_timezone):
+    """
+        Returns the time-of-week slot of unix times in the time zone of the stations.
+
+        Args:
+            times (array-like): Unix times in seconds.
+            timezone (str): The time zone of the stations (default: station_timezone).
+
+        Returns:
+            ndarray: Slots from 0 (Monday 0:00) to week_slots - 1.
+        """
+    times = numpy.asarray(times, dtype=numpy.float64)
+    # the UTC offset changes twice a year only, look it up once per distinct hour
+    hours, inverse = numpy.unique(times.ravel() // 3600, return_inverse=True)
+    offsets = numpy.array([utc_offset(int(hour), timezone) for hour in hours])
+    local_seconds = times.ravel() + offsets[inverse]
+    # unix time 0 was a Thursday, shift to weeks starting on Monday
+    slots = ((local_seconds + 3 * 24 * 3600) // slot_seconds).astype(numpy.int64) % week_slots
+    return slots.reshape(times.shape)
+
+
+@functools.lru_cache(maxsize=4096)
+def utc_offset(hour, timezone=station_timezone):
+    """
+        Returns the UTC offset of the time zone of the stations at an hour.
+
+        Args:
+            hour (int): Hours since the unix epoch.
+            timezone (str): The time zone of the stations (default: station_timezone).
+
+        Returns:
+            float: The offset in seconds.
+        """
+    stamp = datetime.datetime.fromtimestamp(hour * 3600, zoneinfo.ZoneInfo(timezone))
+    return stamp.utcoffset().total_seconds()
+
+
+class ForecastCache:
+    """
+        The current forecast model, retrained from the history in a background thread once it is older than
+        max_age. Requests keep using the previous model (or none) while a new one is trained.
+
+        Args:
+            history (AvailabilityHistory): The recorded polls (default: availability_history).
+            max_age (float): Seconds a model is used for (default: retrain_seconds).
+            timezone (str): The time zone of the stations of the history (default: station_timezone).
+        """
+
+    def __init__(self, history=availability_history, max_age=retrain_seconds, timezone=station_timezone):
+        self.history = history
+        self.max_age = max_age
+        self.timezone = timezone
+        self._model = None
+        self._trained_at = 0.0
+        self._training = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+            Returns the current model, starting its retraining if it is missing or too old.
+
+            Returns:
+                AvailabilityForecast: The model, or None until the first one is trained.
+            """
+        if self._stale():
+            with self._lock:
+                if self._stale() and (self._training is None or not self._training.is_alive()):
+                    self._training = threading.Thread(target=self.train, name='forecast-training', daemon=True)
+                    self._training.start()
+        return self._model
+
+    def train(self):
+        """
+            Trains a new model from the history and makes it the current one.
+
+            Returns:
+                AvailabilityForecast: The new model, or None if the history is too short.
+            """
+        try:
+            model = AvailabilityForecast.from_history(self.history, timezone=self.timezone)
+        except (OSError, ValueError) as e:
+            print(f"Training the availability forecast failed: {e}")
+            model = self._model
+        self._model, self._trained_at = model, time.time()
+        return model
+
+    def _stale(self):
+        if self._model is None:
+            # without a model, training is tried again as soon as the history is long enough
+            return self.history.polls >= min_training_polls and time.time() - self._trained_at >= 60
+        return time.time() - self._trained_at >= self.max_age
+
+
+# the forecast used for station selection by the requests of the process
+availability_forecast = ForecastCache()
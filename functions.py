@@ -1,22 +1,43 @@
+import asyncio
+import functools
+import hashlib
 import json
 import os
+import threading
 import timeit
 import webbrowser
 
 import folium
-import geopandas
+import httpx
+import numpy
 import pandas
 import requests
 from flask import request
 from shapely.geometry import Point
 
+import metrics
+from cache import LRUCache
+from columns import StationColumns
+from filters import StationFilter, local_minutes, station_timezone
+from forecast import availability_forecast
+from history import availability_history
+from routing import NoRouteError, RoutingError, archive_executor, archive_route, decode_route_coordinates, \
+    ors_session, route_cache, route_executor, route_key
+from snapshot import change_log_size, geo_data_file, station_store
+from spatial import StationIndex, project_points
+from station_pairs import choose_station_pair
 
-def timeit_decorator(n=1):
+
+def timeit_decorator(n=1, verbose=True):
     """
         Decorator function to measure the execution time of a function.
 
+        The seconds of every execution of the last call are kept in the `timings` attribute of the decorated
+        function, for benchmarks/harness.py.
+
         Args:
             n (int): Number of times the function should be executed.
+            verbose (bool): Whether the average execution time is printed (default: True).
 
         Returns:
             function: Decorator function.
@@ -24,19 +45,22 @@ def timeit_decorator(n=1):
         """
 
     def decorator(func):
+        @functools.wraps(func)
         def timed_func(*args, **kwargs):
-            total_execution_time = 0
+            timings = []
             for _ in range(n):
                 start_time = timeit.default_timer()
                 result = func(*args, **kwargs)
                 end_time = timeit.default_timer()
-                execution_time = end_time - start_time
-                total_execution_time += execution_time
-            average_execution_time = total_execution_time / n
-            print(f"Function {func.__name__} executed an average of {n} times")
-            print(f"Average execution time: {average_execution_time} seconds")
+                timings.append(end_time - start_time)
+            timed_func.timings = timings
+            if verbose:
+                average_execution_time = sum(timings) / n
+                print(f"Function {func.__name__} executed an average of {n} times")
+                print(f"Average execution time: {average_execution_time} seconds")
             return result
 
+        timed_func.timings = []
         return timed_func
 
     return decorator
@@ -48,94 +72,262 @@ crs_routing_format = "EPSG:4326"
 crs_map_format = "EPSG:3857"
 # Api key for the Open Route Service
 api_ORS_key = "5b3ce3597851110001cf62483a64689c0c234ddab368b092813c9dce"
+# Open Route Service directions endpoint, the routing profile is appended
+ors_directions_url = "https://api.openrouteservice.org/v2/directions"
+# seconds to wait for a routing response
+ors_timeout = 30
+# seconds one leg of an asynchronous route request may take before it is cancelled
+route_leg_timeout = 15
+# whether the last response of every routing profile is kept in routes/geo_data_route_{profile}.json
+archive_routes = True
 
 # 2 types of Open Route Service Routing ( by foot and by bike)
 by_bike = "cycling-regular"
 by_foot = "foot-walking"
-
-
-def get_GeoJSON():
+# name of the feature group holding the prerendered station markers
+station_layer_id = "stations"
+# number of rendered station markers kept, a feed refresh only re-renders the markers of changed stations
+marker_fragment_cache_size = 20000
+# number of rendered station layers kept, one per snapshot and station filter
+station_layer_cache_size = 32
+# columns kept by select_bikes() and select_docks()
+bike_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                'bikesAvailable', 'classicBikesAvailable', 'smartBikesAvailable', 'electricBikesAvailable',
+                'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime', 'latitude', 'longitude', 'geometry']
+dock_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                'bikesAvailable', 'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime',
+                'latitude', 'longitude', 'geometry']
+
+
+# Metro Bike Share LA station feed
+feed_url = "https://bikeshare.metro.net/stations/json"
+# a header with user credentials is needed for the request, otherwise the request gets blocked from the website
+feed_headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64) AppleWebkit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36",
+    "Referer": "https://bikeshare.metro.net/stations/",
+}
+# validators of the last stored feed, sent back as conditional request headers on the next fetch
+feed_validators = {'etag': None, 'last_modified': None, 'sha1': None}
+
+
+def get_GeoJSON(url=feed_url, data_file=geo_data_file, store=station_store, history=availability_history,
+                validators=feed_validators):
     """
         Retrieves GeoJSON data from the Metro Bike Share LA website and saves it locally.
 
-        The function sends a request to the website, saves the retrieved data as a JSON file,
-        and creates a GeoPandas dataframe from the JSON file. It also saves the data in a CSV file.
+        The request is conditional (If-None-Match / If-Modified-Since), so an unchanged feed costs a 304 without
+        a body. A changed payload is stored by store_feed(). Every successful poll, changed or not, appends the
+        station counts to the availability history.
 
+        Args:
+            url (str): The URL of the station feed.
+            data_file (str): The path the feed is stored at.
+            store (SnapshotStore): The snapshot store to reload after new data was saved.
+            history (AvailabilityHistory): The history the counts of the poll are recorded in, None to not record
+                                           them (default: availability_history).
+            validators (dict): The validators of the last stored feed of this URL, updated in place
+                               (default: feed_validators).
+
+        Returns:
+            bool: True if new station data was stored, False otherwise.
     """
-    # create a request to Metro Bike Share LA for retrieving data:
-    # url contains the link to the website
-    url = "https://bikeshare.metro.net/stations/json"
-    # a header with user credentials is needed for the request, otherwise the request gets blocked from the website
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64) AppleWebkit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36",
-        "Referer": "https://bikeshare.metro.net/stations/",
-    }
-    # creating a folder to save the request
-    data_folder = "data"
-    data_file = os.path.join(data_folder, "geo_data.json")
-    # Create the data folder if it doesn't exist
-    if not os.path.exists(data_folder):
-        os.makedirs(data_folder)
+    # hash of the stored file, to detect unchanged payloads after a restart
+    if validators['sha1'] is None and os.path.exists(data_file):
+        with open(data_file, "rb") as file:
+            validators['sha1'] = hashlib.sha1(file.read()).hexdigest()
+
+    headers = dict(feed_headers)
+    if os.path.exists(data_file):
+        if validators['etag']:
+            headers['If-None-Match'] = validators['etag']
+        if validators['last_modified']:
+            headers['If-Modified-Since'] = validators['last_modified']
 
     try:
         # send the request and catch the response
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=30)
+
+        # the stored data is still up to date
+        if response.status_code == 304:
+            print("Data not modified.")
+            metrics.count('feed_polls_total', outcome='not_modified', system=store.name)
+            record_poll(store, history)
+            return False
+
         # if the response is ok save the data
         if response.status_code == 200:
-            data = response.json()
+            validators['etag'] = response.headers.get('ETag')
+            validators['last_modified'] = response.headers.get('Last-Modified')
+            return store_feed(response.content, data_file, store, history, validators)
 
-            # Save the data to a json file
-            with open(data_file, "w") as file:
-                json.dump(data, file)
-            print("Data saved successfully.")
+        # e.g. response.status_code 404
+        metrics.count('feed_polls_total', outcome='failed', system=store.name)
+        if os.path.exists(data_file):
+            print("Failed to retrieve data. Using stored data.")
+        else:
+            print(f"Request failed with status code: {response.status_code}")
+            print("No stored data available.")
 
-            dfgeo = create_dataframe()
-            dfgeo.to_csv("data/geo_station_live.csv")
+    except (requests.exceptions.RequestException, ValueError):
+        metrics.count('feed_polls_total', outcome='failed', system=store.name)
+        if os.path.exists(data_file):
+            print("An error occurred. Using stored data.")
+        else:
+            print("An error occurred. No stored data available.")
 
-        else:  # e.g. response.status_code 404
+    return False
 
-            if os.path.exists(data_file):
-                # Load the data from an previous stored file
-                with open(data_file, "r") as file:
-                    data = json.load(file)
-                print("Failed to retrieve data. Using stored data.")
 
-            else:
-                print(f"Request failed with status code: {response.status_code}")
-                print("No stored data available.")
+def store_feed(payload, data_file, store, history, validators):
+    """
+        Saves a fetched station feed and reloads the snapshot store from it.
 
-    except requests.exceptions.RequestException as e:
-        if os.path.exists(data_file):
-            # Load the data from the stored file
-            with open(data_file, "r") as file:
-                data = json.load(file)
+        A payload whose SHA-1 equals the stored one is not written or parsed again. New data is written to a
+        temporary file and moved over the old one, so the feed file is never seen half-written. The station
+        snapshot is then reloaded once and saved in a CSV file.
 
-            print("An error occurred. Using stored data.")
-        else:
-            print("An error occurred. No stored data available.")
+        Args:
+            payload (bytes): The GeoJSON station feed.
+            data_file (str): The path the feed is stored at.
+            store (SnapshotStore): The snapshot store to reload after new data was saved.
+            history (AvailabilityHistory): The history the counts of the poll are recorded in, or None.
+            validators (dict): The validators of the last stored feed, its 'sha1' is updated in place.
+
+        Returns:
+            bool: True if new station data was stored, False if it was unchanged.
+
+        Raises:
+            ValueError: If the payload is not valid JSON.
+        """
+    # creating a folder to save the request
+    data_folder = os.path.dirname(data_file)
+    # Create the data folder if it doesn't exist
+    if data_folder and not os.path.exists(data_folder):
+        os.makedirs(data_folder)
+
+    sha1 = hashlib.sha1(payload).hexdigest()
+    if sha1 == validators['sha1'] and os.path.exists(data_file):
+        print("Data unchanged.")
+        metrics.count('feed_polls_total', outcome='unchanged', system=store.name)
+        record_poll(store, history)
+        return False
+
+    # check that the payload is valid json before it replaces the stored data
+    json.loads(payload)
+
+    # Save the data to a temporary json file and swap it in atomically; the name is unique per process and thread,
+    # so concurrent writers (e.g. the dev reloader's two processes) never truncate each other's file
+    tmp_file = f"{data_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "wb") as file:
+        file.write(payload)
+    os.replace(tmp_file, data_file)
+    validators['sha1'] = sha1
+    print("Data saved successfully.")
+    metrics.count('feed_polls_total', outcome='changed', system=store.name)
+
+    dfgeo = store.get().frame
+    dfgeo.to_csv(os.path.join(data_folder, "geo_station_live.csv"))
+    record_poll(store, history)
+    return True
+
+
+def record_poll(store, history):
+    """
+        Appends the counts of the current snapshot to the availability history.
+
+        Args:
+            store (SnapshotStore): The snapshot store holding the polled data.
+            history (AvailabilityHistory): The history to append to, or None.
+        """
+    if history is not None:
+        try:
+            history.record(store.get())
+        except OSError as e:
+            print(f"Recording the availability history failed: {e}")
+
+
+class FeedRefresher:
+    """
+        Background thread polling the station feed every `interval` seconds.
+
+        Every poll runs get_GeoJSON(); a changed feed is parsed by the refresher thread and swapped into the
+        snapshot store, so requests keep reading the previous snapshot until the new one is complete.
+        """
+
+    def __init__(self, interval=60, fetch=get_GeoJSON):
+        self.interval = interval
+        self.fetch = fetch
+        self.polls = 0
+        self.changes = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+            Starts the polling thread.
+            """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='feed-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """
+            Stops the polling thread.
+
+            Args:
+                timeout (float): Seconds to wait for the thread to finish (default: None, wait until it does).
+            """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def refresh(self):
+        """
+            Polls the feed once.
+
+            Returns:
+                bool: True if new station data was stored.
+            """
+        self.polls += 1
+        try:
+            changed = self.fetch()
+        except Exception as e:
+            self.errors += 1
+            print(f"Feed refresh failed: {e}")
+            return False
+        if changed:
+            self.changes += 1
+        return changed
+
+    def run(self):
+        """
+            Polls the feed every `interval` seconds in the calling thread until stop() is called.
+            """
+        while not self._stop.wait(self.interval):
+            self.refresh()
 
 
 def create_dataframe():
     """
-        Creates a GeoPandas DataFrame (GeoDataFrame) from a GeoJSON file and saves it as a CSV file.
+        Returns the station data of the current feed as a GeoPandas DataFrame (GeoDataFrame).
+
+        The feed file is parsed only once per change by the process-wide station store, every call returns a
+        shallow view of the cached frame.
 
         Returns:
         - dfgeo: GeoPandas DataFrame containing the data from the GeoJSON file.
 
         """
-    # open json file
-    json_data = "data/geo_data.json"
-    jsonfile = open(json_data)
-    # creates a GeoDataFrame
-    dfgeo = geopandas.read_file(jsonfile)
-    jsonfile.close()
-    # creates a csv file out of the GeoDataFrame
-    dfgeo.to_csv("data/geo_station_live.csv")
+    dfgeo = station_store.get().view()
     return dfgeo
 
 
 def create_local_html_map(dataframe, poslat, poslong, k_nearest, destlat=0.0, destlong=0.0,
-                          route_coordinates_bybike=None, route_foot_start=None, route_foot_end=None):
+                          route_coordinates_bybike=None, route_foot_start=None, route_foot_end=None, index=None,
+                          snapshot=None, mask=None):
     """
         Creates a local HTML map with markers for the user's current position, destination (if provided),
         and nearest stations from the given dataframe. It also draws routes for walking and cycling with the Metro Bike.
@@ -150,6 +342,11 @@ def create_local_html_map(dataframe, poslat, poslong, k_nearest, destlat=0.0, de
             route_coordinates_bybike: List of coordinates for the cycling route (default: None).
             route_foot_start: List of coordinates for the walking route start (default: None).
             route_foot_end: List of coordinates for the walking route end (default: None).
+            index: Optional prebuilt StationIndex used for the nearest station search (default: None).
+            snapshot: Optional StationSnapshot the dataframe was taken from. The station marker layer is then cached
+                      on the snapshot and only the per-request overlay is rendered (default: None).
+            mask: Optional boolean mask of the stations of the dataframe to show. The dataframe must then hold the rows
+                  the index was built from (default: None, all rows of the dataframe are shown).
 
         Returns:
             df_nearest: The dataframe containing the k_nearest stations from the user's current position and destination.
@@ -178,7 +375,7 @@ def create_local_html_map(dataframe, poslat, poslong, k_nearest, destlat=0.0, de
                   icon=folium.Icon(color='black', icon="user")).add_to(m)
 
     # returns a dataframe containing the k_nearest stations from the Users current lat and long coordinates
-    df_nearest = get_nearest_dataframe(dataframe, poslong, poslat, k_nearest)
+    df_nearest = get_nearest_dataframe(dataframe, poslong, poslat, k_nearest, index, mask)
     # if a destination is selected create a second Maker showing the position of the destinations lat and long coordinates
     if not (destlat and destlong) == 0:
         folium.Marker(location=[destlat, destlong],
@@ -193,30 +390,37 @@ def create_local_html_map(dataframe, poslat, poslong, k_nearest, destlat=0.0, de
         folium.PolyLine(locations=route_coordinates_bybike, color='blue', weight=4).add_to(m)
         folium.PolyLine(locations=route_foot_end, color='red', weight=4).add_to(m)
         # search for the destinations k_nearest stations and add them to the existing dataframe
-        df_nearest_route = get_nearest_dataframe(dataframe, destlong, destlat, k_nearest)
+        df_nearest_route = get_nearest_dataframe(dataframe, destlong, destlat, k_nearest, index, mask)
         df_nearest = pandas.concat([df_nearest, df_nearest_route])
 
-    # Add a Marker for every Station
-    for idx, row in dataframe.iterrows():
-        long, lat = row['geometry'].x, row['geometry'].y
+    # Add the Markers of every Station, rendered once per station snapshot and filter
+    shown = dataframe if mask is None else dataframe[mask]
+    if snapshot is not None:
+        # every filter renders its own layer, keep the recently used ones of all snapshots in one bounded cache
+        layer_key = (snapshot.key, hash_index(dataframe.index) if mask is None else hash_mask(mask))
+        layer_script = station_layers.get(layer_key)
+        if layer_script is None:
+            layer_script = render_station_layer(shown)
+            station_layers.put(layer_key, layer_script)
+    else:
+        layer_script = render_station_layer(shown)
+    StationLayer(layer_script).add_to(m)
 
-        # retrieves the right color and icon for a user friendlier interface
-        color, icon = icon_color(row, df_nearest)
-        # creates a Marker with the color and the icon and also adds a Popup with necessary station information
-        station_marker = create_markers(row, lat, long, color, icon)
-        # adds the created marker to the map
-        station_marker.add_to(m)
+    # Highlight the nearest stations with markers drawn on top of the station layer
+    df_highlight = df_nearest.drop_duplicates(subset='kioskId')
+    styles = station_styles(df_highlight, df_highlight['kioskId'])
+    for (idx, row), color, icon in zip(df_highlight.iterrows(), styles['color'], styles['icon']):
+        long, lat = row['geometry'].x, row['geometry'].y
+        create_markers(row, lat, long, color, icon, z_index_offset=1000).add_to(m)
 
     # Add Clickable map that Copies lat and long to clipboard
     m.add_child(folium.ClickForLatLng())
 
-    # Save the map as an HTML file
-    save_map(m)
-
     return df_nearest, m
 
 
-def get_nearest_dataframe(dataframe, poslong, poslat, k_nearest):
+@metrics.timed('nearest')
+def get_nearest_dataframe(dataframe, poslong, poslat, k_nearest, index=None, mask=None):
     """
     Retrieves the nearest data points in a dataframe based on the given position.
 
@@ -225,81 +429,94 @@ def get_nearest_dataframe(dataframe, poslong, poslat, k_nearest):
         poslong: The longitude of the current position.
         poslat: The latitude of the current position.
         k_nearest: The number of nearest neighbors to retrieve.
+        index: Optional prebuilt StationIndex over the dataframe or over a frame the dataframe was filtered from
+               (default: None, an index is built for this call).
+        mask: Optional boolean mask over the rows of the index of the stations that may be returned. The dataframe
+              must then hold the rows the index was built from (default: None).
 
     Returns:
         df_nearest: The dataframe containing the k_nearest neighbors to the current position.
     """
 
-    # create a Geometric Point of the current position
-    my_position_point = create_point(poslat, poslong, crs_routing_format, crs_map_format)
-    # Create a  temporary geodataframe only with necessary columns
-    gdf = dataframe.loc[:, ('kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
-                            'latitude', 'longitude', 'geometry')]
+    # build a temporary index if the caller has no prebuilt one
+    if index is None:
+        index = StationIndex.from_frame(dataframe)
 
-    # Reproject the 'geometry' column to the desired CRS format
-    gdf['geometry'] = gdf['geometry'].to_crs(crs_map_format)
+    # restrict the search to the rows of the dataframe if it is a filtered subset of the indexed frame
+    if mask is None:
+        mask = index.subset_mask(dataframe)
 
-    # Calculate the distances from the current position to all stations
-    gdf['distance'] = gdf['geometry'].distance(my_position_point)
+    # project the current position to the CRS of the index
+    x, y = project_points(poslat, poslong, crs_routing_format, crs_map_format)
 
-    # sort the Dataframe by distances
-    gdf = gdf.sort_values(by='distance')
-
-    # creates a new dataframe where the KioskID matches the KioskID from the distance sorted Dataframe, containing
-    df_nearest = dataframe[dataframe['kioskId'].isin(gdf['kioskId'].head(k_nearest))]
+    # positions of the k_nearest stations, kept in the order of the dataframe
+    positions, distances = index.query(float(x), float(y), k_nearest, mask)
+    df_nearest = dataframe.loc[index.labels[numpy.sort(positions)]]
 
     return df_nearest
 
 
-def icon_color(row, df_nearest):
+def station_styles(dataframe, nearest_ids=None):
     """
-        Determines the color and icon for a station marker based on its status and availability.
+        Determines the marker color and icon of all stations at once.
+
+        Active stations with more than 5 bikes and docks are green, with at least 2 of both blue, with fewer red,
+        as are unavailable stations. Any other status is gray with a magnifying glass icon. The nearest stations
+        get the dark variant of their color.
 
         Args:
-            row (Series): The row containing station information.
-            df_nearest (DataFrame): The dataframe containing the nearest stations.
+            dataframe (DataFrame): The dataframe containing station data.
+            nearest_ids (array-like): KioskIds of the nearest stations, which are highlighted (default: None).
 
         Returns:
-            color (str): The color for the station marker.
-            icon (str): The icon for the station marker.
-        """
-    # station is active and has enough available bikes and docks
-    if 'Active' in row['kioskPublicStatus'] and int(row['bikesAvailable']) > 5 and int(row['docksAvailable']) > 5:
-        # the nearest stations are highlighted
-        if row['kioskId'] in df_nearest['kioskId'].values:
-            color = 'darkgreen'
-        else:
-            color = 'green'
-        icon = 'bicycle'
-
-    # station is active and has some bikes and docks
-    elif 'Active' in row['kioskPublicStatus'] and int(row['bikesAvailable']) >= 2 and int(
-            row['docksAvailable']) >= 2:
-        # the nearest stations are highlighted
-        if row['kioskId'] in df_nearest['kioskId'].values:
-            color = 'darkblue'
-        else:
-            color = 'blue'
-        icon = 'bicycle'
-
+            DataFrame: 'color' and 'icon' columns with the index of the input dataframe.
+        """
+    status = dataframe['kioskPublicStatus'].astype(str)
+    active = status.str.contains('Active', regex=False).to_numpy()
+    unavailable = status.str.contains('Unavailable', regex=False).to_numpy()
+    bikes = dataframe['bikesAvailable'].to_numpy().astype(int)
+    docks = dataframe['docksAvailable'].to_numpy().astype(int)
+
+    # station is active and has enough, or at least some, available bikes and docks
+    enough = active & (bikes > 5) & (docks > 5)
+    some = active & (bikes >= 2) & (docks >= 2) & ~enough
     # Station is unavailable or active but has low or no availability of bikes and docks
-    elif 'Unavailable' in row['kioskPublicStatus'] or 'Active' in row['kioskPublicStatus']:
-        # the nearest stations are highlighted
-        if row['kioskId'] in df_nearest['kioskId'].values:
-            color = 'darkred'
-        else:
-            color = 'red'
-        icon = 'bicycle'
+    low = (unavailable | active) & ~enough & ~some
 
-    # anything else, (error handling)
-    else:
-        color = 'gray'
-        icon = 'magnifying-glass'
+    color = numpy.select([enough, some, low], ['green', 'blue', 'red'], default='gray').astype(object)
+    icon = numpy.where(enough | some | low, 'bicycle', 'magnifying-glass').astype(object)
+
+    # the nearest stations are highlighted
+    if nearest_ids is not None:
+        nearest = numpy.isin(dataframe['kioskId'].to_numpy(), numpy.asarray(nearest_ids)) & (color != 'gray')
+        color[nearest] = numpy.char.add('dark', color[nearest].astype(str))
 
-    return color, icon
+    return pandas.DataFrame({'color': color, 'icon': icon}, index=dataframe.index)
 
 
-def create_markers(row, lat, long, color, icon):
+def station_popup(row):
+    """
+        Creates the HTML content of the popup of a station marker.
+
+        Args:
+            row (Series): The row containing station information.
+
+        Returns:
+            str: The popup HTML.
+        """
+    return """
+            <b>Name:</b> {}<br>
+            <b>ID:</b> {}<br>
+            <b>Street:</b> {}<br>
+            <b>Available Bikes:</b> {}<br>
+            <b>Available Docks:</b> {}<br>
+            <b>Status:</b> {}<br>
+            <b>Opening hours:</b> {} am - {} pm<br>
+            """.format(row['name'], row['kioskId'], row['addressStreet'], row['bikesAvailable'], row['docksAvailable'],
+                       row['kioskPublicStatus'], row['openTime'], row['closeTime'])
+
+
+def create_markers(row, lat, long, color, icon, z_index_offset=0):
     """
         Creates a marker for a station on the map.
 
@@ -309,6 +526,7 @@ def create_markers(row, lat, long, color, icon):
             long (float): The longitude of the station.
             color (str): The color for the marker.
             icon (str): The icon for the marker.
+            z_index_offset (int): Offset of the marker in the stacking order (default: 0).
 
         Returns:
             Marker: The marker for the station.
@@ -317,16 +535,7 @@ def create_markers(row, lat, long, color, icon):
     station_name = row['name']
 
     # create HTML content for the marker's popup
-    popup_html = """
-            <b>Name:</b> {}<br>
-            <b>ID:</b> {}<br>
-            <b>Street:</b> {}<br>
-            <b>Available Bikes:</b> {}<br>
-            <b>Available Docks:</b> {}<br>
-            <b>Status:</b> {}<br>
-            <b>Opening hours:</b> {} am - {} pm<br>
-            """.format(row['name'], row['kioskId'], row['addressStreet'], row['bikesAvailable'], row['docksAvailable'],
-                       row['kioskPublicStatus'], row['openTime'], row['closeTime'])
+    popup_html = station_popup(row)
 
     # Create a popup for the marker with the HTML content
     popup = folium.Popup(html=popup_html, max_width=250)
@@ -336,25 +545,286 @@ def create_markers(row, lat, long, color, icon):
                                    tooltip=f'{station_name}',
                                    popup=popup,
                                    icon=folium.Icon(color=f'{color}',
-                                                    icon=f'{icon}', prefix='fa')
+                                                    icon=f'{icon}', prefix='fa'),
+                                   z_index_offset=z_index_offset
                                    )
     return station_marker
 
 
-def save_map(m):
+class StationLayer(folium.MacroElement):
     """
-        Saves the map as an HTML file.
+        Map layer holding prerendered station markers.
+
+        The marker script is rendered once by render_station_layer() and emitted as is, so adding the layer to a
+        map costs neither marker objects nor template rendering. The markers are registered by kioskId in the
+        `station_markers` object of the page, for patching them from the change stream.
 
         Args:
-            m (Map): The map object to be saved.
+            script (str): The prerendered marker script.
         """
-    map_file = 'templates/map.html'
-    m.save(map_file)
 
+    def __init__(self, script):
+        super().__init__()
+        self._name = 'feature_group'
+        self._id = station_layer_id
+        self.script = script
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        layer = f"var {self.get_name()} = L.featureGroup({{}}).addTo({self._parent.get_name()});\n" \
+                "var station_markers = {};\n"
+        figure.script.add_child(RawScript(layer + self.script), name=self.get_name())
 
-def find_route(source_lat, source_long, dest_lat, dest_long, travel_type):
+
+class RawScript(folium.Element):
     """
-        Finds a route between the source and destination coordinates using the OpenRouteService API.
+        Script fragment that is written to the page without passing it through the template engine again.
+        """
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = script
+
+    def render(self, **kwargs):
+        return self.script
+
+
+def render_station_layer(dataframe):
+    """
+        Renders the script of the station markers of a dataframe, to be reused by StationLayer on every map.
+
+        The script of every marker is cached by the station values it shows, so after a feed refresh only the
+        markers of the changed stations are rendered again.
+
+        Args:
+            dataframe: The dataframe containing station data.
+
+        Returns:
+            str: The marker script, adding the markers to the station feature group.
+        """
+    # retrieves the right colors and icons for a user friendlier interface
+    styles = station_styles(dataframe)
+    fragments = []
+    canvas = None
+
+    for (idx, row), color, icon in zip(dataframe.iterrows(), styles['color'], styles['icon']):
+        long, lat = row['geometry'].x, row['geometry'].y
+        key = (row['kioskId'], long, lat, color, icon, station_popup(row), row['name'])
+        fragment = marker_fragments.get(key)
+        if fragment is None:
+            canvas = canvas or MarkerCanvas()
+            # creates a Marker with the color and the icon and also adds a Popup with necessary station information
+            fragment = canvas.render(create_markers(row, lat, long, color, icon), row['kioskId'])
+            marker_fragments.put(key, fragment)
+        fragments.append(fragment)
+
+    return ''.join(fragments)
+
+
+class MarkerCanvas:
+    """
+        Detached map the station markers are rendered against, one marker script at a time.
+        """
+
+    def __init__(self):
+        self.figure = folium.Figure()
+        self.layer = folium.FeatureGroup()
+        self.layer._id = station_layer_id
+        self.layer.add_to(folium.Map(tiles=None).add_to(self.figure))
+
+    def render(self, marker, kiosk_id):
+        """
+            Renders the script of a marker added to the station feature group.
+
+            Args:
+                marker (Marker): The station marker.
+                kiosk_id: The kioskId the marker is registered under.
+
+            Returns:
+                str: The marker script.
+            """
+        scripts = self.figure.script._children
+        scripts.clear()
+        marker.add_to(self.layer)
+        marker.render()
+        script = ''.join(element.render() for element in scripts.values())
+        self.layer._children.clear()
+        return script + f"station_markers[{json.dumps(str(kiosk_id))}] = {marker.get_name()};\n"
+
+
+def station_changes(diff):
+    """
+        Builds the change stream event of a snapshot diff, with the new marker style and popup of every changed
+        or added station.
+
+        Args:
+            diff (SnapshotDiff): The diff of a new snapshot.
+
+        Returns:
+            dict: version, base_version, the changed stations and the kioskIds of the removed stations.
+        """
+    event = change_events.get((diff.system, diff.version))
+    if event is not None:
+        return event
+
+    rows = diff.rows
+    styles = station_styles(rows)
+    stations = [{'kioskId': str(row['kioskId']), 'name': row['name'],
+                 'latitude': float(row['latitude']), 'longitude': float(row['longitude']),
+                 'bikesAvailable': int(row['bikesAvailable']), 'docksAvailable': int(row['docksAvailable']),
+                 'kioskPublicStatus': row['kioskPublicStatus'], 'color': color, 'icon': icon,
+                 'popup': station_popup(row)}
+                for (idx, row), color, icon in zip(rows.iterrows(), styles['color'], styles['icon'])]
+    event = {'version': diff.version, 'base_version': diff.base_version, 'stations': stations,
+             'removed': [str(kiosk_id) for kiosk_id in diff.removed]}
+    change_events.put((diff.system, diff.version), event)
+    return event
+
+
+def hash_mask(mask):
+    """
+        Returns a short hash of a boolean station mask, identifying a filtered subset of a snapshot.
+
+        Args:
+            mask (ndarray): The boolean mask.
+
+        Returns:
+            str: The hex digest of the mask.
+        """
+    return hashlib.sha1(numpy.packbits(mask)).hexdigest() + str(len(mask))
+
+
+def hash_index(index):
+    """
+        Returns a short hash of the labels of a dataframe index, identifying a filtered subset of a snapshot.
+
+        Args:
+            index (Index): The dataframe index.
+
+        Returns:
+            str: The hex digest of the index labels.
+        """
+    return hashlib.sha1(numpy.ascontiguousarray(index.to_numpy()).tobytes()).hexdigest()
+
+
+def render_map(m):
+    """
+        Renders the map to an HTML document in memory.
+
+        Args:
+            m (Map): The map object to be rendered.
+
+        Returns:
+            str: The HTML document of the map.
+        """
+    return m.get_root().render()
+
+
+class ORSBackend:
+    """
+        Routing backend calling the OpenRouteService directions API.
+        """
+    name = 'ors'
+    # header for the request
+    headers = {
+        'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
+    }
+
+    def route(self, source_lat, source_long, dest_lat, dest_long, travel_type):
+        """
+            Requests the route of a leg from the OpenRouteService API.
+
+            Args:
+                source_lat (float): The latitude of the source location.
+                source_long (float): The longitude of the source location.
+                dest_lat (float): The latitude of the destination location.
+                dest_long (float): The longitude of the destination location.
+                travel_type (str): The routing profile ('foot-walking', 'cycling-regular', ...).
+
+            Returns:
+                ndarray: (n, 2) array of reversed (latitude, longitude) coordinates representing the route.
+            """
+        # make a request to the OpenRouteService API to get the route data, reusing pooled connections
+        metrics.count('ors_requests_total', profile=travel_type)
+        try:
+            call = ors_session.get(self.url(source_lat, source_long, dest_lat, dest_long, travel_type),
+                                   headers=self.headers, timeout=ors_timeout)
+        except requests.RequestException as e:
+            metrics.count('ors_failures_total', reason=type(e).__name__)
+            raise
+
+        return self.decode(call.content, travel_type, call.status_code)
+
+    async def route_async(self, source_lat, source_long, dest_lat, dest_long, travel_type, client):
+        """
+            Requests the route of a leg from the OpenRouteService API without blocking the event loop.
+
+            Args:
+                source_lat (float): The latitude of the source location.
+                source_long (float): The longitude of the source location.
+                dest_lat (float): The latitude of the destination location.
+                dest_long (float): The longitude of the destination location.
+                travel_type (str): The routing profile ('foot-walking', 'cycling-regular', ...).
+                client (httpx.AsyncClient): The client whose pooled connections are used.
+
+            Returns:
+                ndarray: (n, 2) array of reversed (latitude, longitude) coordinates representing the route.
+            """
+        metrics.count('ors_requests_total', profile=travel_type)
+        try:
+            call = await client.get(self.url(source_lat, source_long, dest_lat, dest_long, travel_type),
+                                    headers=self.headers)
+        except httpx.HTTPError as e:
+            metrics.count('ors_failures_total', reason=type(e).__name__)
+            raise
+
+        return self.decode(call.content, travel_type, call.status_code)
+
+    @staticmethod
+    def url(source_lat, source_long, dest_lat, dest_long, travel_type):
+        # the directions request of a leg, positions as longitude,latitude
+        return (f'{ors_directions_url}/{travel_type}?api_key={api_ORS_key}'
+                f'&start={source_long},{source_lat}&end={dest_long},{dest_lat}')
+
+    @staticmethod
+    def decode(payload, travel_type, status_code=200):
+        # Extract the (latitude, longitude) coordinates from the route data, an error response has none
+        if status_code != 200:
+            metrics.count('ors_failures_total', reason=f'status {status_code}')
+        # ORS answers 404 (error code 2009) if the positions are not connected by the road network
+        if status_code == 404:
+            raise NoRouteError(f"no {travel_type} route found by the routing service")
+        if status_code != 200:
+            raise RoutingError(f"the routing service answered the {travel_type} route with status {status_code}",
+                               status_code)
+        reversed_coordinates = decode_route_coordinates(payload)
+
+        # Save the route data to a file in the background
+        if archive_routes:
+            archive_executor.submit(archive_route, payload,
+                                    os.path.join("routes", f'geo_data_route_{travel_type}.json'))
+
+        return reversed_coordinates
+
+
+# rendered station marker scripts by the station values they show
+marker_fragments = LRUCache(marker_fragment_cache_size)
+# rendered station layers by snapshot key and station subset
+station_layers = LRUCache(station_layer_cache_size)
+# change stream events by system and snapshot version, shared by all clients of the stream
+change_events = LRUCache(change_log_size)
+
+# backend answering route queries: ORSBackend() or a local_routing.LocalBackend over a road graph
+route_backend = ORSBackend()
+
+
+def find_route(source_lat, source_long, dest_lat, dest_long, travel_type, cache=route_cache, backend=None):
+    """
+        Finds a route between the source and destination coordinates using the OpenRouteService API
+        or the configured routing backend.
+
+        Routes are cached by backend, travel type and snapped end points, a cached route is returned without a
+        request.
 
         Args:
             source_lat (float): The latitude of the source location.
@@ -362,47 +832,126 @@ def find_route(source_lat, source_long, dest_lat, dest_long, travel_type):
             dest_lat (float): The latitude of the destination location.
             dest_long (float): The longitude of the destination location.
             travel_type (str): The type of travel ('foot', 'bike', 'car', etc.).
+            cache (RouteCache): The route cache to use, None to always call the API (default: the shared cache).
+            backend: The routing backend to use (default: None, the module's route_backend).
 
         Returns:
-            list: A list of reversed coordinates representing the route.
+            ndarray: (n, 2) array of reversed (latitude, longitude) coordinates representing the route.
         """
+    if backend is None:
+        backend = route_backend
 
-    # create folder, saving the route
-    route_folder = "routes"
-    data_file = os.path.join(route_folder, f'geo_data_route_{travel_type}.json')
-    if not os.path.exists(route_folder):
-        os.makedirs(route_folder)
+    key = (backend.name,) + route_key(travel_type, source_lat, source_long, dest_lat, dest_long)
+    if cache is not None:
+        cached_route = cache.get(key)
+        if cached_route is not None:
+            return cached_route
 
-    # header for the request
-    headers = {
-        'Accept': 'application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8',
-    }
+    # legs run concurrently, their time is part of the request's routing span
+    with metrics.span('route_leg', timing=False):
+        reversed_coordinates = backend.route(source_lat, source_long, dest_lat, dest_long, travel_type)
+
+    if cache is not None:
+        cache.put(key, reversed_coordinates)
+
+    return reversed_coordinates
+
+
+def find_routes(legs, backend=None):
+    """
+        Finds the routes of several legs concurrently.
+
+        Args:
+            legs (list): Tuples of find_route() arguments (source_lat, source_long, dest_lat, dest_long, travel_type).
+            backend: The routing backend to use (default: None, the module's route_backend).
+
+        Returns:
+            list: The reversed coordinate arrays of every leg, in the order of the legs.
+
+        Raises:
+            NoRouteError: If the backend found no route for a leg.
+            RoutingError: If the routing service answered a leg with an error.
+        """
+    with metrics.span('routing'):
+        futures = [route_executor.submit(find_route, *leg, backend=backend) for leg in legs]
+        return [future.result() for future in futures]
 
-    # make a request to the OpenRouteService API to get the route data
-    call = requests.get(
-        f'https://api.openrouteservice.org/v2/directions/{travel_type}?api_key={api_ORS_key}&start={source_long},{source_lat}&end={dest_long},{dest_lat}',
-        headers=headers)
 
-    data = json.loads(call.text)
+async def find_route_async(source_lat, source_long, dest_lat, dest_long, travel_type, client, cache=route_cache,
+                           backend=None):
+    """
+        Finds a route like find_route(), awaiting the routing service instead of blocking a thread.
 
-    # Save the route data to a file
-    with open(data_file, "w") as file:
-        json.dump(data, file)
+        Backends without an asynchronous API (LocalBackend) run in the route executor.
 
-    route_folder = "routes"
-    data_file = os.path.join(route_folder, f'geo_data_route_{travel_type}.json')
-    with open(data_file, 'r') as f:
-        geojson_data = json.load(f)
+        Args:
+            source_lat (float): The latitude of the source location.
+            source_long (float): The longitude of the source location.
+            dest_lat (float): The latitude of the destination location.
+            dest_long (float): The longitude of the destination location.
+            travel_type (str): The routing profile ('foot-walking', 'cycling-regular', ...).
+            client (httpx.AsyncClient): The client of the requests to the routing service.
+            cache (RouteCache): The route cache to use, None to always call the API (default: the shared cache).
+            backend: The routing backend to use (default: None, the module's route_backend).
 
-    # Extract the coordinates from the route data
-    coordinates = geojson_data['features'][0]['geometry']['coordinates']
+        Returns:
+            ndarray: (n, 2) array of reversed (latitude, longitude) coordinates representing the route.
+        """
+    if backend is None:
+        backend = route_backend
+
+    key = (backend.name,) + route_key(travel_type, source_lat, source_long, dest_lat, dest_long)
+    if cache is not None:
+        cached_route = cache.get(key)
+        if cached_route is not None:
+            return cached_route
+
+    with metrics.span('route_leg', timing=False):
+        if hasattr(backend, 'route_async'):
+            reversed_coordinates = await backend.route_async(source_lat, source_long, dest_lat, dest_long,
+                                                             travel_type, client)
+        else:
+            reversed_coordinates = await asyncio.get_running_loop().run_in_executor(
+                route_executor, backend.route, source_lat, source_long, dest_lat, dest_long, travel_type)
 
-    # Reverse the order of coordinates (longitude, latitude) to (latitude, longitude)
-    reversed_coordinates = [(coord[1], coord[0]) for coord in coordinates]
+    if cache is not None:
+        cache.put(key, reversed_coordinates)
 
     return reversed_coordinates
 
 
+async def find_routes_async(legs, client, backend=None, timeout=route_leg_timeout):
+    """
+        Finds the routes of several legs concurrently on the running event loop.
+
+        Every leg gets its own timeout. When a leg fails or times out, the other legs are cancelled and the
+        error is raised; cancelling the caller cancels all legs.
+
+        Args:
+            legs (list): Tuples of find_route() arguments (source_lat, source_long, dest_lat, dest_long, travel_type).
+            client (httpx.AsyncClient): The client of the requests to the routing service.
+            backend: The routing backend to use (default: None, the module's route_backend).
+            timeout (float): Seconds every leg may take (default: route_leg_timeout).
+
+        Returns:
+            list: The reversed coordinate arrays of every leg, in the order of the legs.
+
+        Raises:
+            asyncio.TimeoutError: If a leg took longer than the timeout.
+            NoRouteError: If the backend found no route for a leg.
+            RoutingError: If the routing service answered a leg with an error.
+        """
+    tasks = [asyncio.ensure_future(asyncio.wait_for(find_route_async(*leg, client, backend=backend), timeout))
+             for leg in legs]
+    try:
+        with metrics.span('routing'):
+            return await asyncio.gather(*tasks)
+    finally:
+        # a failed leg leaves the others running, cancel them (finished legs ignore it)
+        for task in tasks:
+            task.cancel()
+
+
 def create_point(lat, long, crs_in, crs_out):
     """
         Creates a geometric point with the specified latitude and longitude, and reprojects it to the desired CRS.
@@ -416,17 +965,10 @@ def create_point(lat, long, crs_in, crs_out):
         Returns:
             shapely.geometry.Point: The reprojected point in the desired CRS.
         """
-    # Create a point with the given latitude and longitude
-    point = Point(long, lat)
-
-    # Create a GeoSeries with the point and assign the input CRS
-    point = geopandas.GeoSeries([point], crs=crs_in)
-
-    # Reproject the point to the desired CRS
-    point = point.to_crs(crs_out)
-    # print(f'Point from {crs_in} to {crs_out}: from {lat} , {long} to {point.iloc[0]}')
+    # Reproject the coordinates with the cached transformer and create the point
+    x, y = project_points(lat, long, crs_in, crs_out)
 
-    return point.iloc[0]
+    return Point(float(x), float(y))
 
 
 def select_bikes(df, drop_numbers):
@@ -442,12 +984,7 @@ def select_bikes(df, drop_numbers):
         """
 
     # select the necessary columns from the dataframe and drop the data points where the number is too low
-    df = df.loc[:, ('kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
-                    'bikesAvailable', 'classicBikesAvailable', 'smartBikesAvailable',
-                    'electricBikesAvailable',
-                    'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime',
-                    'latitude', 'longitude', 'geometry',)] \
-        .drop(df[df['bikesAvailable'] <= drop_numbers].index)
+    df = df.loc[:, bike_columns].drop(df[df['bikesAvailable'] <= drop_numbers].index)
 
     return df
 
@@ -465,26 +1002,24 @@ def select_docks(df, drop_numbers):
         """
 
     # select the necessary columns from the dataframe and drop the data points where the number is to low
-    df = df.loc[:, ('kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
-                    'bikesAvailable', 'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime',
-                    'latitude', 'longitude', 'geometry',)] \
-        .drop(df[df['docksAvailable'] <= drop_numbers].index)
+    df = df.loc[:, dock_columns].drop(df[df['docksAvailable'] <= drop_numbers].index)
 
     return df
 
 
-def request_lat_long(in_put):
+def request_lat_long(in_put, form=None):
     """
         Retrieves latitude or longitude value from the input form data.
 
         Args:
             in_put (str): The input parameter to retrieve from the form data.
+            form (Mapping): The form fields (default: None, the form of the current Flask request).
 
         Returns:
             float: The retrieved latitude or longitude value. If not found, returns 0.0.
     """
     # get the value from the form data
-    out_put = request.form.get(in_put)
+    out_put = (request.form if form is None else form).get(in_put)
 
     # conversion to float if exist
     if out_put:
@@ -495,9 +1030,39 @@ def request_lat_long(in_put):
     return out_put
 
 
-def full_route(df, s_lat, s_long, d_lat, d_long):
+def request_station_filter(form=None, timezone=station_timezone):
     """
-        Calculates the full route from the source position to the destination position using bike and foot.
+        Builds the station filter of the optional filter fields of the input form.
+
+        Args:
+            form (Mapping): The form fields (default: None, the form of the current Flask request).
+            timezone (str): The time zone of the opening hours of the stations (default: station_timezone).
+
+        Returns:
+            StationFilter: The minimum classic, electric and smart bikes, active stations only and stations open now.
+    """
+    form = request.form if form is None else form
+
+    def count(in_put):
+        # empty fields do not filter
+        out_put = form.get(in_put)
+        return int(out_put) if out_put else 0
+
+    return StationFilter(min_classic_bikes=count('min_classic_bikes'),
+                         min_electric_bikes=count('min_electric_bikes'),
+                         min_smart_bikes=count('min_smart_bikes'),
+                         active=form.get('activeOnly') == 'on',
+                         open_at=local_minutes(timezone=timezone) if form.get('openNow') == 'on' else None)
+
+
+@metrics.timed('station_choice')
+def route_stations(df, s_lat, s_long, d_lat, d_long, index=None, mask=None, snapshot=None,
+                   forecast=availability_forecast):
+    """
+        Chooses the start and end station of a trip.
+
+        The start and end station are chosen together among the nearest stations of both positions, by the
+        estimated total trip time, so only the winning pair is sent to the routing service.
 
         Args:
             df (DataFrame): The input dataframe containing station data.
@@ -505,35 +1070,128 @@ def full_route(df, s_lat, s_long, d_lat, d_long):
             s_long (float): The longitude of the source position.
             d_lat (float): The latitude of the destination position.
             d_long (float): The longitude of the destination position.
+            index (StationIndex): Optional prebuilt index used for the nearest station search (default: None).
+            mask (ndarray): Optional boolean mask of the stations that may be used. The dataframe must then hold the
+                            rows the index was built from (default: None, all rows of the dataframe may be used).
+            snapshot (StationSnapshot): Optional snapshot the dataframe and the index were taken from, its cached
+                                        columns and availability index are used to filter the stations and
+                                        its ride time matrix to score the pairs (default: None).
+            forecast (ForecastCache): The availability forecast the station choice considers the counts on
+                                      arrival with (default: availability_forecast).
 
         Returns:
-            tuple: A tuple containing the route segments:
-                - start_to_station (list): The route from the source position to the nearest start station by foot.
-                - s_station_to_d_station (list): The route from the start station to the destination station by bike.
-                - d_station_to_end (list): The route from the destination station to the destination position by foot.
+            tuple: (start label, end label, estimated trip seconds). The labels are index labels of df.
+
+        Raises:
+            ValueError: If no station has a bike or a dock available.
         """
 
     # only the nearest stations and min availability = 1
     ranking = 1
 
-    # delete stations with no availability
-    df = select_bikes(df, ranking)
-    df = select_docks(df, ranking)
+    # build a temporary index if the caller has no prebuilt one
+    if index is None:
+        index = StationIndex.from_frame(df)
+
+    # skip stations with no availability
+    route_filter = StationFilter(min_bikes=ranking + 1, min_docks=ranking + 1)
+    if snapshot is not None:
+        available = route_filter.mask(snapshot)
+    else:
+        # the dataframe may be a filtered subset of the indexed frame
+        available = index.mask_for(df.index[route_filter.evaluate(StationColumns.from_frame(df))])
+    mask = available if mask is None else mask & available
+
+    # the pair of start and end station with the shortest estimated walk + ride + walk time
+    return choose_station_pair(df, index, s_lat, s_long, d_lat, d_long, mask=mask, forecast=forecast.get(),
+                               snapshot=snapshot)
+
+
+def trip_legs(df, s_lat, s_long, d_lat, d_long, s_station, d_station):
+    """
+        Returns the legs of a trip over a start and an end station.
 
-    # Distance from source position to start station
-    df_start_station = get_nearest_dataframe(df, s_long, s_lat, ranking)
-    s_station_lat = df_start_station.loc[:, ('latitude')].item()
-    s_station_long = df_start_station.loc[:, ('longitude')].item()
-    start_to_station = find_route(s_lat, s_long, s_station_lat, s_station_long, by_foot)
+        Args:
+            df (DataFrame): The input dataframe containing station data.
+            s_lat (float): The latitude of the source position.
+            s_long (float): The longitude of the source position.
+            d_lat (float): The latitude of the destination position.
+            d_long (float): The longitude of the destination position.
+            s_station: The index label of the start station.
+            d_station: The index label of the end station.
 
-    # Distance from start station to end station
-    df_end_station = get_nearest_dataframe(df, d_long, d_lat, ranking)
-    d_station_lat = df_end_station.loc[:, ('latitude')].item()
-    d_station_long = df_end_station.loc[:, ('longitude')].item()
-    s_station_to_d_station = find_route(s_station_lat, s_station_long, d_station_lat, d_station_long, by_bike)
+        Returns:
+            list: find_route() arguments of the walk to the start station, the ride between the stations and the
+                  walk to the destination.
+        """
+    s_station_lat = float(df.loc[s_station, 'latitude'])
+    s_station_long = float(df.loc[s_station, 'longitude'])
+    d_station_lat = float(df.loc[d_station, 'latitude'])
+    d_station_long = float(df.loc[d_station, 'longitude'])
+
+    return [
+        (s_lat, s_long, s_station_lat, s_station_long, by_foot),
+        (s_station_lat, s_station_long, d_station_lat, d_station_long, by_bike),
+        (d_station_lat, d_station_long, d_lat, d_long, by_foot),
+    ]
+
+
+def route_legs(df, s_lat, s_long, d_lat, d_long, index=None, mask=None, snapshot=None,
+               forecast=availability_forecast):
+    """
+        Chooses the start and end station of a trip and returns its three legs.
+
+        Args:
+            df (DataFrame): The input dataframe containing station data.
+            s_lat (float): The latitude of the source position.
+            s_long (float): The longitude of the source position.
+            d_lat (float): The latitude of the destination position.
+            d_long (float): The longitude of the destination position.
+            index (StationIndex): Optional prebuilt index used for the nearest station search (default: None).
+            mask (ndarray): Optional boolean mask of the stations that may be used, see route_stations()
+                            (default: None).
+            snapshot (StationSnapshot): Optional snapshot the dataframe and the index were taken from
+                                        (default: None).
+            forecast (ForecastCache): The availability forecast of the station choice (default: availability_forecast).
+
+        Returns:
+            list: find_route() arguments of the walk to the start station, the ride between the stations and the
+                  walk to the destination.
+        """
+    s_station, d_station, _ = route_stations(df, s_lat, s_long, d_lat, d_long, index, mask, snapshot, forecast)
+
+    return trip_legs(df, s_lat, s_long, d_lat, d_long, s_station, d_station)
+
+
+def full_route(df, s_lat, s_long, d_lat, d_long, index=None, backend=None, mask=None, snapshot=None,
+               forecast=availability_forecast):
+    """
+        Calculates the full route from the source position to the destination position using bike and foot.
+
+        Args:
+            df (DataFrame): The input dataframe containing station data.
+            s_lat (float): The latitude of the source position.
+            s_long (float): The longitude of the source position.
+            d_lat (float): The latitude of the destination position.
+            d_long (float): The longitude of the destination position.
+            index (StationIndex): Optional prebuilt index used for the nearest station search (default: None).
+            backend: The routing backend, ORSBackend or LocalBackend (default: None, the module's route_backend).
+            mask (ndarray): Optional boolean mask of the stations that may be used, see route_stations()
+                            (default: None).
+            snapshot (StationSnapshot): Optional snapshot the dataframe and the index were taken from
+                                        (default: None).
+            forecast (ForecastCache): The availability forecast of the station choice (default: availability_forecast).
+
+        Returns:
+            tuple: A tuple containing the route segments:
+                - start_to_station (list): The route from the source position to the start station by foot.
+                - s_station_to_d_station (list): The route from the start station to the destination station by bike.
+                - d_station_to_end (list): The route from the end station to the destination position by foot.
+        """
+    legs = route_legs(df, s_lat, s_long, d_lat, d_long, index, mask, snapshot, forecast)
 
-    # Distance from end station to destination position
-    d_station_to_end = find_route(d_station_lat, d_station_long, d_lat, d_long, by_foot)
+    # fetch the walk to the start station, the ride between the stations and the walk to the destination at once
+    start_to_station, s_station_to_d_station, d_station_to_end = find_routes(legs, backend)
 
     return start_to_station, s_station_to_d_station, d_station_to_end
 
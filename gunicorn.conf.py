@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# address to listen on
+bind = os.environ.get('BIKE_MAP_BIND', '0.0.0.0:8000')
+# worker processes, rendering the map is CPU bound
+workers = int(os.environ.get('BIKE_MAP_WORKERS', multiprocessing.cpu_count()))
+# threads per worker. Every open page keeps a change stream (/changes) open, and with the gthread worker each
+# stream holds one of these threads for up to main.change_stream_seconds before the browser reconnects: more
+# open pages than workers x threads starve all other requests. Serve many open pages with the ASGI worker
+# instead (asgi.py), whose change streams hold no thread
+worker_class = 'gthread'
+threads = int(os.environ.get('BIKE_MAP_THREADS', 8))
+# load the app and the station snapshot once in the master, the workers share it copy-on-write
+preload_app = True
+# seconds a request may take, routing requests wait for the routing service
+timeout = 60
+# change streams are long-lived, keep idle keep-alive connections short
+keepalive = 5
+
+# the only process polling the station feeds of all systems and writing the feed files and the availability
+# histories; a new interpreter rather than a fork of the master, which would inherit its signal handlers
+feed_poller_command = [sys.executable, '-c', 'from functions import FeedRefresher; '
+                                             'from main import feed_refresh_interval; '
+                                             'from systems import refresh_systems; '
+                                             'FeedRefresher(feed_refresh_interval, refresh_systems).run()']
+feed_poller = None
+
+
+def when_ready(server):
+    global feed_poller
+    feed_poller = subprocess.Popen(feed_poller_command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.log.info("Feed poller started (pid %s)", feed_poller.pid)
+
+
+def on_exit(server):
+    if feed_poller is not None and feed_poller.poll() is None:
+        feed_poller.terminate()
+        feed_poller.wait(5)
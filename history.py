@@ -0,0 +1,370 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # no fcntl on Windows, only one process may write a history there
+    fcntl = None
+
+import numpy
+import pandas
+
+from columns import station_columns
+
+# folder of the availability history written by get_GeoJSON()
+history_folder = os.path.join("data", "history")
+# counts recorded per station and poll, StationColumns attributes
+history_columns = ['bikes', 'classic_bikes', 'smart_bikes', 'electric_bikes', 'docks']
+# one entry per poll: unix time, first row of the poll in the count files and station layout of the poll
+poll_dtype = numpy.dtype([('time', '<i8'), ('start', '<i8'), ('layout', '<i4'), ('count', '<i4')])
+# dtype of the count files
+count_dtype = numpy.dtype('<i2')
+# dtype of the layout file, the kioskIds of every distinct station layout one after another
+layout_dtype = numpy.dtype('<i4')
+
+
+class AvailabilityHistory:
+    """
+        Append-only, memory-mapped columnar store of the station counts of every poll.
+
+        Every count is a file of int16 values, one per station and poll, in poll order; a poll of n stations
+        appends n values to each file. The poll table holds the time, the first row and the station layout of
+        every poll; the kioskIds of a layout are stored once, as long as stations are not added or removed
+        the polls share it. Files are only appended to, meta.json records the committed sizes and is replaced
+        atomically after every append, so a crash in between leaves at most an uncommitted tail that is cut
+        off by the next append. Appends hold an exclusive lock on the file 'lock' of the folder, so the
+        processes sharing a history (the feed poller, the workers and the dev server) never interleave them.
+
+        Queries read the files through memory maps. Polls are in time order, so a time window is a contiguous
+        row range found by binary search, and the rows of one station are one offset per layout.
+
+        Args:
+            folder (str): The folder of the store, created on the first append (default: history_folder).
+        """
+
+    def __init__(self, folder=history_folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._maps = None
+        self._layouts = []
+        self._meta_stat = None
+        self._meta = self._read_meta()
+
+    def __len__(self):
+        self._refresh()
+        return self._meta['rows']
+
+    @property
+    def polls(self):
+        """
+            Returns the number of recorded polls.
+
+            Returns:
+                int: The number of polls.
+            """
+        self._refresh()
+        return self._meta['polls']
+
+    def append(self, timestamp, kiosk_ids, counts):
+        """
+            Appends the counts of one poll.
+
+            Args:
+                timestamp (int): Unix time of the poll in seconds, later than the last recorded poll.
+                kiosk_ids (ndarray): The kioskIds of the stations.
+                counts (dict): The counts of the stations by history column.
+
+            Returns:
+                bool: True if the poll was recorded, False if it is not newer than the last recorded poll.
+            """
+        kiosk_ids = numpy.asarray(kiosk_ids, dtype=layout_dtype)
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock, self._process_lock():
+            # the polls another process committed while this one waited for the lock
+            self._refresh()
+            if self._meta['polls'] and timestamp <= self._meta['last_time']:
+                return False
+            self._truncate(self._meta)
+            # the new sizes become visible to queries once they are committed to meta.json
+            meta = dict(self._meta, layouts=list(self._meta['layouts']))
+
+            layout = self._layout_id(kiosk_ids)
+            if layout is None:
+                layout = len(meta['layouts'])
+                self._write('layouts.bin', kiosk_ids)
+                meta['layouts'].append([meta['layout_rows'], len(kiosk_ids)])
+                meta['layout_rows'] += len(kiosk_ids)
+
+            for column in history_columns:
+                self._write(f'{column}.bin', numpy.asarray(counts[column]).astype(count_dtype))
+            poll = numpy.array([(timestamp, meta['rows'], layout, len(kiosk_ids))], dtype=poll_dtype)
+            self._write('polls.bin', poll)
+
+            meta['rows'] += len(kiosk_ids)
+            meta['polls'] += 1
+            meta['last_time'] = int(timestamp)
+            self._write_meta(meta)
+            self._meta = meta
+            self._maps = None
+        return True
+
+    def record(self, snapshot, timestamp=None):
+        """
+            Appends the counts of a station snapshot.
+
+            Args:
+                snapshot (StationSnapshot): The polled snapshot.
+                timestamp (int): Unix time of the poll (default: None, now).
+
+            Returns:
+                bool: True if the poll was recorded.
+            """
+        columns = station_columns(snapshot)
+        counts = {column: getattr(columns, column) for column in history_columns}
+        return self.append(int(timestamp if timestamp is not None else time.time()), columns.kiosk_id, counts)
+
+    def station(self, kiosk_id, start=None, end=None):
+        """
+            Returns the recorded counts of one station.
+
+            Args:
+                kiosk_id (int): The kioskId of the station.
+                start (int): First unix time of the window (default: None, from the first poll).
+                end (int): Unix time the window ends before (default: None, up to the last poll).
+
+            Returns:
+                DataFrame: 'time' and the history columns, one row per poll that contained the station.
+            """
+        maps = self._open()
+        first, last = self._poll_range(maps, start, end)
+        polls = maps['polls'][first:last]
+
+        rows, times = [numpy.zeros(0, dtype=numpy.int64)], [numpy.zeros(0, dtype=numpy.int64)]
+        for layout in numpy.unique(polls['layout']):
+            offset = self._offset(maps, layout, kiosk_id)
+            if offset is not None:
+                in_layout = polls[polls['layout'] == layout]
+                rows.append(in_layout['start'] + offset)
+                times.append(in_layout['time'])
+        # rows grow with the poll time
+        rows, times = numpy.concatenate(rows), numpy.concatenate(times)
+        order = numpy.argsort(rows, kind='stable')
+        rows, times = rows[order], times[order]
+
+        frame = {'time': times}
+        for column in history_columns:
+            frame[column] = maps[column][rows]
+        return pandas.DataFrame(frame)
+
+    def window(self, start=None, end=None):
+        """
+            Returns the recorded counts of all stations in a time window.
+
+            Args:
+                start (int): First unix time of the window (default: None, from the first poll).
+                end (int): Unix time the window ends before (default: None, up to the last poll).
+
+            Returns:
+                DataFrame: 'time', 'kioskId' and the history columns, one row per station and poll.
+            """
+        maps = self._open()
+        first, last = self._poll_range(maps, start, end)
+        polls = maps['polls'][first:last]
+        if not len(polls):
+            return pandas.DataFrame({'time': [], 'kioskId': [], **{column: [] for column in history_columns}})
+
+        # the window is one contiguous row range, kioskIds are repeated per run of polls sharing a layout
+        row_start, row_end = int(polls['start'][0]), int(polls['start'][-1] + polls['count'][-1])
+        breaks = numpy.flatnonzero(numpy.diff(polls['layout'])) + 1
+        kiosk_ids = numpy.concatenate([numpy.tile(self._layout(maps, polls['layout'][run[0]]), len(run))
+                                       for run in numpy.split(numpy.arange(len(polls)), breaks)])
+
+        frame = {'time': numpy.repeat(polls['time'], polls['count']), 'kioskId': kiosk_ids}
+        for column in history_columns:
+            frame[column] = numpy.asarray(maps[column][row_start:row_end])
+        return pandas.DataFrame(frame)
+
+    def matrix(self, columns, kiosk_ids, start=None, end=None):
+        """
+            Returns the recorded counts of some stations in a time window as dense poll x station matrices.
+
+            Args:
+                columns (list): The history columns to return.
+                kiosk_ids (ndarray): The kioskIds of the stations, one matrix column each.
+                start (int): First unix time of the window (default: None, from the first poll).
+                end (int): Unix time the window ends before (default: None, up to the last poll).
+
+            Returns:
+                tuple: The poll times and a dict of int16 matrices by column, -1 where a poll did not contain
+                       the station.
+            """
+        maps = self._open()
+        first, last = self._poll_range(maps, start, end)
+        polls = maps['polls'][first:last]
+        kiosk_ids = numpy.asarray(kiosk_ids)
+        matrices = {column: numpy.full((len(polls), len(kiosk_ids)), -1, dtype=count_dtype) for column in columns}
+
+        # every run of polls sharing a layout is one reshaped row range
+        breaks = numpy.flatnonzero(numpy.diff(polls['layout'])) + 1
+        for run in numpy.split(numpy.arange(len(polls)), breaks) if len(polls) else []:
+            layout = int(polls['layout'][run[0]])
+            count = int(polls['count'][run[0]])
+            positions = self._offsets(maps, layout, kiosk_ids)
+            found = positions >= 0
+            row_start = int(polls['start'][run[0]])
+            for column in columns:
+                block = maps[column][row_start:row_start + len(run) * count].reshape(len(run), count)
+                matrices[column][run[0]:run[-1] + 1, found] = block[:, positions[found]]
+        return numpy.asarray(polls['time']), matrices
+
+    def last_layout(self):
+        """
+            Returns the kioskIds of the stations of the last poll.
+
+            Returns:
+                ndarray: The kioskIds, empty if nothing was recorded yet.
+            """
+        maps = self._open()
+        if not len(maps['polls']):
+            return numpy.zeros(0, dtype=layout_dtype)
+        return numpy.asarray(self._layout(maps, int(maps['polls']['layout'][-1])))
+
+    def stats(self):
+        """
+            Returns the size of the store.
+
+            Returns:
+                dict: The number of polls and rows, the station layouts, the first and last poll time and the
+                      bytes on disk.
+            """
+        maps = self._open()
+        polls = maps['polls']
+        return {
+            'polls': self._meta['polls'],
+            'rows': self._meta['rows'],
+            'layouts': len(self._meta['layouts']),
+            'first_time': int(polls['time'][0]) if len(polls) else None,
+            'last_time': self._meta['last_time'] if self._meta['polls'] else None,
+            'bytes': self._meta['rows'] * count_dtype.itemsize * len(history_columns)
+            + self._meta['polls'] * poll_dtype.itemsize + self._meta['layout_rows'] * layout_dtype.itemsize,
+        }
+
+    @contextlib.contextmanager
+    def _process_lock(self):
+        # exclusive across processes, released when the file is closed (also by a crashing process)
+        with open(os.path.join(self.folder, 'lock'), 'a') as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _poll_range(self, maps, start, end):
+        times = maps['polls']['time']
+        first = 0 if start is None else int(numpy.searchsorted(times, start, side='left'))
+        last = len(times) if end is None else int(numpy.searchsorted(times, end, side='left'))
+        return first, max(first, last)
+
+    def _layout(self, maps, layout):
+        layout_start, layout_count = self._meta['layouts'][layout]
+        return maps['layouts'][layout_start:layout_start + layout_count]
+
+    def _offset(self, maps, layout, kiosk_id):
+        # position of a station in a layout
+        position = int(self._offsets(maps, layout, numpy.array([kiosk_id]))[0])
+        return position if position >= 0 else None
+
+    def _offsets(self, maps, layout, kiosk_ids):
+        # positions of stations in a layout (-1 if missing), through a sorter built once per layout
+        while len(self._layouts) <= layout:
+            self._layouts.append(None)
+        if self._layouts[layout] is None:
+            layout_ids = numpy.asarray(self._layout(maps, layout))
+            self._layouts[layout] = (numpy.argsort(layout_ids, kind='stable'), layout_ids)
+        sorter, layout_ids = self._layouts[layout]
+        if not len(layout_ids):
+            return numpy.full(len(kiosk_ids), -1)
+        positions = numpy.minimum(numpy.searchsorted(layout_ids, kiosk_ids, sorter=sorter), len(layout_ids) - 1)
+        positions = sorter[positions]
+        return numpy.where(layout_ids[positions] == kiosk_ids, positions, -1)
+
+    def _layout_id(self, kiosk_ids):
+        # the station layout of the last poll is reused when the stations are the same
+        meta = self._meta
+        if not meta['polls']:
+            return None
+        maps = self._open()
+        layout = int(maps['polls']['layout'][-1])
+        if numpy.array_equal(self._layout(maps, layout), kiosk_ids):
+            return layout
+        return None
+
+    def _refresh(self):
+        # pick up polls committed by another process, e.g. the feed poller of a multi-worker server
+        try:
+            stat = os.stat(os.path.join(self.folder, 'meta.json'))
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) != self._meta_stat:
+            self._meta = self._read_meta()
+            self._maps = None
+
+    def _open(self):
+        self._refresh()
+        maps = self._maps
+        if maps is None:
+            meta = self._meta
+            maps = {'polls': self._map('polls.bin', poll_dtype, meta['polls']),
+                    'layouts': self._map('layouts.bin', layout_dtype, meta['layout_rows'])}
+            for column in history_columns:
+                maps[column] = self._map(f'{column}.bin', count_dtype, meta['rows'])
+            self._maps = maps
+        return maps
+
+    def _map(self, name, dtype, length):
+        if not length:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(os.path.join(self.folder, name), dtype=dtype, mode='r', shape=(length,))
+
+    def _write(self, name, values):
+        with open(os.path.join(self.folder, name), 'ab') as file:
+            file.write(numpy.ascontiguousarray(values).tobytes())
+
+    def _truncate(self, meta):
+        # cut off what an interrupted append wrote after the last commit
+        sizes = {'polls.bin': meta['polls'] * poll_dtype.itemsize,
+                 'layouts.bin': meta['layout_rows'] * layout_dtype.itemsize}
+        for column in history_columns:
+            sizes[f'{column}.bin'] = meta['rows'] * count_dtype.itemsize
+        for name, size in sizes.items():
+            path = os.path.join(self.folder, name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                self._maps = None
+                with open(path, 'r+b') as file:
+                    file.truncate(size)
+
+    def _read_meta(self):
+        path = os.path.join(self.folder, 'meta.json')
+        if os.path.exists(path):
+            with open(path) as file:
+                stat = os.fstat(file.fileno())
+                self._meta_stat = (stat.st_mtime_ns, stat.st_size)
+                return json.load(file)
+        return {'rows': 0, 'polls': 0, 'layout_rows': 0, 'layouts': [], 'last_time': 0,
+                'columns': history_columns}
+
+    def _write_meta(self, meta):
+        path = os.path.join(self.folder, 'meta.json')
+        # unique per process and thread, a concurrent writer never truncates the file before it is swapped in
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, path)
+        stat = os.stat(path)
+        self._meta_stat = (stat.st_mtime_ns, stat.st_size)
+
+
+# the history recorded by the feed polls of the process
+availability_history = AvailabilityHistory()
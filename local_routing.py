@@ -0,0 +1,429 @@
+import heapq
+import json
+import os
+import threading
+import xml.etree.ElementTree
+
+import numpy
+from scipy.spatial import cKDTree
+
+from routing import NoRouteError
+from spatial import project_points
+from station_pairs import haversine
+
+# access bits of a directed edge
+FOOT = 1
+BIKE = 2
+# routing profile of the Open Route Service naming -> access bit
+profile_access = {'foot-walking': FOOT, 'cycling-regular': BIKE}
+
+# OSM highway types closed to pedestrians and to bikes
+no_foot_highways = {'motorway', 'motorway_link', 'trunk', 'trunk_link'}
+no_bike_highways = {'motorway', 'motorway_link', 'footway', 'steps', 'pedestrian', 'corridor'}
+# OSM highway types that form the routable network, other ways (e.g. buildings) are ignored
+routable_highways = {'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary',
+                     'secondary_link', 'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street',
+                     'service', 'road', 'track', 'path', 'footway', 'cycleway', 'bridleway', 'steps', 'pedestrian',
+                     'corridor'}
+
+
+def way_access(tags):
+    """
+        Returns the access bits of a way in its direction of digitization and against it.
+
+        Args:
+            tags (dict): The OSM tags (or GeoJSON properties) of the way.
+
+        Returns:
+            tuple: (forward, backward) access bits.
+        """
+    highway = tags.get('highway', 'residential')
+    access = 0
+    if (highway not in no_foot_highways or tags.get('foot') == 'yes') and tags.get('foot') != 'no':
+        access |= FOOT
+    if (highway not in no_bike_highways or tags.get('bicycle') in ('yes', 'designated')) \
+            and tags.get('bicycle') != 'no':
+        access |= BIKE
+
+    # one-way streets restrict bikes only, pedestrians may walk both ways
+    oneway = str(tags.get('oneway', 'no')).lower()
+    if oneway in ('yes', 'true', '1'):
+        return access, access & ~BIKE
+    if oneway == '-1':
+        return access & ~BIKE, access
+    return access, access
+
+
+class RoadGraph:
+    """
+        Road network in compressed sparse row form.
+
+        Nodes are stored as coordinate arrays, the outgoing edges of node u are indices[indptr[u]:indptr[u + 1]]
+        with their lengths in meters and their access bits (FOOT, BIKE). A KD-tree over the projected node
+        coordinates snaps query positions to the network.
+
+        Args:
+            lonlat (ndarray): (n, 2) node longitudes and latitudes.
+            indptr (ndarray): (n + 1,) offsets of the outgoing edges of every node.
+            indices (ndarray): (m,) target node of every edge.
+            lengths (ndarray): (m,) length of every edge in meters.
+            access (ndarray): (m,) access bits of every edge.
+        """
+
+    def __init__(self, lonlat, indptr, indices, lengths, access):
+        self.lonlat = numpy.ascontiguousarray(lonlat, dtype=numpy.float64)
+        self.indptr = numpy.ascontiguousarray(indptr, dtype=numpy.int64)
+        self.indices = numpy.ascontiguousarray(indices, dtype=numpy.int32)
+        self.lengths = numpy.ascontiguousarray(lengths, dtype=numpy.float32)
+        self.access = numpy.ascontiguousarray(access, dtype=numpy.uint8)
+        x, y = project_points(self.lonlat[:, 1], self.lonlat[:, 0])
+        self.tree = cKDTree(numpy.column_stack((x, y)))
+        # plain lists are much faster than numpy scalars in the search loop
+        self._adjacency = None
+
+    def __len__(self):
+        return len(self.lonlat)
+
+    @classmethod
+    def from_edges(cls, lonlat, sources, targets, access):
+        """
+            Builds the graph from a list of directed edges.
+
+            Args:
+                lonlat (ndarray): (n, 2) node longitudes and latitudes.
+                sources (array-like): Source node of every edge.
+                targets (array-like): Target node of every edge.
+                access (array-like): Access bits of every edge, edges without access are dropped.
+
+            Returns:
+                RoadGraph: The graph.
+            """
+        lonlat = numpy.asarray(lonlat, dtype=numpy.float64).reshape(-1, 2)
+        sources = numpy.asarray(sources, dtype=numpy.int64)
+        targets = numpy.asarray(targets, dtype=numpy.int64)
+        access = numpy.asarray(access, dtype=numpy.uint8)
+        keep = (access != 0) & (sources != targets)
+        sources, targets, access = sources[keep], targets[keep], access[keep]
+
+        order = numpy.argsort(sources, kind='stable')
+        sources, targets, access = sources[order], targets[order], access[order]
+        indptr = numpy.zeros(len(lonlat) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(sources, minlength=len(lonlat)), out=indptr[1:])
+        lengths = haversine(lonlat[sources, 1], lonlat[sources, 0], lonlat[targets, 1], lonlat[targets, 0])
+        return cls(lonlat, indptr, targets, lengths, access)
+
+    def save(self, path):
+        """
+            Saves the graph arrays to a .npz file.
+
+            The arrays are written to a temporary file moved over the path, so other processes never read a
+            partial graph.
+
+            Args:
+                path (str): The file to write.
+            """
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            numpy.savez(file, lonlat=self.lonlat, indptr=self.indptr, indices=self.indices, lengths=self.lengths,
+                        access=self.access)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+            Loads a graph saved with save().
+
+            Args:
+                path (str): The .npz file.
+
+            Returns:
+                RoadGraph: The graph.
+            """
+        with numpy.load(path) as arrays:
+            return cls(arrays['lonlat'], arrays['indptr'], arrays['indices'], arrays['lengths'], arrays['access'])
+
+    def reversed(self):
+        """
+            Returns the graph with every edge turned around, its travel_distances() are distances to the source.
+
+            Returns:
+                RoadGraph: The reversed graph.
+            """
+        sources = numpy.repeat(numpy.arange(len(self)), numpy.diff(self.indptr))
+        return RoadGraph.from_edges(self.lonlat, self.indices, sources, self.access)
+
+    def adjacency(self):
+        """
+            Returns the edge arrays as Python lists for the search loops.
+
+            Returns:
+                tuple: (indptr, indices, lengths, access) lists.
+            """
+        if self._adjacency is None:
+            self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.lengths.tolist(),
+                               self.access.tolist())
+        return self._adjacency
+
+    def nearest_node(self, lat, long):
+        """
+            Snaps a position to the nearest node of the network.
+
+            Args:
+                lat (float): The latitude of the position.
+                long (float): The longitude of the position.
+
+            Returns:
+                int: The node id.
+            """
+        x, y = project_points(lat, long)
+        return int(self.tree.query((float(x), float(y)))[1])
+
+    def shortest_path(self, source, target, profile):
+        """
+            Finds the shortest path between two nodes with A*, guided by the great-circle distance to the target.
+
+            Args:
+                source (int): The source node.
+                target (int): The target node.
+                profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+
+            Returns:
+                tuple: (list of node ids, length in meters).
+
+            Raises:
+                NoRouteError: If the target cannot be reached with the profile.
+            """
+        bit = profile_access[profile]
+        indptr, indices, lengths, access = self.adjacency()
+        # the great-circle distance never overestimates the remaining length, so the first path found is optimal
+        remaining = haversine(self.lonlat[:, 1], self.lonlat[:, 0],
+                              self.lonlat[target, 1], self.lonlat[target, 0]).tolist()
+
+        distance = {source: 0.0}
+        previous = {source: -1}
+        heap = [(remaining[source], 0.0, source)]
+        while heap:
+            estimate, length, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if length > distance[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                if not access[edge] & bit:
+                    continue
+                neighbour = indices[edge]
+                candidate = length + lengths[edge]
+                if candidate < distance.get(neighbour, float('inf')):
+                    distance[neighbour] = candidate
+                    previous[neighbour] = node
+                    heapq.heappush(heap, (candidate + remaining[neighbour], candidate, neighbour))
+        else:
+            raise NoRouteError(f"no {profile} route between node {source} and node {target}")
+
+        path = [target]
+        while previous[path[-1]] != -1:
+            path.append(previous[path[-1]])
+        path.reverse()
+        return path, distance[target]
+
+    def travel_distances(self, source, profile, max_distance):
+        """
+            Finds the network distance from a node to every node within max_distance (Dijkstra with a cutoff).
+
+            Args:
+                source (int): The source node.
+                profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+                max_distance (float): The search radius along the network in meters.
+
+            Returns:
+                dict: Node id -> distance in meters of every reached node.
+            """
+        bit = profile_access[profile]
+        indptr, indices, lengths, access = self.adjacency()
+        distance = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap:
+            length, node = heapq.heappop(heap)
+            if length > distance[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                if not access[edge] & bit:
+                    continue
+                neighbour = indices[edge]
+                candidate = length + lengths[edge]
+                if candidate <= max_distance and candidate < distance.get(neighbour, float('inf')):
+                    distance[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, neighbour))
+        return distance
+
+    def route(self, source_lat, source_long, dest_lat, dest_long, profile):
+        """
+            Finds the route between two positions.
+
+            Args:
+                source_lat (float): The latitude of the source location.
+                source_long (float): The longitude of the source location.
+                dest_lat (float): The latitude of the destination location.
+                dest_long (float): The longitude of the destination location.
+                profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+
+            Returns:
+                tuple: ((n, 2) array of (latitude, longitude) coordinates, length in meters).
+
+            Raises:
+                NoRouteError: If the destination cannot be reached with the profile.
+            """
+        path, length = self.shortest_path(self.nearest_node(source_lat, source_long),
+                                          self.nearest_node(dest_lat, dest_long), profile)
+        coordinates = numpy.empty((len(path) + 2, 2))
+        coordinates[0] = source_lat, source_long
+        coordinates[1:-1] = self.lonlat[path][:, ::-1]
+        coordinates[-1] = dest_lat, dest_long
+        return coordinates, length
+
+
+class GraphBuilder:
+    """
+        Collects ways and turns them into a RoadGraph, sharing nodes between ways with equal coordinates.
+        """
+
+    def __init__(self):
+        self.nodes = {}
+        self.lonlat = []
+        self.sources = []
+        self.targets = []
+        self.access = []
+
+    def node(self, long, lat):
+        key = (round(long, 7), round(lat, 7))
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = len(self.lonlat)
+            self.lonlat.append(key)
+        return node
+
+    def add_way(self, coordinates, tags):
+        """
+            Adds a way given as a list of (longitude, latitude) positions.
+
+            Args:
+                coordinates (list): The positions of the way.
+                tags (dict): The OSM tags (or GeoJSON properties) of the way.
+            """
+        forward, backward = way_access(tags)
+        nodes = [self.node(position[0], position[1]) for position in coordinates]
+        for u, v in zip(nodes, nodes[1:]):
+            self.sources += (u, v)
+            self.targets += (v, u)
+            self.access += (forward, backward)
+
+    def build(self):
+        return RoadGraph.from_edges(self.lonlat, self.sources, self.targets, self.access)
+
+
+def load_geojson_graph(path):
+    """
+        Builds a road graph from the LineString / MultiLineString features of a GeoJSON file.
+
+        Args:
+            path (str): The GeoJSON file, feature properties are read like OSM tags (highway, oneway, foot, bicycle).
+
+        Returns:
+            RoadGraph: The graph.
+        """
+    with open(path) as file:
+        features = json.load(file)['features']
+
+    builder = GraphBuilder()
+    for feature in features:
+        geometry = feature.get('geometry') or {}
+        tags = feature.get('properties') or {}
+        if geometry.get('type') == 'LineString':
+            builder.add_way(geometry['coordinates'], tags)
+        elif geometry.get('type') == 'MultiLineString':
+            for line in geometry['coordinates']:
+                builder.add_way(line, tags)
+    return builder.build()
+
+
+def load_osm_graph(path):
+    """
+        Builds a road graph from the highway ways of an OSM XML extract.
+
+        Args:
+            path (str): The .osm file.
+
+        Returns:
+            RoadGraph: The graph.
+        """
+    positions = {}
+    builder = GraphBuilder()
+    for event, element in xml.etree.ElementTree.iterparse(path, events=('end',)):
+        if element.tag == 'node':
+            positions[element.get('id')] = (float(element.get('lon')), float(element.get('lat')))
+        elif element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if tags.get('highway') in routable_highways:
+                refs = [nd.get('ref') for nd in element.iter('nd')]
+                builder.add_way([positions[ref] for ref in refs if ref in positions], tags)
+        if element.tag in ('node', 'way', 'relation'):
+            element.clear()
+    return builder.build()
+
+
+def load_road_graph(path):
+    """
+        Loads a road graph from an OSM extract (.osm) or a GeoJSON file.
+
+        The parsed graph is cached next to the source as `<path>.npz` and reused as long as the source is unchanged.
+
+        Args:
+            path (str): The graph source file.
+
+        Returns:
+            RoadGraph: The graph.
+        """
+    cache_file = f'{path}.npz'
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(path):
+        return RoadGraph.load(cache_file)
+
+    graph = load_osm_graph(path) if path.endswith('.osm') else load_geojson_graph(path)
+    try:
+        graph.save(cache_file)
+    except OSError:
+        pass
+    return graph
+
+
+class LocalBackend:
+    """
+        Routing backend answering route queries in-process on a local road graph.
+
+        Args:
+            graph (RoadGraph): The road network.
+        """
+    name = 'local'
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_road_graph(path))
+
+    def route(self, source_lat, source_long, dest_lat, dest_long, travel_type):
+        """
+            Finds the route of a leg on the local graph.
+
+            Args:
+                source_lat (float): The latitude of the source location.
+                source_long (float): The longitude of the source location.
+                dest_lat (float): The latitude of the destination location.
+                dest_long (float): The longitude of the destination location.
+                travel_type (str): The routing profile ('foot-walking' or 'cycling-regular').
+
+            Returns:
+                ndarray: (n, 2) array of (latitude, longitude) coordinates of the route.
+            """
+        coordinates, length = self.graph.route(source_lat, source_long, dest_lat, dest_long, travel_type)
+        return coordinates
@@ -1,111 +1,493 @@
 # ________________Imports________________
-from flask import Flask, render_template
+import asyncio
+import json
+import os
+import time
+
+from flask import Flask, Response, abort, render_template, jsonify, stream_with_context
 from functions import *
+import metrics
+from api import api_blueprint, api_responses
+from cache import LRUCache
+from filters import StationFilter, station_timezone
+from forecast import availability_forecast
+from local_routing import LocalBackend
+from routing import NoRouteError, RoutingError, route_cache
+from spatial import station_index
+from systems import bike_systems, refresh_systems, system_for, system_named
+from table import bike_table_columns, dock_table_columns, render_station_table, station_table_columns, \
+    station_tables
 
 # _______________________________________
 
 # ________________VALUES________________
-# default starting point Los Angeles
-default_latitude, default_longitude = 34.04919, -118.24799
 # default number of k_nearest stations
 k_number_default = 5
+# number of rendered results (map and nearest stations) kept for repeated identical requests
+map_cache_size = 64
+# decimals the positions are rounded to in the result cache key (5 decimals ~ 1 m)
+position_decimals = 5
 # CRS format to calculate routing
 crs_routing_format = "EPSG:4326"
 # CRS format displaying on the Open Street Map
 crs_map_format = "EPSG:3857"
 browser_open = 1
+# seconds between two polls of the station feed
+feed_refresh_interval = 60
+# seconds between two keep-alive comments of an idle change stream
+change_keepalive = 15
+# milliseconds an interrupted change stream client waits before reconnecting
+change_retry = 5000
+# seconds a change stream stays open before the client has to reconnect; behind a threaded WSGI server every
+# open stream holds a thread, the limit keeps open pages from holding them for good
+change_stream_seconds = 60
 # 2 types of Open Route Service Routing ( by foot and by bike)
 by_bike = "cycling-regular"
 by_foot = "foot-walking"
+# routing backend: 'ors' for the Open Route Service API, 'local' for the road graph below
+routing_backend = 'ors'
+# road graph of the local routing backend, an OSM extract (.osm) or GeoJSON file
+road_graph_file = os.path.join('routes', 'test_graph.geojson')
 
 
 # ______________________________________
 
 
-def run_map_viewer():
+def search_parameters(form, timezone=station_timezone):
+    """
+        Reads the search parameters of the input form.
+
+        Args:
+            form (Mapping): The submitted form fields (request.form or a dict of strings).
+            timezone (str): The time zone of the opening hours of the stations (default: station_timezone).
+
+        Returns:
+            dict: The keyword arguments of search_stations() besides the snapshot and the backend.
+        """
+    # Get int inputs from Website
+    rankings = form.get('rankings')
+    drop_if_number = form.get('available_pieces')
+
+    return dict(
+        # Get float inputs from Website
+        latitude=request_lat_long('latitude', form), longitude=request_lat_long('longitude', form),
+        dest_latitude=request_lat_long('destLat', form), dest_longitude=request_lat_long('destLong', form),
+        rankings=int(rankings) if rankings else 3, drop_if_number=int(drop_if_number) if drop_if_number else 1,
+        # Get Checkbox from Website
+        search_bikes=form.get('searchBike') == 'on', search_docks=form.get('searchDocks') == 'on',
+        station_filter=request_station_filter(form, timezone))
+
+
+def search_request(form):
+    """
+        Routes a search to the bike-share system of its position and reads its parameters in the time zone of
+        that system. A search without a position gets the default system and its center as the position.
+
+        Args:
+            form (Mapping): The submitted form fields (request.form or a dict of strings).
+
+        Returns:
+            tuple: The BikeSystem to search in and the search parameters from search_parameters().
+        """
+    system = system_for(request_lat_long('latitude', form), request_lat_long('longitude', form))
+    parameters = search_parameters(form, system.timezone)
+    if not (parameters['latitude'] and parameters['longitude']):
+        parameters['latitude'], parameters['longitude'] = system.center
+    return system, parameters
+
+
+def search_key(snapshot, parameters):
+    """
+        Returns the key of a search in the rendered result cache.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot searched in.
+            parameters (dict): The search parameters from search_parameters().
+
+        Returns:
+            tuple: The key, equal for identical searches on the same snapshot.
+        """
+    return (snapshot.key, round(parameters['latitude'], position_decimals),
+            round(parameters['longitude'], position_decimals), round(parameters['dest_latitude'], position_decimals),
+            round(parameters['dest_longitude'], position_decimals), parameters['rankings'],
+            parameters['search_bikes'], parameters['search_docks'], parameters['drop_if_number'],
+            parameters['station_filter'].key())
+
+
+def search_mask(snapshot, search_bikes, search_docks, drop_if_number, station_filter=None):
+    """
+        Evaluates the filters of a search.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot to search in.
+            search_bikes (bool): Whether stations without enough bikes are dropped.
+            search_docks (bool): Whether stations without enough docks are dropped.
+            drop_if_number (int): Stations with this number of bikes or docks or less are dropped.
+            station_filter (StationFilter): Further conditions the stations must meet (default: None).
+
+        Returns:
+            tuple: The boolean mask of the kept stations over the snapshot's rows and the columns of the table
+                   (see table.py).
+        """
+    station_filter = station_filter or StationFilter()
+    table_columns = station_table_columns
+
+    # Prepare Task 1: Filter stations by bike availability
+    if search_bikes:
+        station_filter &= StationFilter(min_bikes=drop_if_number + 1)
+        table_columns = bike_table_columns
+
+    # Prepare Task 2: Filter stations by dock availability
+    if search_docks:
+        station_filter &= StationFilter(min_docks=drop_if_number + 1)
+        table_columns = dock_table_columns
+
+    # all conditions are evaluated as one mask over the snapshot's rows, no frame is copied
+    with metrics.span('filter'):
+        return station_filter.mask(snapshot), table_columns
+
+
+def render_search(snapshot, latitude, longitude, dest_latitude, dest_longitude, rankings, mask, table_columns,
+                  routes=None):
     """
-        Runs the map viewer application using Flask.
+        Renders the map and the nearest stations table of a search.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot searched in.
+            latitude (float): The latitude of the user's position.
+            longitude (float): The longitude of the user's position.
+            dest_latitude (float): The latitude of the destination (0.0 if no route is requested).
+            dest_longitude (float): The longitude of the destination (0.0 if no route is requested).
+            rankings (int): The number of nearest stations to retrieve.
+            mask (ndarray): The boolean mask of the kept stations from search_mask().
+            table_columns (list): The columns of the nearest stations table.
+            routes (tuple): The walk to the start station, the ride and the walk to the destination
+                            (default: None, no route).
+
+        Returns:
+            tuple: The HTML table of the nearest stations and the HTML document of the map.
+        """
+    df = snapshot.view()
+    index = station_index(snapshot)
+    with metrics.span('map_render'):
+        if routes is not None:
+            route_foot_start, route_bike, route_foot_end = routes
+
+            # Create the HTML map with routing information
+            gdf, m = create_local_html_map(df, latitude, longitude, rankings, dest_latitude, dest_longitude,
+                                           route_bike, route_foot_start, route_foot_end, index, snapshot, mask)
+        else:
+            # Create the HTML map with default values
+            gdf, m = create_local_html_map(df, latitude, longitude, rankings, index=index, snapshot=snapshot,
+                                           mask=mask)
+        map_html = render_map(m)
+
+    # the table shows the columns the filters used to keep, rendered from the snapshot's pre-rendered rows
+    with metrics.span('table_render'):
+        table_html = render_station_table(snapshot, snapshot.frame.index.get_indexer(gdf.index), table_columns)
+
+    return table_html, map_html
+
+
+def search_stations(snapshot, latitude, longitude, dest_latitude, dest_longitude, rankings, search_bikes,
+                    search_docks, drop_if_number, backend=None, station_filter=None, forecast=availability_forecast):
+    """
+        Filters the stations, computes the route if a destination is given and renders the map.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot to search in.
+            latitude (float): The latitude of the user's position.
+            longitude (float): The longitude of the user's position.
+            dest_latitude (float): The latitude of the destination (0.0 if no route is requested).
+            dest_longitude (float): The longitude of the destination (0.0 if no route is requested).
+            rankings (int): The number of nearest stations to retrieve.
+            search_bikes (bool): Whether stations without enough bikes are dropped.
+            search_docks (bool): Whether stations without enough docks are dropped.
+            drop_if_number (int): Stations with this number of bikes or docks or less are dropped.
+            backend: The routing backend (default: None, the default backend of functions.py).
+            station_filter (StationFilter): Further conditions the stations must meet (default: None).
+            forecast (ForecastCache): The availability forecast of the station choice, the one of the snapshot's
+                                      system (default: availability_forecast).
+
+        Returns:
+            tuple: The HTML table of the nearest stations and the HTML document of the map.
+        """
+    mask, table_columns = search_mask(snapshot, search_bikes, search_docks, drop_if_number, station_filter)
+    routes = None
+
+    # Prepare Task 3: Routing from Source to Destination
+    if dest_longitude and dest_latitude:
+        routes = full_route(snapshot.view(), latitude, longitude, dest_latitude, dest_longitude,
+                            station_index(snapshot), backend, mask, snapshot, forecast)
+
+    return render_search(snapshot, latitude, longitude, dest_latitude, dest_longitude, rankings, mask,
+                         table_columns, routes)
+
+
+async def search_stations_async(snapshot, latitude, longitude, dest_latitude, dest_longitude, rankings,
+                                search_bikes, search_docks, drop_if_number, client, backend=None,
+                                station_filter=None, executor=None, forecast=availability_forecast):
+    """
+        search_stations() for a running event loop: the station choice and the rendering run in an executor,
+        the legs of the route are awaited concurrently, so a request waiting for the routing service holds no
+        thread.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot to search in.
+            latitude (float): The latitude of the user's position.
+            longitude (float): The longitude of the user's position.
+            dest_latitude (float): The latitude of the destination (0.0 if no route is requested).
+            dest_longitude (float): The longitude of the destination (0.0 if no route is requested).
+            rankings (int): The number of nearest stations to retrieve.
+            search_bikes (bool): Whether stations without enough bikes are dropped.
+            search_docks (bool): Whether stations without enough docks are dropped.
+            drop_if_number (int): Stations with this number of bikes or docks or less are dropped.
+            client (httpx.AsyncClient): The client of the requests to the routing service.
+            backend: The routing backend (default: None, the default backend of functions.py).
+            station_filter (StationFilter): Further conditions the stations must meet (default: None).
+            executor (Executor): The executor of the station choice and the rendering (default: None, the
+                                 event loop's default executor).
+            forecast (ForecastCache): The availability forecast of the station choice, the one of the snapshot's
+                                      system (default: availability_forecast).
+
+        Returns:
+            tuple: The HTML table of the nearest stations and the HTML document of the map.
+
+        Raises:
+            asyncio.TimeoutError: If a leg of the route took longer than route_leg_timeout.
+        """
+    loop = asyncio.get_running_loop()
+    mask, table_columns = search_mask(snapshot, search_bikes, search_docks, drop_if_number, station_filter)
+    routes = None
+
+    if dest_longitude and dest_latitude:
+        # bound to the request's context, so the spans of the executor threads are part of its timing
+        legs = await loop.run_in_executor(executor, metrics.bound(route_legs), snapshot.view(), latitude,
+                                          longitude, dest_latitude, dest_longitude, station_index(snapshot), mask,
+                                          snapshot, forecast)
+        routes = await find_routes_async(legs, client, backend)
+
+    return await loop.run_in_executor(executor, metrics.bound(render_search), snapshot, latitude, longitude,
+                                      dest_latitude, dest_longitude, rankings, mask, table_columns, routes)
+
+
+def change_messages(diffs, version):
+    """
+        Renders snapshot diffs as server-sent events of the change stream.
+
+        Args:
+            diffs (list): The SnapshotDiffs newer than the version, oldest first, see ChangeLog.since().
+            version (int): The last version the client has seen.
+
+        Returns:
+            tuple: The events and the version of the last one.
+        """
+    if diffs[0].base_version > version:
+        # the client missed diffs that are not kept anymore, it has to reload the page
+        return f"id: {diffs[-1].version}\nevent: reload\ndata: {{}}\n\n", diffs[-1].version
+    messages = [f"id: {diff.version}\nevent: stations\ndata: {json.dumps(station_changes(diff))}\n\n"
+                for diff in diffs]
+    return ''.join(messages), diffs[-1].version
+
+
+def request_system():
+    """
+        Returns the bike-share system named by the system query parameter of the request.
+
+        Returns:
+            BikeSystem: The system, the default one without the parameter.
+
+        Raises:
+            NotFound: If no system has that name.
+        """
+    try:
+        return system_named(request.args.get('system'))
+    except KeyError:
+        abort(404, f"Unknown system: {request.args.get('system')}")
+
+
+def create_app(backend=None):
+    """
+        Creates the map viewer application.
 
         The function sets up a Flask web application and defines routes for handling user requests.
-        It creates a GeoDataFrame from the retrieved GeoJSON data and initializes the map with default values.
-        The function handles user inputs from the website, performs data filtering and routing tasks,
-        and generates the HTML map to be rendered on the website.
+        The station data is read from the process-wide snapshot store, so the app can be created once per
+        process and served by any WSGI server. It handles user inputs from the website, performs data
+        filtering and routing tasks, and generates the HTML map to be rendered on the website.
+
+        Args:
+            backend: The routing backend (default: None, chosen by routing_backend).
 
+        Returns:
+            Flask: The application.
         """
 
     app = Flask(__name__)
 
+    # routing backend used for all route requests
+    if backend is None:
+        backend = LocalBackend.from_file(road_graph_file) if routing_backend == 'local' else ORSBackend()
+
     @app.route('/favicon.ico')
     def ignore_favicon():
         return app.response_class(status=204)
 
+    # JSON and GeoJSON endpoints under /api
+    app.register_blueprint(api_blueprint)
+
+    # rendered results of recent requests: (nearest stations table html, map html) by request parameters
+    rendered_maps = LRUCache(map_cache_size)
+    # shared with the asynchronous route requests of asgi.py
+    app.extensions['rendered_maps'] = rendered_maps
+    app.extensions['route_backend'] = backend
+    # road network of the precomputed service areas (/api/reachable)
+    app.extensions['road_graph_file'] = road_graph_file
+
+    if metrics.server_timing:
+        @app.before_request
+        def start_timing():
+            metrics.start_request()
+
+    @app.after_request
+    def count_request(response):
+        metrics.count('requests_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+        timing = metrics.server_timing_header()
+        if timing:
+            response.headers['Server-Timing'] = timing
+        return response
+
     @app.route('/', methods=['GET', 'POST'])
     def index():
 
-        # Create the initial GeoDataFrame
-        df = create_dataframe()
         if request.method == 'POST':
+            # the snapshot of the system of the position, with its spatial index and derived structures
+            system, parameters = search_request(request.form)
+            snapshot = system.store.get()
+
+            # identical requests on the same snapshot get the already rendered result
+            request_key = search_key(snapshot, parameters)
+            result = rendered_maps.get(request_key)
+            if result is None:
+                try:
+                    result = search_stations(snapshot, backend=backend, forecast=system.forecast, **parameters)
+                except NoRouteError:
+                    # the road network does not connect the stations, show the form again with a message
+                    return default_page(system, "No route found between the chosen stations, try other "
+                                                "positions."), 422
+                except RoutingError:
+                    # an error response of the routing service, e.g. an exhausted quota
+                    return default_page(system, "The routing service is not available, try again later."), 502
+                rendered_maps.put(request_key, result)
+            table_html, map_html = result
+
+            with metrics.span('template_render'):
+                return render_template('index.html', latitude=parameters['latitude'],
+                                       longitude=parameters['longitude'], search_bikes=parameters['search_bikes'],
+                                       search_docks=parameters['search_docks'], df_html=table_html,
+                                       map_html=map_html, snapshot_version=snapshot.version, system=system.name)
+
+        return default_page(request_system())
+
+    def default_page(system, error=None):
+        # Create the HTML map with default values of the system
+        snapshot = system.store.get()
+        latitude, longitude = system.center
+        request_key = (snapshot.key, latitude, longitude, k_number_default)
+        result = rendered_maps.get(request_key)
+        if result is None:
+            with metrics.span('map_render'):
+                gdf, m = create_local_html_map(snapshot.view(), latitude, longitude, k_number_default,
+                                               index=station_index(snapshot), snapshot=snapshot)
+                map_html = render_map(m)
+            with metrics.span('table_render'):
+                result = render_station_table(snapshot, snapshot.frame.index.get_indexer(gdf.index)), map_html
+            rendered_maps.put(request_key, result)
+        table_html, map_html = result
+
+        with metrics.span('template_render'):
+            return render_template('index.html', latitude=latitude, longitude=longitude, df_html=table_html,
+                                   map_html=map_html, snapshot_version=snapshot.version, system=system.name,
+                                   error=error)
+
+    @app.route('/changes')
+    def station_change_stream():
+        store = request_system().store
+        # clients resume after the last event they got, new clients start at the current snapshot
+        last_event = request.headers.get('Last-Event-ID') or request.args.get('since')
+        if last_event and not last_event.isdigit():
+            abort(400, 'since must be a snapshot version')
+        version = int(last_event) if last_event else store.get().version
 
-            # Get float inputs from Website
-            latitude = request_lat_long('latitude')
-            longitude = request_lat_long('longitude')
-            dest_latitude = request_lat_long('destLat')
-            dest_longitude = request_lat_long('destLong')
-
-            # Get int inputs from Website
-            rankings = request.form.get('rankings')
-            rankings = int(rankings) if rankings else 3
-            drop_if_number = request.form.get('available_pieces')
-            drop_if_number = int(drop_if_number) if drop_if_number else 1
-
-            # Get Checkbox from Website
-            search_bikes = request.form.get('searchBike') == 'on'
-            search_docks = request.form.get('searchDocks') == 'on'
-
-            # Prepare Task 1: Filter stations by bike availability
-            if search_bikes:
-                print("Task 1:")
-                df = select_bikes(df, drop_if_number)
-
-            # Prepare Task 2: Filter stations by dock availability
-            if search_docks:
-                print("Task 2:")
-                df = select_docks(df, drop_if_number)
-            # Prepare Task 3: Routing from Source to Destination
-            if dest_longitude and dest_latitude:
-                print("Task 3:")
-                print("________________________ROUTING STARTED________________________")
-                # Perform routing tasks
-                route_foot_start, route_bike, route_foot_end = full_route(df, latitude, longitude, dest_latitude,
-                                                                          dest_longitude)
-                print("__________________________ROUTING END__________________________")
-
-                # Create the HTML map with routing information
-                gdf, m = create_local_html_map(df, latitude or default_latitude, longitude or default_longitude,
-                                               rankings, dest_latitude, dest_longitude, route_bike, route_foot_start,
-                                               route_foot_end)
-            else:
-                # Create the HTML map with default values
-                gdf, m = create_local_html_map(df, latitude or default_latitude, longitude or default_longitude,
-                                               rankings)
-
-            return render_template('index.html', latitude=latitude, longitude=longitude,
-                                   search_bikes=search_bikes, search_docks=search_docks,
-                                   df_html=gdf.to_html(index=False))
-
-        # Create the HTML map with default values
-        gdf, m = create_local_html_map(df, default_latitude, default_longitude, k_number_default)
-
-        return render_template('index.html', latitude=default_latitude, longitude=default_longitude,
-                               df_html=gdf.to_html(index=False))
-
-    if __name__ == '__main__':
+        def events(version):
+            yield f"retry: {change_retry}\n\n"
+            # the stream ends after change_stream_seconds, the browser reconnects with the Last-Event-ID
+            deadline = time.monotonic() + change_stream_seconds
+            while time.monotonic() < deadline:
+                diffs = store.changes.since(version, timeout=min(change_keepalive, deadline - time.monotonic()))
+                if not diffs:
+                    # the feed is written by another process (the gunicorn feed poller), a changed file only
+                    # becomes a diff when this process reloads it
+                    store.get()
+                    yield ": keep-alive\n\n"
+                    continue
+                messages, version = change_messages(diffs, version)
+                yield messages
+
+        return Response(stream_with_context(events(version)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/stats')
+    def snapshot_stats():
+        # hit / miss / reload counters of the station snapshot, the rendered maps and the API responses, size of
+        # the history; of the default system and by system
+        default = system_named(None)
+        return jsonify(snapshot=default.store.stats(), maps=rendered_maps.stats(), api=api_responses.stats(),
+                       history=default.history.stats(),
+                       systems={name: dict(snapshot=system.store.stats(), history=system.history.stats())
+                                for name, system in bike_systems.items()})
+
+    @app.route('/metrics')
+    def metrics_text():
+        # spans and counters of this process in the Prometheus text format, with the cache counters
+        samples = []
+        for name, system in bike_systems.items():
+            snapshot = system.store.stats()
+            samples += [('snapshot_version', {'system': name}, snapshot['version']),
+                        ('snapshot_stations', {'system': name}, snapshot['stations'])]
+            samples += [(sample, dict(labels, system=name), value)
+                        for sample, labels, value in metrics.cache_samples('snapshot', snapshot)]
+        for name, cache in (('maps', rendered_maps), ('api', api_responses), ('tables', station_tables),
+                            ('routes', route_cache), ('markers', marker_fragments), ('layers', station_layers)):
+            samples += metrics.cache_samples(name, cache.stats())
+        return Response(metrics.registry.render(samples), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+def run_map_viewer():
+    """
+        Runs the map viewer with the Flask development server: debugger, reloader and a browser window.
+
+        The reloader runs this function in a watching parent process and again in the serving child process.
+        Only the child polls the feeds, so the feed files and the histories have a single writer; the parent
+        opens the browser.
+
+        Production serving goes through wsgi.py instead.
+        """
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if serving:
+        # retrieves the GeoJSon Stationdata of all systems
+        refresh_systems()
+    app = create_app()
+    if serving:
+        # keep the station data of all systems up to date while the server runs
+        FeedRefresher(feed_refresh_interval, refresh_systems).start()
+    else:
         open_browser()
-        app.run(debug=True)
+    app.run(debug=True)
 
 
-# retrieves the GeoJSon Stationdata
-get_GeoJSON()
-# run
-run_map_viewer()
-input("Press Enter to exit...")
+if __name__ == '__main__':
+    # run
+    run_map_viewer()
+    input("Press Enter to exit...")
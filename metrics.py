@@ -0,0 +1,274 @@
+"""
+    Timing spans and counters of the request path, exported in the Prometheus text format.
+
+    A span times a stage of a request (feed load, filtering, nearest search, routing, map and template
+    render) into a histogram per stage. While a request is being timed (start_request()), the spans of its
+    context are also collected for its Server-Timing header. Counters count events such as calls to the
+    routing service and their failures. Counters kept elsewhere (the hit and miss counts of the caches) are
+    passed in as samples when the metrics are rendered, so the hot path does not count them twice.
+
+    Every process keeps its own metrics: behind gunicorn, /metrics shows the numbers of the worker that
+    answered the scrape.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import math
+import numbers
+import os
+import threading
+import timeit
+
+# upper bounds of the span histogram buckets in seconds
+span_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# prefix of all exported metric names
+metric_prefix = 'bike_map_'
+# whether responses get a Server-Timing header with the spans of the request
+server_timing = os.environ.get('BIKE_MAP_SERVER_TIMING', '') not in ('', '0')
+
+# type and help text of the exported metrics, by name without the prefix
+metric_descriptions = {
+    'span_seconds': ('histogram', 'Duration of the stages of the request path.'),
+    'requests_total': ('counter', 'Answered requests by endpoint and status.'),
+    'ors_requests_total': ('counter', 'Requests to the OpenRouteService API by profile.'),
+    'ors_failures_total': ('counter', 'Failed requests to the OpenRouteService API by reason.'),
+    'feed_polls_total': ('counter', 'Polls of the station feeds by system and outcome.'),
+    'cache_hits_total': ('counter', 'Hits of the caches.'),
+    'cache_misses_total': ('counter', 'Misses of the caches.'),
+    'cache_entries': ('gauge', 'Entries of the caches.'),
+    'snapshot_version': ('gauge', 'Version of the current station snapshot by system.'),
+    'snapshot_stations': ('gauge', 'Stations of the current station snapshot by system.'),
+}
+
+# the spans of the request being timed in this context: list of (name, seconds), None if not timed
+request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class Histogram:
+    """
+        Cumulative bucket counts, sum and count of observed durations.
+        """
+
+    def __init__(self):
+        self.buckets = [0] * (len(span_buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(span_buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry:
+    """
+        The counters and histograms of a process.
+        """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def count(self, name, value=1, **labels):
+        """
+            Increments a counter.
+
+            Args:
+                name (str): The metric name, a key of metric_descriptions.
+                value (float): The increment (default: 1).
+                **labels (str): The labels of the counter.
+            """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds):
+        # adds a duration to the histogram of a span
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, samples=()):
+        """
+            Renders all metrics in the Prometheus text exposition format.
+
+            Args:
+                samples (iterable): Further (name, labels dict, value) samples, e.g. cache_samples().
+
+            Returns:
+                str: The metrics.
+            """
+        with self._lock:
+            counters = [(name, dict(labels), value) for (name, labels), value in self._counters.items()]
+            histograms = {span: (list(h.buckets), h.sum, h.count) for span, h in self._histograms.items()}
+        samples = counters + list(samples)
+
+        by_name = {}
+        for name, labels, value in samples:
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        if histograms:
+            lines += header('span_seconds')
+            for span, (buckets, total, count) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket in zip(span_buckets + (float('inf'),), buckets):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(sample('span_seconds_bucket', {'span': span, 'le': le}, cumulative))
+                lines.append(sample('span_seconds_sum', {'span': span}, total))
+                lines.append(sample('span_seconds_count', {'span': span}, count))
+        for name in sorted(by_name):
+            lines += header(name)
+            lines += [sample(name, labels, value)
+                      for labels, value in sorted(by_name[name], key=lambda item: sorted(item[0].items()))]
+        return '\n'.join(lines) + '\n'
+
+
+def header(name):
+    kind, help_text = metric_descriptions.get(name, ('untyped', ''))
+    return [f'# HELP {metric_prefix}{name} {help_text}', f'# TYPE {metric_prefix}{name} {kind}']
+
+
+def sample(name, labels, value):
+    # one line of the exposition format, label values escaped
+    if labels:
+        pairs = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n')) for key, label in labels.items())
+        return f'{metric_prefix}{name}{{{pairs}}} {sample_value(value)}'
+    return f'{metric_prefix}{name} {sample_value(value)}'
+
+
+def sample_value(value):
+    # integers in full, floats with the digits that round-trip, infinities and NaN as the format spells them
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+# the metrics of this process
+registry = Registry()
+
+
+@contextlib.contextmanager
+def span(name, timing=True):
+    """
+        Times a stage of the request path.
+
+        Args:
+            name (str): The stage.
+            timing (bool): Whether the span is part of the Server-Timing header of the request, False for
+                           stages running concurrently with other spans of the request (default: True).
+        """
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        seconds = timeit.default_timer() - start
+        registry.observe(name, seconds)
+        spans = request_spans.get()
+        if timing and spans is not None:
+            spans.append((name, seconds))
+
+
+def timed(name, timing=True):
+    """
+        Decorator timing every call of a function as a span.
+
+        Args:
+            name (str): The stage.
+            timing (bool): See span() (default: True).
+
+        Returns:
+            function: Decorator function.
+        """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            with span(name, timing):
+                return func(*args, **kwargs)
+
+        return timed_func
+
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """
+        Increments a counter of the process registry.
+
+        Args:
+            name (str): The metric name, a key of metric_descriptions.
+            value (float): The increment (default: 1).
+            **labels (str): The labels of the counter.
+        """
+    registry.count(name, value, **labels)
+
+
+def start_request():
+    # starts collecting the spans of the request of this context
+    request_spans.set([])
+
+
+def bound(func):
+    """
+        Binds a function to the current context, so the spans it records in an executor thread belong to the
+        request that submitted it.
+
+        Args:
+            func (callable): The function.
+
+        Returns:
+            callable: The function run in a copy of the current context.
+        """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def server_timing_header():
+    """
+        Returns the Server-Timing header value of the request of this context.
+
+        Spans of the same stage are summed.
+
+        Returns:
+            str: The header value, None if the request is not timed or has no spans.
+        """
+    spans = request_spans.get()
+    if not spans:
+        return None
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in totals.items())
+
+
+def cache_samples(name, stats):
+    """
+        Samples of the counters of a cache.
+
+        Args:
+            name (str): The cache label.
+            stats (dict): The stats() of the cache, hits, misses and optionally entries.
+
+        Returns:
+            list: The (name, labels, value) samples.
+        """
+    samples = [('cache_hits_total', {'cache': name}, stats['hits']),
+               ('cache_misses_total', {'cache': name}, stats['misses'])]
+    if 'entries' in stats:
+        samples.append(('cache_entries', {'cache': name}, stats['entries']))
+    return samples
@@ -0,0 +1,390 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import LRUCache
+
+# folder of the on-disk route cache
+route_cache_folder = os.path.join("routes", "cache")
+# seconds a cached route stays valid
+route_cache_ttl = 24 * 60 * 60
+# number of routes kept in memory
+route_cache_size = 4096
+# max number of route files and their max total bytes in the on-disk cache, beyond either the expired and then the
+# oldest files are deleted
+route_cache_files = 50000
+route_cache_bytes = 512 * 1024 * 1024
+# fraction of both limits the on-disk cache is shrunk to, so an eviction frees room for many routes
+route_cache_low_water = 0.9
+# seconds between two scans of the on-disk cache; the workers of a server share the folder, a scan counts the
+# routes the other workers wrote
+route_cache_scan_seconds = 300
+# decimals the leg end points are snapped to in the cache key (4 decimals ~ 11 m)
+route_snap_decimals = 4
+# max number of route requests running at the same time
+route_workers = 16
+# max number of open connections of the asynchronous routing client, every route search in flight needs up to
+# three; a leg waiting for a free connection counts against its timeout
+async_route_connections = 512
+
+
+class NoRouteError(ValueError):
+    """
+        Raised by a routing backend when no route connects the two positions of a leg with the profile, e.g.
+        the positions lie on parts of the road network without a connection.
+        """
+
+
+class RoutingError(Exception):
+    """
+        Raised when the routing service answers a leg with an error instead of a route, e.g. a rejected request
+        (400), an exhausted quota (429) or a server error (5xx).
+
+        Args:
+            message (str): The description of the error.
+            status_code (int): The HTTP status of the response.
+        """
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# end of a list of positions: two closing brackets, optionally separated by whitespace
+_line_end = re.compile(rb'\]\s*\]')
+
+
+def decode_route_coordinates(payload):
+    """
+        Extracts features[0].geometry.coordinates from an ORS GeoJSON response without parsing the whole document.
+
+        The coordinate array is located in the raw bytes and converted to floats in one numpy call, the number of
+        values is checked against the number of positions. Responses with an unexpected layout fall back to a full
+        JSON parse.
+
+        Args:
+            payload (bytes): The body of the directions response.
+
+        Returns:
+            ndarray: (n, 2) float64 array of (latitude, longitude) pairs along the route.
+
+        Raises:
+            KeyError, IndexError: If the response contains no route (e.g. an error response).
+            ValueError: If the response is not valid JSON.
+        """
+    try:
+        start = payload.index(b'"coordinates"', payload.index(b'"geometry"', payload.index(b'"features"')))
+        start = payload.index(b'[', start)
+        # a LineString is a list of positions, it ends with the first double closing bracket
+        end = _line_end.search(payload, start).end()
+        coordinates = payload[start:end]
+        # number of values per position (2, or 3 with elevation) and of positions (opening brackets of the list)
+        dimensions = coordinates[:coordinates.index(b']')].count(b',') + 1
+        count = coordinates.count(b'[') - 1
+        # every value is converted, an empty or malformed one raises instead of ending the array early
+        values = numpy.array(coordinates.translate(None, b'[] \n\r\t').split(b','), dtype=numpy.float64)
+        if len(values) != count * dimensions:
+            raise ValueError(f"{len(values)} values for {count} positions of {dimensions} dimensions")
+        positions = values.reshape(count, dimensions)
+    except (ValueError, AttributeError):
+        positions = numpy.asarray(json.loads(payload)['features'][0]['geometry']['coordinates'], dtype=numpy.float64)
+        positions = positions.reshape(-1, positions.shape[-1] if positions.size else 2)
+
+    # Reverse the order of coordinates (longitude, latitude) to (latitude, longitude)
+    return numpy.ascontiguousarray(positions[:, 1::-1])
+
+
+def encode_polyline(coordinates, precision=5):
+    """
+        Encodes route coordinates in the encoded polyline format (as used by Google Maps, OSRM and ORS).
+
+        Every position is stored as the rounded difference to the previous one, each value zigzag encoded and
+        split into 5-bit chunks written as printable characters. All values are encoded at once with numpy.
+
+        Args:
+            coordinates (array-like): (n, 2) array of (latitude, longitude) pairs.
+            precision (int): The number of decimals kept (default: 5, about 1 m).
+
+        Returns:
+            str: The encoded polyline.
+        """
+    values = numpy.round(numpy.asarray(coordinates, dtype=numpy.float64).reshape(-1, 2) * 10 ** precision)
+    deltas = numpy.diff(values.astype(numpy.int64), axis=0, prepend=0).ravel()
+    # zigzag: the sign moves to the lowest bit, so small negative values stay short
+    deltas = (deltas << 1) ^ (deltas >> 63)
+
+    # 5-bit chunks from the lowest up, every chunk but the last of a value flagged with 0x20
+    shifts = numpy.arange(0, 64, 5)
+    remaining = deltas[:, None] >> shifts[None, :]
+    chunks = remaining & 0x1f
+    # a value needs a chunk for every shift leaving bits, and at least one
+    lengths = numpy.maximum(numpy.count_nonzero(remaining, axis=1), 1)
+    used = numpy.arange(len(shifts))[None, :] < lengths[:, None]
+    more = numpy.arange(len(shifts))[None, :] < lengths[:, None] - 1
+    characters = (chunks | numpy.where(more, 0x20, 0)) + 63
+    return characters[used].astype(numpy.uint8).tobytes().decode('ascii')
+
+
+def archive_route(payload, data_file):
+    """
+        Writes a raw routing response to disk, through a temporary file so readers never see a partial file.
+
+        Args:
+            payload (bytes): The body of the directions response.
+            data_file (str): The path of the archive file.
+        """
+    folder = os.path.dirname(data_file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_file = f'{data_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file, 'wb') as file:
+        file.write(payload)
+    os.replace(tmp_file, data_file)
+
+
+def create_session(pool_size=route_workers):
+    """
+        Creates an HTTP session that keeps its connections to the routing service alive.
+
+        Args:
+            pool_size (int): The max number of pooled connections per host.
+
+        Returns:
+            requests.Session: The session.
+        """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def create_async_client(pool_size=async_route_connections, timeout=30):
+    """
+        Creates an asynchronous HTTP client that keeps its connections to the routing service alive.
+
+        The client belongs to the event loop it is used on, create it once the loop runs.
+
+        Args:
+            pool_size (int): The max number of open connections, the route requests waiting on the routing
+                             service at the same time.
+            timeout (float): Seconds to wait for a response.
+
+        Returns:
+            httpx.AsyncClient: The client.
+        """
+    return httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                             timeout=timeout)
+
+
+def route_key(travel_type, source_lat, source_long, dest_lat, dest_long, decimals=route_snap_decimals):
+    """
+        Returns the cache key of a route leg, with both end points snapped to a grid.
+
+        Args:
+            travel_type (str): The routing profile, e.g. 'foot-walking'.
+            source_lat (float): The latitude of the source location.
+            source_long (float): The longitude of the source location.
+            dest_lat (float): The latitude of the destination location.
+            dest_long (float): The longitude of the destination location.
+            decimals (int): The number of decimals the coordinates are rounded to.
+
+        Returns:
+            tuple: The cache key.
+        """
+    return (travel_type,
+            round(float(source_lat), decimals), round(float(source_long), decimals),
+            round(float(dest_lat), decimals), round(float(dest_long), decimals))
+
+
+class RouteCache:
+    """
+        Two-level cache of route coordinates: an in-memory LRU in front of one JSON file per route on disk.
+
+        Both levels expire entries after `ttl` seconds. Routes found on disk are promoted to memory, so a
+        restarted server warms up without calling the routing service again. The files are written on the
+        executor, off the request path; when the folder holds more than max_files files or max_bytes bytes, the
+        expired files and then the oldest ones are deleted.
+
+        Args:
+            folder (str): The folder of the on-disk cache, None to keep routes in memory only.
+            maxsize (int): The max number of routes kept in memory.
+            ttl (float): Seconds a route stays valid.
+            max_files (int): The max number of route files on disk (default: route_cache_files).
+            max_bytes (int): The max total size of the route files on disk (default: route_cache_bytes).
+            executor (Executor): The executor writing the files (default: None, the thread calling put()).
+        """
+
+    def __init__(self, folder=route_cache_folder, maxsize=route_cache_size, ttl=route_cache_ttl,
+                 max_files=route_cache_files, max_bytes=route_cache_bytes, executor=None):
+        self.folder = folder
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.disk_hits = 0
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.evicted = 0
+        # files and bytes on disk as of the last scan plus the files written since, by folder
+        self._disk_lock = threading.Lock()
+        self._disk_folder = None
+        self._disk_files = 0
+        self._disk_bytes = 0
+        self._scanned = 0.0
+
+    def _path(self, key, folder=None):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(folder or self.folder, f'{name}.json')
+
+    def get(self, key):
+        """
+            Returns the cached coordinates of a route.
+
+            Args:
+                key (tuple): The key from route_key().
+
+            Returns:
+                ndarray: The (lat, long) coordinates of the route, or None if the route is not cached.
+            """
+        coordinates = self.memory.get(key)
+        if coordinates is not None or self.folder is None:
+            return coordinates
+
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as file:
+                coordinates = numpy.asarray(json.load(file)['coordinates'], dtype=numpy.float64).reshape(-1, 2)
+            coordinates.setflags(write=False)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        self.disk_hits += 1
+        self.memory.put(key, coordinates)
+        return coordinates
+
+    def put(self, key, coordinates):
+        """
+            Stores the coordinates of a route in memory and on disk.
+
+            Args:
+                key (tuple): The key from route_key().
+                coordinates (ndarray): The (lat, long) coordinates of the route.
+            """
+        # cached routes are shared between requests
+        coordinates = numpy.asarray(coordinates)
+        coordinates.setflags(write=False)
+        self.memory.put(key, coordinates)
+        if self.folder is None:
+            return
+
+        if self.executor is None:
+            self._write(self.folder, key, coordinates)
+        else:
+            self.executor.submit(self._write, self.folder, key, coordinates)
+
+    def _write(self, folder, key, coordinates):
+        # one route file, then the eviction if the folder outgrew its limits
+        os.makedirs(folder, exist_ok=True)
+        path = self._path(key, folder)
+        # write to a temporary file first, so concurrent readers never see a partial route
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+                json.dump({'key': list(key), 'coordinates': coordinates.tolist()}, file)
+                size = file.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Caching the route failed: {e}")
+            return
+
+        with self._disk_lock:
+            if folder != self._disk_folder or time.time() - self._scanned > route_cache_scan_seconds:
+                self._evict(folder)
+                return
+            self._disk_files += 1
+            self._disk_bytes += size
+            if self._disk_files > self.max_files or self._disk_bytes > self.max_bytes:
+                self._evict(folder)
+
+    def _evict(self, folder):
+        """
+            Scans the on-disk cache and shrinks it below the low water mark of both limits if it exceeds one.
+
+            Expired files go first, then the files written longest ago. Called with the disk lock held.
+
+            Args:
+                folder (str): The folder of the on-disk cache.
+            """
+        now = time.time()
+        files = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            # deleted by another worker meanwhile
+                            continue
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        count, total = len(files), sum(size for _, size, _ in files)
+
+        if count > self.max_files or total > self.max_bytes:
+            max_files = int(self.max_files * route_cache_low_water)
+            max_bytes = int(self.max_bytes * route_cache_low_water)
+            # oldest first, the expired files are the oldest
+            files.sort()
+            for mtime, size, path in files:
+                if now - mtime <= self.ttl and count <= max_files and total <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                count -= 1
+                total -= size
+                self.evicted += 1
+
+        self._disk_folder = folder
+        self._disk_files = count
+        self._disk_bytes = total
+        self._scanned = now
+
+    def stats(self):
+        """
+            Returns the counters of the cache.
+
+            Returns:
+                dict: memory hits and misses, disk hits, the number of routes in memory, the evicted route files
+                      and the route files on disk as of the last write.
+            """
+        stats = self.memory.stats()
+        stats['disk_hits'] = self.disk_hits
+        stats['disk_evicted'] = self.evicted
+        stats['disk_files'] = self._disk_files
+        return stats
+
+
+# pooled connections to the routing service, shared by all requests
+ors_session = create_session()
+# threads fetching the legs of a route at the same time
+route_executor = ThreadPoolExecutor(max_workers=route_workers, thread_name_prefix='route')
+# single thread writing raw routing responses and cached routes to disk off the request path
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='route-archive')
+# routes of all requests
+route_cache = RouteCache(executor=archive_executor)
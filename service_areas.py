@@ -0,0 +1,357 @@
+"""
+    Walking and cycling service areas of the stations, precomputed per snapshot on the local road graph.
+
+    For every station the network distance from every node within reach is found once (Dijkstra on the
+    reversed graph, so one-way streets count in the direction of travel towards the station), in a process
+    pool. The result is rasterized into a grid of cells: every cell lists the stations reachable from its
+    center within the precomputed time, ordered by travel time. "Stations within 5 minutes' walk" of a
+    position is then the lookup of its cell. The grids are cached on disk by the road graph and the station
+    positions, station counts do not matter.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from cache import LRUCache
+from columns import station_columns
+from local_routing import load_road_graph
+from spatial import project_points
+from station_pairs import bike_speed, walk_speed
+
+# travel time of the precomputed service areas in minutes, by routing profile
+service_area_minutes = {'foot-walking': 15, 'cycling-regular': 10}
+# average speed in m/s, by routing profile
+profile_speeds = {'foot-walking': walk_speed, 'cycling-regular': bike_speed}
+# edge length of a grid cell in meters
+cell_size = 100.0
+# positions and stations farther than this from the road network (m) are outside the service areas
+snap_distance_max = 300.0
+# processes computing the service areas, the work is CPU bound
+service_area_workers = os.cpu_count() or 1
+# stations handed to a process at once
+service_area_chunk = 16
+# folder of the on-disk cache of the service areas
+service_area_folder = os.path.join("routes", "cache", "service_areas")
+# version of the cache file layout, part of the cache key
+service_area_format = 1
+
+# loaded road graphs and their reversed graphs by path and modification time
+road_graphs = LRUCache(2)
+road_graphs_lock = threading.Lock()
+# graph of the service area processes, set by init_worker()
+worker_graph = None
+
+
+class ServiceAreas:
+    """
+        Grid index of the stations reachable from any position within the precomputed travel time.
+
+        The grid covers the stations' bounding box, extended by the distance travelled in the precomputed time,
+        in the projected CRS of spatial.py. The stations of cell c are stations[indptr[c]:indptr[c + 1]] with
+        their travel times in seconds, ordered by travel time.
+
+        Args:
+            profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+            max_seconds (int): The precomputed travel time.
+            origin (tuple): Projected (x, y) of the lower left corner of the grid.
+            cell (float): Edge length of a cell in projected units.
+            shape (tuple): (rows, columns) of the grid.
+            indptr (ndarray): (rows * columns + 1,) offsets of the stations of every cell.
+            stations (ndarray): Row positions of the stations in the snapshot.
+            seconds (ndarray): Travel time to every station.
+            lonlat (ndarray): (n, 2) station longitudes and latitudes the areas were computed for.
+        """
+
+    def __init__(self, profile, max_seconds, origin, cell, shape, indptr, stations, seconds, lonlat):
+        self.profile = profile
+        self.max_seconds = int(max_seconds)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.cell = float(cell)
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.indptr = indptr
+        self.stations = stations
+        self.seconds = seconds
+        self.lonlat = lonlat
+
+    def __len__(self):
+        return len(self.stations)
+
+    def matches(self, lonlat):
+        # whether the areas were computed for stations at these positions, in this order
+        return self.lonlat.shape == lonlat.shape and numpy.array_equal(self.lonlat, lonlat)
+
+    def cells(self, lats, longs):
+        """
+            Returns the grid cells of positions.
+
+            Args:
+                lats (array-like): The latitudes.
+                longs (array-like): The longitudes.
+
+            Returns:
+                ndarray: The cell of every position, -1 outside the grid.
+            """
+        x, y = project_points(lats, longs)
+        column = numpy.floor((numpy.asarray(x) - self.origin[0]) / self.cell).astype(numpy.int64)
+        row = numpy.floor((numpy.asarray(y) - self.origin[1]) / self.cell).astype(numpy.int64)
+        inside = (row >= 0) & (row < self.shape[0]) & (column >= 0) & (column < self.shape[1])
+        return numpy.where(inside, row * self.shape[1] + column, -1)
+
+    def reachable(self, lat, long, minutes):
+        """
+            Finds the stations reachable from a position.
+
+            Args:
+                lat (float): The latitude of the position.
+                long (float): The longitude of the position.
+                minutes (float): The travel time, at most the precomputed time.
+
+            Returns:
+                tuple: (row positions of the stations, travel times in seconds), ordered by travel time.
+            """
+        cell = int(self.cells(lat, long))
+        if cell < 0:
+            return self.stations[:0], self.seconds[:0]
+        start, end = self.indptr[cell], self.indptr[cell + 1]
+        # the stations of a cell are ordered by travel time
+        end = start + numpy.searchsorted(self.seconds[start:end], minutes * 60, side='right')
+        return self.stations[start:end], self.seconds[start:end]
+
+    def save(self, path):
+        """
+            Saves the grid to a .npz file.
+
+            The grid is written to a temporary file moved over the path, so other processes never read a partial
+            grid.
+
+            Args:
+                path (str): The file to write.
+            """
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            numpy.savez(file, profile=self.profile, max_seconds=self.max_seconds, origin=self.origin,
+                        cell=self.cell, shape=self.shape, indptr=self.indptr, stations=self.stations,
+                        seconds=self.seconds, lonlat=self.lonlat)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+            Loads a grid saved with save().
+
+            Args:
+                path (str): The .npz file.
+
+            Returns:
+                ServiceAreas: The grid.
+            """
+        with numpy.load(path) as arrays:
+            return cls(str(arrays['profile']), arrays['max_seconds'], arrays['origin'], arrays['cell'],
+                       arrays['shape'], arrays['indptr'], arrays['stations'], arrays['seconds'], arrays['lonlat'])
+
+
+def init_worker(graph):
+    global worker_graph
+    worker_graph = graph
+
+
+def node_travel_distances(task):
+    """
+        Runs in a service area process: the network distances to a node from every node within reach.
+
+        Args:
+            task (tuple): (node, profile, max_distance).
+
+        Returns:
+            tuple: (reached nodes, distances in meters).
+        """
+    node, profile, max_distance = task
+    distances = worker_graph.travel_distances(node, profile, max_distance)
+    return (numpy.fromiter(distances.keys(), dtype=numpy.int64, count=len(distances)),
+            numpy.fromiter(distances.values(), dtype=numpy.float64, count=len(distances)))
+
+
+def travel_distances(graph, nodes, profile, max_distance, workers=service_area_workers):
+    """
+        Finds the network distances to nodes in a process pool.
+
+        Args:
+            graph (RoadGraph): The reversed road graph.
+            nodes (ndarray): The target nodes.
+            profile (str): The routing profile.
+            max_distance (float): The search radius along the network in meters.
+            workers (int): The number of processes, 1 to compute in this process (default: service_area_workers).
+
+        Returns:
+            list: (reached nodes, distances) of every node.
+        """
+    tasks = [(int(node), profile, max_distance) for node in nodes]
+    if workers <= 1 or len(tasks) <= 1:
+        init_worker(graph)
+        return [node_travel_distances(task) for task in tasks]
+    # spawned processes do not inherit the threads and locks of a serving process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(graph,)) as executor:
+        return list(executor.map(node_travel_distances, tasks, chunksize=service_area_chunk))
+
+
+def build_service_areas(graph, reversed_graph, lonlat, profile, workers=service_area_workers):
+    """
+        Computes the service area grid of stations.
+
+        The travel time from a cell to a station is the distance from the cell center to its nearest network
+        node, along the network to the node nearest to the station and on to the station, at the speed of the
+        profile.
+
+        Args:
+            graph (RoadGraph): The road graph.
+            reversed_graph (RoadGraph): graph.reversed().
+            lonlat (ndarray): (n, 2) station longitudes and latitudes.
+            profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+            workers (int): The number of processes (default: service_area_workers).
+
+        Returns:
+            ServiceAreas: The grid.
+        """
+    speed = profile_speeds[profile]
+    max_seconds = service_area_minutes[profile] * 60
+    max_distance = max_seconds * speed
+
+    # projected units per meter grow with the latitude (Web Mercator)
+    scale = 1 / numpy.cos(numpy.radians(numpy.mean(lonlat[:, 1]))) if len(lonlat) else 1.0
+    x, y = project_points(lonlat[:, 1], lonlat[:, 0])
+    station_xy = numpy.column_stack((x, y))
+    cell = cell_size * scale
+    margin = max_distance * scale
+    origin = station_xy.min(axis=0) - margin if len(lonlat) else numpy.zeros(2)
+    extent = station_xy.max(axis=0) + margin if len(lonlat) else numpy.zeros(2)
+    columns, rows = numpy.maximum(numpy.ceil((extent - origin) / cell).astype(numpy.int64), 1)
+
+    # snap the cell centers and the stations to the network
+    column, row = numpy.meshgrid(numpy.arange(columns), numpy.arange(rows))
+    centers = origin + (numpy.column_stack((column.ravel(), row.ravel())) + 0.5) * cell
+    cell_snap, cell_node = graph.tree.query(centers, distance_upper_bound=snap_distance_max * scale)
+    station_snap, station_node = graph.tree.query(station_xy, distance_upper_bound=snap_distance_max * scale)
+    snapped = numpy.isfinite(cell_snap)
+    cell_snap = numpy.where(snapped, cell_snap / scale, 0.0)
+
+    # cells by their nearest node
+    order = numpy.flatnonzero(snapped)[numpy.argsort(cell_node[snapped], kind='stable')]
+    node_indptr = numpy.zeros(len(graph) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(cell_node[order], minlength=len(graph)), out=node_indptr[1:])
+
+    # one search per network node, stations sharing their nearest node share it
+    stations = numpy.flatnonzero(numpy.isfinite(station_snap))
+    nodes, station_search = numpy.unique(station_node[stations], return_inverse=True)
+    searches = travel_distances(reversed_graph, nodes, profile, max_distance, workers)
+
+    entry_cells, entry_stations, entry_seconds = [], [], []
+    for position, search in zip(stations, station_search):
+        reached, distances = searches[search]
+        counts = node_indptr[reached + 1] - node_indptr[reached]
+        starts = numpy.repeat(node_indptr[reached], counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        cells = order[starts + offsets]
+        seconds = (numpy.repeat(distances, counts) + cell_snap[cells] + station_snap[position] / scale) / speed
+        keep = seconds <= max_seconds
+        entry_cells.append(cells[keep])
+        entry_stations.append(numpy.full(keep.sum(), position, dtype=numpy.int32))
+        entry_seconds.append(seconds[keep])
+
+    entry_cells = numpy.concatenate(entry_cells) if entry_cells else numpy.zeros(0, dtype=numpy.int64)
+    entry_stations = numpy.concatenate(entry_stations) if entry_stations else numpy.zeros(0, dtype=numpy.int32)
+    entry_seconds = numpy.concatenate(entry_seconds) if entry_seconds else numpy.zeros(0)
+    # by cell, within a cell by travel time
+    order = numpy.lexsort((entry_seconds, entry_cells))
+    indptr = numpy.zeros(rows * columns + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(entry_cells, minlength=rows * columns), out=indptr[1:])
+    return ServiceAreas(profile, max_seconds, origin, cell, (rows, columns), indptr, entry_stations[order],
+                        numpy.ceil(entry_seconds[order]).astype(numpy.uint16), lonlat)
+
+
+def road_graph(path):
+    """
+        Returns a road graph and its reversed graph, loading them once per file version.
+
+        Args:
+            path (str): The graph source file (see local_routing.load_road_graph()).
+
+        Returns:
+            tuple: (RoadGraph, reversed RoadGraph).
+        """
+    key = (path, os.path.getmtime(path))
+    with road_graphs_lock:
+        graphs = road_graphs.get(key)
+        if graphs is None:
+            graph = load_road_graph(path)
+            graphs = graph, graph.reversed()
+            road_graphs.put(key, graphs)
+    return graphs
+
+
+def cache_name(graph, lonlat, profile):
+    # the cache file name of a graph, station positions and profile
+    digest = hashlib.sha1(repr((service_area_format, profile, service_area_minutes[profile],
+                                profile_speeds[profile], cell_size, snap_distance_max)).encode())
+    for array in (graph.lonlat, graph.indptr, graph.indices, graph.access, lonlat):
+        digest.update(numpy.ascontiguousarray(array).tobytes())
+    return f'{profile}-{digest.hexdigest()[:20]}.npz'
+
+
+def load_service_areas(graph_file, lonlat, profile, folder=service_area_folder, workers=service_area_workers):
+    """
+        Returns the service areas of stations from the disk cache, computing and caching them if missing.
+
+        Args:
+            graph_file (str): The road graph source file.
+            lonlat (ndarray): (n, 2) station longitudes and latitudes.
+            profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+            folder (str): The folder of the disk cache, None to not cache (default: service_area_folder).
+            workers (int): The number of processes (default: service_area_workers).
+
+        Returns:
+            ServiceAreas: The grid.
+        """
+    graph, reversed_graph = road_graph(graph_file)
+    path = os.path.join(folder, cache_name(graph, lonlat, profile)) if folder else None
+    if path is not None and os.path.exists(path):
+        try:
+            return ServiceAreas.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    areas = build_service_areas(graph, reversed_graph, lonlat, profile, workers)
+    if path is not None:
+        try:
+            os.makedirs(folder, exist_ok=True)
+            areas.save(path)
+        except OSError:
+            pass
+    return areas
+
+
+def service_areas(snapshot, profile, graph_file):
+    """
+        Returns the service areas of a station snapshot, building them once per snapshot.
+
+        A snapshot whose stations did not move reuses the areas of the previous snapshot.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+            profile (str): The routing profile ('foot-walking' or 'cycling-regular').
+            graph_file (str): The road graph source file.
+
+        Returns:
+            ServiceAreas: The grid index of the snapshot's stations.
+        """
+    def lonlat(s):
+        columns = station_columns(s)
+        return numpy.column_stack((columns.longitude, columns.latitude)).astype(numpy.float64)
+
+    return snapshot.derived(('service_areas', profile, graph_file),
+                            lambda s: load_service_areas(graph_file, lonlat(s), profile),
+                            update=lambda areas, s: areas if areas.matches(lonlat(s)) else None)
@@ -0,0 +1,395 @@
+import collections
+import os
+import threading
+import time
+
+import geopandas
+import numpy
+import pandas
+
+import metrics
+
+# path of the station feed written by get_GeoJSON()
+geo_data_file = os.path.join("data", "geo_data.json")
+# name of the bike-share system of the default feed, Metro Bike Share LA
+default_system = 'metro-la'
+# number of diffs kept for clients of the change stream catching up
+change_log_size = 100
+# feed columns compared between snapshots, the ones the app shows or filters on; bookkeeping columns like
+# kioskUnresponsiveTime would otherwise mark stations as changed on every poll
+diff_columns = ['name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode', 'bikesAvailable',
+                'classicBikesAvailable', 'smartBikesAvailable', 'electricBikesAvailable', 'docksAvailable',
+                'totalDocks', 'kioskPublicStatus', 'openTime', 'closeTime', 'latitude', 'longitude']
+
+
+class StationSnapshot:
+    """
+        One parsed version of the station feed.
+
+        The GeoDataFrame is parsed once and shared by every request. Requests get shallow copies through
+        view(), so adding or replacing columns never touches the shared frame. Structures derived from the
+        snapshot (spatial index, projected coordinates, tables, ...) are built lazily through derived()
+        and live exactly as long as the snapshot itself. A snapshot loaded after another one carries the diff
+        to it, so derived structures can be carried over or patched for the changed stations instead.
+
+        Attributes:
+            version (int): Increasing number of the snapshot, starting with 1.
+            frame (GeoDataFrame): The parsed station feed.
+            source_mtime (int): Modification time (ns) of the feed file the snapshot was parsed from.
+            source_size (int): Size in bytes of the feed file the snapshot was parsed from.
+            diff (SnapshotDiff): The changes since the previous snapshot, None for the first one.
+            loaded_at (float): Unix time the snapshot was created.
+            system (str): Name of the bike-share system of the feed, '' for a store without a name.
+        """
+
+    def __init__(self, version, frame, source_mtime=0, source_size=0, diff=None, previous=None, system=''):
+        self.version = version
+        self.frame = frame
+        self.source_mtime = source_mtime
+        self.source_size = source_size
+        self.diff = diff
+        self.loaded_at = time.time()
+        self.system = system
+        self._derived = {}
+        # one lock per structure being built, so a slow build (e.g. the service areas) does not block requests
+        # needing another structure; reentrant, a structure may be built from other derived structures
+        self._build_locks = {}
+        # guards _build_locks
+        self._derived_lock = threading.Lock()
+        # names of the derived structures with an update(), the only ones a next snapshot carries over
+        self._updatable = set()
+        # derived structures of the previous snapshot, candidates for update() (the previous frame is not kept)
+        self._previous = {}
+        if previous is not None and diff is not None:
+            self._previous = {name: previous._derived[name] for name in list(previous._updatable)
+                              if name in previous._derived}
+
+    def view(self):
+        """
+            Returns a shallow copy of the station frame, safe to filter and to add columns to.
+
+            Returns:
+                GeoDataFrame: A view on the shared station data.
+            """
+        return self.frame.copy(deep=False)
+
+    @property
+    def key(self):
+        """
+            The identity of the snapshot across the stores of all systems, for cache keys.
+
+            Returns:
+                tuple: (system, version).
+            """
+        return self.system, self.version
+
+    @property
+    def source_key(self):
+        """
+            The identity of the feed data of the snapshot across processes and restarts, for validators sent to
+            clients. The version counts per process, every worker of a server numbers its snapshots on its own.
+
+            Returns:
+                tuple: (system, feed file mtime in ns, feed file size), (system, version) for a snapshot not
+                       loaded from a file.
+            """
+        if not self.source_size:
+            return self.key
+        return self.system, self.source_mtime, self.source_size
+
+    def derived(self, name, build, update=None):
+        """
+            Returns a structure derived from this snapshot, building it on first use.
+
+            Every structure is built once; concurrent callers of the same name wait for the build, callers of
+            other names do not.
+
+            Args:
+                name (hashable): The cache key of the derived structure.
+                build (callable): Called with the snapshot to build the structure if it is not cached yet.
+                update (callable): Called with the structure of the previous snapshot and this snapshot, if the
+                                   previous one had it. Returns the structure for this snapshot, e.g. the previous
+                                   one patched along self.diff, or None to build it (default: None).
+
+            Returns:
+                The cached structure.
+            """
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        if update is not None:
+            self._updatable.add(name)
+        with self._derived_lock:
+            lock = self._build_locks.setdefault(name, threading.RLock())
+        with lock:
+            try:
+                if name not in self._derived:
+                    value = None
+                    if update is not None and name in self._previous:
+                        value = update(self._previous[name], self)
+                    self._derived[name] = value if value is not None else build(self)
+                    self._previous.pop(name, None)
+                return self._derived[name]
+            finally:
+                # built (or failed), later callers find the structure without the lock
+                with self._derived_lock:
+                    if self._build_locks.get(name) is lock:
+                        del self._build_locks[name]
+
+
+class SnapshotStore:
+    """
+        Process-wide store handing out the current station snapshot.
+
+        The feed file is stat'ed on every get(). As long as its mtime and size are unchanged the cached
+        snapshot is returned (hit). When the file changed, exactly one caller re-parses it while concurrent
+        callers wait for the result (reload); the first load counts as a miss. Every reload diffs the new
+        feed against the previous snapshot and publishes the diff to the change log.
+
+        Args:
+            data_file (str): Path of the GeoJSON station feed (default: geo_data_file).
+            name (str): Name of the bike-share system of the feed, handed on to its snapshots (default: '').
+        """
+
+    def __init__(self, data_file=geo_data_file, name=''):
+        self.data_file = data_file
+        self.name = name
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.changes = ChangeLog()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def get(self):
+        """
+            Returns the current station snapshot, (re)loading the feed file if it changed on disk.
+
+            Returns:
+                StationSnapshot: The current snapshot.
+            """
+        stat = os.stat(self.data_file)
+        snapshot = self._snapshot
+        if snapshot is not None and self._is_current(snapshot, stat):
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            # another request may have reloaded the file while we were waiting for the lock
+            stat = os.stat(self.data_file)
+            snapshot = self._snapshot
+            if snapshot is not None and self._is_current(snapshot, stat):
+                self.hits += 1
+                return snapshot
+
+            if snapshot is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            version = snapshot.version + 1 if snapshot is not None else 1
+            with metrics.span('feed_load'):
+                frame = load_station_frame(self.data_file)
+                diff = diff_frames(snapshot.frame, frame, snapshot.version, version, self.name) \
+                    if snapshot is not None else None
+            self._snapshot = StationSnapshot(version, frame, stat.st_mtime_ns, stat.st_size, diff, snapshot,
+                                             self.name)
+            if diff is not None:
+                self.changes.publish(diff)
+            return self._snapshot
+
+    def peek(self):
+        """
+            Returns the currently cached snapshot without checking the feed file.
+
+            Returns:
+                StationSnapshot: The cached snapshot, or None if nothing was loaded yet.
+            """
+        return self._snapshot
+
+    def stats(self):
+        """
+            Returns the cache counters of the store.
+
+            Returns:
+                dict: hits, misses, reloads, the current version and the number of stations.
+            """
+        snapshot = self._snapshot
+        diff = snapshot.diff if snapshot is not None else None
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'version': snapshot.version if snapshot is not None else 0,
+            'stations': len(snapshot.frame) if snapshot is not None else 0,
+            'last_changed': len(diff.rows) + len(diff.removed) if diff is not None else 0,
+        }
+
+    @staticmethod
+    def _is_current(snapshot, stat):
+        return snapshot.source_mtime == stat.st_mtime_ns and snapshot.source_size == stat.st_size
+
+
+class SnapshotDiff:
+    """
+        Per-kioskId changes between two snapshots, over the diff_columns.
+
+        Attributes:
+            base_version (int): Version of the previous snapshot.
+            version (int): Version of the new snapshot.
+            changed (ndarray): KioskIds present in both snapshots with any changed value.
+            added (ndarray): KioskIds only in the new snapshot.
+            removed (ndarray): KioskIds only in the previous snapshot.
+            moved (ndarray): KioskIds among changed whose coordinates changed.
+            same_layout (bool): Whether both snapshots hold the same kioskIds in the same order at the same
+                                coordinates, so structures built over station positions stay valid.
+            positions (ndarray): Row positions in the new frame of the changed and added stations.
+            rows (GeoDataFrame): The new rows of the changed and added stations.
+            system (str): Name of the bike-share system of both snapshots.
+        """
+
+    def __init__(self, base_version, version, changed, added, removed, moved, same_layout, positions, rows,
+                 system=''):
+        self.base_version = base_version
+        self.version = version
+        self.changed = changed
+        self.added = added
+        self.removed = removed
+        self.moved = moved
+        self.same_layout = same_layout
+        self.positions = positions
+        self.rows = rows
+        self.system = system
+
+    def __repr__(self):
+        return (f"SnapshotDiff({self.base_version} -> {self.version}: {len(self.changed)} changed, "
+                f"{len(self.added)} added, {len(self.removed)} removed)")
+
+
+def diff_frames(old, new, base_version=0, version=0, system=''):
+    """
+        Compares two station frames by kioskId.
+
+        Args:
+            old (GeoDataFrame): The previous station frame.
+            new (GeoDataFrame): The new station frame.
+            base_version (int): Version of the previous snapshot (default: 0).
+            version (int): Version of the new snapshot (default: 0).
+            system (str): Name of the bike-share system of both frames (default: '').
+
+        Returns:
+            SnapshotDiff: The changes from old to new.
+        """
+    old_ids = old['kioskId'].to_numpy()
+    new_ids = new['kioskId'].to_numpy()
+    same_ids = len(old_ids) == len(new_ids) and numpy.array_equal(old_ids, new_ids)
+
+    if same_ids:
+        new_positions = numpy.arange(len(new))
+        old_positions = new_positions
+    else:
+        old_lookup = pandas.Index(old_ids)
+        old_positions = old_lookup.get_indexer(new_ids)
+        new_positions = numpy.flatnonzero(old_positions >= 0)
+        old_positions = old_positions[new_positions]
+
+    # compare the tracked columns the snapshots share, row by row for the stations in both
+    differs = numpy.zeros(len(new_positions), dtype=bool)
+    moved = numpy.zeros(len(new_positions), dtype=bool)
+    for column in new.columns.intersection(old.columns).intersection(diff_columns):
+        before = old[column].to_numpy()
+        after = new[column].to_numpy()
+        if not same_ids:
+            before, after = before[old_positions], after[new_positions]
+        changed = numpy.asarray(before != after, dtype=bool)
+        # missing values compare unequal to themselves, recheck only the few rows that differ
+        unequal = numpy.flatnonzero(changed)
+        if len(unequal):
+            changed[unequal] = ~(pandas.isna(before[unequal]) & pandas.isna(after[unequal]))
+        differs |= changed
+        if column in ('latitude', 'longitude'):
+            moved |= changed
+
+    if same_ids:
+        added = removed = numpy.array([], dtype=numpy.int64)
+    else:
+        added = numpy.setdiff1d(numpy.arange(len(new)), new_positions, assume_unique=True)
+        removed = numpy.setdiff1d(old_ids, new_ids)
+    positions = numpy.sort(numpy.concatenate([new_positions[differs], added]))
+
+    return SnapshotDiff(base_version, version,
+                        changed=new_ids[new_positions[differs]],
+                        added=new_ids[added],
+                        removed=removed,
+                        moved=new_ids[new_positions[moved]],
+                        same_layout=same_ids and not moved.any(),
+                        positions=positions,
+                        rows=new.iloc[positions],
+                        system=system)
+
+
+class ChangeLog:
+    """
+        The most recent snapshot diffs, for clients following the changes of the feed.
+
+        Args:
+            maxlen (int): The number of diffs kept (default: change_log_size).
+        """
+
+    def __init__(self, maxlen=change_log_size):
+        self._diffs = collections.deque(maxlen=maxlen)
+        self._condition = threading.Condition()
+
+    def publish(self, diff):
+        """
+            Appends a diff and wakes up the waiting clients.
+
+            Args:
+                diff (SnapshotDiff): The diff of a new snapshot.
+            """
+        with self._condition:
+            self._diffs.append(diff)
+            self._condition.notify_all()
+
+    def since(self, version, timeout=None):
+        """
+            Returns the diffs of the snapshots after a version, waiting for one if there is none yet.
+
+            Args:
+                version (int): The last version the client has seen.
+                timeout (float): Seconds to wait for a new diff (default: None, wait forever).
+
+            Returns:
+                list: The SnapshotDiffs with a newer version, oldest first; empty after the timeout.
+            """
+        with self._condition:
+            self._condition.wait_for(lambda: self._diffs and self._diffs[-1].version > version, timeout)
+            return [diff for diff in self._diffs if diff.version > version]
+
+    def latest_version(self):
+        """
+            Returns the version of the most recent diff.
+
+            Returns:
+                int: The version, 0 if no diff was published yet.
+            """
+        with self._condition:
+            return self._diffs[-1].version if self._diffs else 0
+
+
+def load_station_frame(data_file=geo_data_file):
+    """
+        Parses the station feed file into a GeoDataFrame.
+
+        Args:
+            data_file (str): Path of the GeoJSON station feed.
+
+        Returns:
+            GeoDataFrame: The parsed station data.
+        """
+    with open(data_file) as jsonfile:
+        return geopandas.read_file(jsonfile)
+
+
+# the store of the default system shared by all requests of the process
+station_store = SnapshotStore(name=default_system)
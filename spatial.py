@@ -0,0 +1,270 @@
+import functools
+
+import numpy
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+# CRS of the station feed and of user input
+crs_input_format = "EPSG:4326"
+# CRS the index is built in, query distances are returned in its units; Web Mercator units are stretched by
+# 1 / cos(latitude), they rank stations of one city correctly but are not meters on the ground
+crs_index_format = "EPSG:3857"
+# mean earth radius in meters, for ground distances
+earth_radius = 6371008.8
+
+
+@functools.lru_cache(maxsize=None)
+def get_transformer(crs_in, crs_out):
+    """
+        Returns the (cached) transformer between two CRS, with (x, y) = (longitude, latitude) axis order.
+
+        Args:
+            crs_in (str): The CRS of the input coordinates.
+            crs_out (str): The CRS of the output coordinates.
+
+        Returns:
+            pyproj.Transformer: The transformer.
+        """
+    return Transformer.from_crs(crs_in, crs_out, always_xy=True)
+
+
+def project_points(lats, longs, crs_in=crs_input_format, crs_out=crs_index_format):
+    """
+        Reprojects a batch of coordinates without creating geometry objects.
+
+        Args:
+            lats (array-like or float): The latitudes (or y coordinates) of the points.
+            longs (array-like or float): The longitudes (or x coordinates) of the points.
+            crs_in (str): The CRS of the input points (default: EPSG:4326).
+            crs_out (str): The CRS of the output points (default: EPSG:3857).
+
+        Returns:
+            tuple: (x, y) float64 arrays in the output CRS.
+        """
+    longs = numpy.asarray(longs, dtype=numpy.float64)
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    return get_transformer(crs_in, crs_out).transform(longs, lats)
+
+
+class StationIndex:
+    """
+        KD-tree over the projected coordinates of a station frame.
+
+        The index is built once per station snapshot and answers k-nearest and radius queries in O(log n).
+        Results are positions into the frame the index was built from; `labels` maps them back to the index
+        labels of that frame. Queries on a filtered subset of the frame pass a boolean mask over the
+        positions instead of rebuilding the tree.
+
+        Args:
+            xy (ndarray): (n, 2) array of projected station coordinates.
+            labels (array-like): Index labels of the frame rows, in the same order as xy.
+            lonlat (ndarray): Optional (n, 2) array of the station longitudes and latitudes (EPSG:4326).
+        """
+
+    def __init__(self, xy, labels, lonlat=None):
+        self.xy = numpy.ascontiguousarray(xy, dtype=numpy.float64)
+        self.labels = numpy.asarray(labels)
+        self.lonlat = numpy.ascontiguousarray(lonlat, dtype=numpy.float64) if lonlat is not None else None
+        self.tree = cKDTree(self.xy)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+            Builds the index from the geometry column of a station GeoDataFrame.
+
+            Args:
+                frame (GeoDataFrame): The stations, in any CRS.
+
+            Returns:
+                StationIndex: The index over the stations of the frame.
+            """
+        geometry = frame['geometry']
+        crs_in = geometry.crs.to_string() if geometry.crs is not None else crs_input_format
+        long, lat = geometry.x.to_numpy(), geometry.y.to_numpy()
+        x, y = project_points(lat, long, crs_in, crs_index_format)
+        if crs_in != crs_input_format:
+            long, lat = project_points(lat, long, crs_in, crs_input_format)
+        return cls(numpy.column_stack((x, y)), frame.index, numpy.column_stack((long, lat)))
+
+    def mask_for(self, labels):
+        """
+            Returns the boolean mask selecting the rows with the given index labels.
+
+            Args:
+                labels (array-like): Index labels of a subset of the indexed frame.
+
+            Returns:
+                ndarray: Boolean mask over the index positions.
+            """
+        return numpy.isin(self.labels, numpy.asarray(labels))
+
+    def subset_mask(self, frame):
+        """
+            Returns the mask restricting queries to the rows of a frame filtered from the indexed frame.
+
+            Args:
+                frame (DataFrame): The indexed frame or a row subset of it.
+
+            Returns:
+                ndarray: Boolean mask over the index positions, or None if the frame holds all indexed rows.
+            """
+        if len(frame) == len(self) and numpy.array_equal(frame.index.to_numpy(), self.labels):
+            return None
+        return self.mask_for(frame.index)
+
+    def query(self, x, y, k, mask=None):
+        """
+            Finds the k stations nearest to a projected point.
+
+            Args:
+                x (float): The projected x coordinate of the point.
+                y (float): The projected y coordinate of the point.
+                k (int): The number of stations to return.
+                mask (ndarray): Optional boolean mask of the stations that may be returned.
+
+            Returns:
+                tuple: (positions, distances) of the nearest stations, ordered by distance.
+            """
+        n = len(self)
+        if mask is not None:
+            n = min(n, int(numpy.count_nonzero(mask)))
+        k = min(int(k), n)
+        if k <= 0:
+            return numpy.empty(0, dtype=numpy.intp), numpy.empty(0)
+
+        # query more candidates until enough of them pass the mask
+        k_query = k
+        while True:
+            distances, positions = self.tree.query((x, y), k=min(k_query, len(self)))
+            distances = numpy.atleast_1d(distances)
+            positions = numpy.atleast_1d(positions)
+            if mask is not None:
+                keep = mask[positions]
+                distances, positions = distances[keep], positions[keep]
+            if len(positions) >= k or k_query >= len(self):
+                return positions[:k], distances[:k]
+            k_query *= 2
+
+    def query_radius(self, x, y, radius, mask=None):
+        """
+            Finds all stations within a radius of a projected point.
+
+            Args:
+                x (float): The projected x coordinate of the point.
+                y (float): The projected y coordinate of the point.
+                radius (float): The search radius in projected units.
+                mask (ndarray): Optional boolean mask of the stations that may be returned.
+
+            Returns:
+                tuple: (positions, distances) of the stations within the radius, ordered by distance.
+            """
+        positions = numpy.asarray(self.tree.query_ball_point((x, y), r=radius), dtype=numpy.intp)
+        if mask is not None:
+            positions = positions[mask[positions]]
+        distances = numpy.hypot(self.xy[positions, 0] - x, self.xy[positions, 1] - y)
+        order = numpy.argsort(distances, kind='stable')
+        return positions[order], distances[order]
+
+
+def batch_nearest(index, lats, longs, k, chunk_size=10000, mask=None):
+    """
+        Finds the k nearest stations for many points in one vectorized pass.
+
+        The points are projected and queried in chunks of `chunk_size`, so the temporary arrays stay bounded
+        no matter how many points are passed. With a mask, a KD-tree over the allowed stations is built once
+        for the whole batch.
+
+        Args:
+            index (StationIndex): The index over the stations.
+            lats (array-like): The latitudes of the points (EPSG:4326).
+            longs (array-like): The longitudes of the points (EPSG:4326).
+            k (int): The number of stations per point.
+            chunk_size (int): The number of points queried at once (default: 10000).
+            mask (ndarray): Optional boolean mask of the stations that may be returned.
+
+        Returns:
+            tuple: (positions, distances), two (n_points, k) arrays ordered by distance per point. Positions refer
+                to the rows of the indexed frame.
+        """
+    lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+    longs = numpy.asarray(longs, dtype=numpy.float64).ravel()
+    if lats.shape != longs.shape:
+        raise ValueError("latitudes and longitudes must have the same length")
+
+    tree, allowed = index.tree, None
+    if mask is not None:
+        allowed = numpy.flatnonzero(mask)
+        tree = cKDTree(index.xy[allowed])
+
+    k = min(int(k), tree.n)
+    positions = numpy.empty((len(lats), max(k, 0)), dtype=numpy.intp)
+    distances = numpy.empty((len(lats), max(k, 0)), dtype=numpy.float64)
+    if k <= 0:
+        return positions, distances
+
+    for start in range(0, len(lats), chunk_size):
+        stop = start + chunk_size
+        x, y = project_points(lats[start:stop], longs[start:stop])
+        chunk_distances, chunk_positions = tree.query(numpy.column_stack((x, y)), k=k, workers=-1)
+        # a query for k=1 returns flat arrays
+        chunk_positions = chunk_positions.reshape(-1, k)
+        positions[start:stop] = chunk_positions if allowed is None else allowed[chunk_positions]
+        distances[start:stop] = chunk_distances.reshape(-1, k)
+
+    return positions, distances
+
+
+def ground_distances(index, positions, lats, longs):
+    """
+        Returns the great-circle (haversine) distances in meters from points to stations of an index.
+
+        Args:
+            index (StationIndex): The index over the stations, with their longitudes and latitudes.
+            positions (ndarray): Row positions of the stations, e.g. the result of query() or batch_nearest().
+            lats (array-like or float): The latitudes of the points, broadcast against positions.
+            longs (array-like or float): The longitudes of the points, broadcast against positions.
+
+        Returns:
+            ndarray: The distances, in the shape of positions.
+        """
+    station_longs = numpy.radians(index.lonlat[positions, 0])
+    station_lats = numpy.radians(index.lonlat[positions, 1])
+    lats = numpy.radians(numpy.asarray(lats, dtype=numpy.float64))
+    longs = numpy.radians(numpy.asarray(longs, dtype=numpy.float64))
+    a = numpy.sin((station_lats - lats) / 2) ** 2 \
+        + numpy.cos(lats) * numpy.cos(station_lats) * numpy.sin((station_longs - longs) / 2) ** 2
+    return 2 * earth_radius * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
+
+
+def station_index(snapshot):
+    """
+        Returns the spatial index of a station snapshot, building it once per snapshot.
+
+        The index of the previous snapshot is kept as long as no station was added, removed or moved.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+
+        Returns:
+            StationIndex: The index over the snapshot's stations.
+        """
+    return snapshot.derived('station_index', lambda s: StationIndex.from_frame(s.frame), update=reuse_index)
+
+
+def reuse_index(index, snapshot):
+    """
+        Returns the index of the previous snapshot if it is still valid for a snapshot.
+
+        Args:
+            index (StationIndex): The index of the previous snapshot.
+            snapshot (StationSnapshot): The new snapshot.
+
+        Returns:
+            StationIndex: The index, or None if stations were added, removed or moved.
+        """
+    if snapshot.diff.same_layout and numpy.array_equal(index.labels, snapshot.frame.index.to_numpy()):
+        return index
+    return None
@@ -0,0 +1,197 @@
+import numpy
+
+from cache import LRUCache
+from spatial import project_points
+
+# average walking speed in m/s
+walk_speed = 1.35
+# average cycling speed in m/s
+bike_speed = 4.5
+# ratio of street distance to straight-line distance
+circuity = 1.3
+# seconds to undock a bike and to dock it again
+dock_seconds = 60
+# stations with fewer bikes (start) or docks (end) than this are penalized ...
+availability_comfort = 3
+# ... by up to this many seconds, a nearly empty or full station may be gone on arrival
+availability_penalty = 180
+# number of start and end station candidates scored per trip
+pair_candidates = 5
+# stations up to this number get a full precomputed ride time matrix, above it rows are computed per trip
+matrix_max_stations = 2000
+# rows of the ride time matrix of a larger feed kept, one per recent start station
+matrix_cached_rows = 512
+
+
+def haversine(lat1, long1, lat2, long2):
+    """
+        Great-circle distance between coordinates, broadcasting over arrays.
+
+        Args:
+            lat1, long1 (array-like): The first coordinates in degrees.
+            lat2, long2 (array-like): The second coordinates in degrees.
+
+        Returns:
+            ndarray: The distances in meters.
+        """
+    lat1, long1, lat2, long2 = (numpy.radians(value) for value in (lat1, long1, lat2, long2))
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((long2 - long1) / 2) ** 2
+    return 2 * 6371008.8 * numpy.arcsin(numpy.sqrt(a))
+
+
+def ride_times(lonlat, starts, ends):
+    """
+        Estimated bike travel times between two sets of stations, in seconds.
+
+        Estimates use the straight-line distance stretched by `circuity` at `bike_speed`, plus `dock_seconds`.
+
+        Args:
+            lonlat (ndarray): (n, 2) array of station longitudes and latitudes.
+            starts (ndarray): Positions of the start stations.
+            ends (ndarray): Positions of the end stations.
+
+        Returns:
+            ndarray: (len(starts), len(ends)) ride times in seconds.
+        """
+    long, lat = lonlat[:, 0], lonlat[:, 1]
+    distance = haversine(lat[starts][:, None], long[starts][:, None], lat[ends][None, :], long[ends][None, :])
+    return distance * circuity / bike_speed + dock_seconds
+
+
+class RideTimeMatrix:
+    """
+        Estimated bike travel times between the stations of a snapshot (see ride_times()), in seconds.
+
+        Up to `matrix_max_stations` stations the full float32 matrix is precomputed at once (16 MB for 2000
+        stations). Larger feeds fill the rows of the start stations of the trips on demand, the most recently
+        used `matrix_cached_rows` rows are kept. A matrix belongs to a snapshot (see ride_time_matrix()) and is
+        carried over to the next one while no station moved, added or removed.
+
+        Args:
+            lonlat (ndarray): (n, 2) array of station longitudes and latitudes.
+        """
+
+    def __init__(self, lonlat):
+        self.lonlat = lonlat
+        self.matrix = None
+        self.rows = LRUCache(matrix_cached_rows)
+        if len(lonlat) <= matrix_max_stations:
+            self.matrix = self._compute(numpy.arange(len(lonlat)))
+
+    def __len__(self):
+        return len(self.lonlat)
+
+    def matches(self, lonlat):
+        # whether the matrix was computed for stations at these positions, in this order
+        return self.lonlat.shape == lonlat.shape and numpy.array_equal(self.lonlat, lonlat)
+
+    def _compute(self, starts):
+        return ride_times(self.lonlat, starts, numpy.arange(len(self.lonlat))).astype(numpy.float32)
+
+    def times(self, starts, ends):
+        """
+            Returns the ride times between two sets of stations.
+
+            Args:
+                starts (ndarray): Positions of the start stations.
+                ends (ndarray): Positions of the end stations.
+
+            Returns:
+                ndarray: (len(starts), len(ends)) ride times in seconds.
+            """
+        if self.matrix is not None:
+            return self.matrix[numpy.ix_(starts, ends)]
+        rows = [self.rows.get(int(start)) for start in starts]
+        missing = [position for position, row in enumerate(rows) if row is None]
+        if missing:
+            for position, row in zip(missing, self._compute(numpy.asarray(starts)[missing])):
+                self.rows.put(int(starts[position]), row)
+                rows[position] = row
+        return numpy.stack(rows)[:, ends]
+
+
+def ride_time_matrix(snapshot, index):
+    """
+        Returns the ride time matrix of the stations of a snapshot, built once per station layout.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+            index (StationIndex): The index the candidate positions refer to, built over the snapshot's frame.
+
+        Returns:
+            RideTimeMatrix: The ride times between the stations of the index.
+        """
+    matrix = snapshot.derived('ride_time_matrix', lambda s: RideTimeMatrix(index.lonlat),
+                              update=lambda previous, s: previous if previous.matches(index.lonlat) else None)
+    # an index over another frame (e.g. a filtered subset) gets a matrix of its own, not cached
+    return matrix if matrix.matches(index.lonlat) else RideTimeMatrix(index.lonlat)
+
+
+def choose_station_pair(df, index, s_lat, s_long, d_lat, d_long, k=pair_candidates, mask=None, forecast=None,
+                        now=None, snapshot=None):
+    """
+        Chooses the start and end station minimizing the estimated walk + ride + walk time of a trip.
+
+        The k nearest stations of the source and of the destination are scored against each other, stations
+        with few bikes (start) or docks (end) are penalized. With a forecast, the penalties use the counts
+        predicted for the time the user arrives at the station instead of the current ones. A pair needs two
+        different stations.
+
+        Args:
+            df (DataFrame): The stations to choose from, the indexed frame or a filtered subset of it.
+            index (StationIndex): The index built over the station frame.
+            s_lat (float): The latitude of the source position.
+            s_long (float): The longitude of the source position.
+            d_lat (float): The latitude of the destination position.
+            d_long (float): The longitude of the destination position.
+            k (int): The number of candidates per side (default: pair_candidates).
+            mask (ndarray): Optional boolean mask over the index positions of the stations that may be chosen
+                            (default: None, the stations of df).
+            forecast (AvailabilityForecast): Optional availability forecast (default: None).
+            now (float): Unix time of the current counts (default: None, now).
+            snapshot (StationSnapshot): Optional snapshot the index was built from, its cached ride time matrix
+                                        is used (default: None, the ride times of the candidates are computed).
+
+        Returns:
+            tuple: (start label, end label, estimated trip seconds). The labels are index labels of df.
+
+        Raises:
+            ValueError: If df contains no station or a single one.
+        """
+    if mask is None:
+        mask = index.subset_mask(df)
+    x, y = project_points([s_lat, d_lat], [s_long, d_long])
+    starts, _ = index.query(float(x[0]), float(y[0]), k, mask)
+    ends, _ = index.query(float(x[1]), float(y[1]), k, mask)
+    if len(starts) == 0 or len(ends) == 0:
+        raise ValueError("no station available")
+
+    long, lat = index.lonlat[:, 0], index.lonlat[:, 1]
+    walk_start = haversine(s_lat, s_long, lat[starts], long[starts]) * circuity / walk_speed
+    walk_end = haversine(lat[ends], long[ends], d_lat, d_long) * circuity / walk_speed
+    if snapshot is not None:
+        ride = ride_time_matrix(snapshot, index).times(starts, ends).astype(float)
+    else:
+        ride = ride_times(index.lonlat, starts, ends)
+
+    bikes = df.loc[index.labels[starts], 'bikesAvailable'].to_numpy().astype(float)
+    docks = df.loc[index.labels[ends], 'docksAvailable'].to_numpy().astype(float)
+    if forecast is not None:
+        # counts expected on arrival: at the start station after the walk, at the end station after the ride
+        start_ids = df.loc[index.labels[starts], 'kioskId'].to_numpy()
+        end_ids = df.loc[index.labels[ends], 'kioskId'].to_numpy()
+        bikes = forecast.predict('bikes', start_ids, bikes, walk_start, now)
+        docks = forecast.predict('docks', end_ids[None, :], docks[None, :], walk_start[:, None] + ride, now)
+
+    # penalize stations that are about to run out of bikes (start) or docks (end)
+    start_penalty = availability_penalty * numpy.clip(1 - bikes / availability_comfort, 0, 1)
+    end_penalty = availability_penalty * numpy.clip(1 - docks / availability_comfort, 0, 1)
+
+    total = (walk_start + start_penalty)[:, None] + ride + walk_end[None, :] + end_penalty
+    # returning the bike where it was taken is no trip
+    total[starts[:, None] == ends[None, :]] = numpy.inf
+    if not numpy.isfinite(total).any():
+        raise ValueError("no pair of stations available")
+    best_start, best_end = numpy.unravel_index(numpy.argmin(total), total.shape)
+
+    return index.labels[starts[best_start]], index.labels[ends[best_end]], float(total[best_start, best_end])
@@ -0,0 +1,495 @@
+"""
+    The bike-share systems served by one deployment.
+
+    Every system has its own station feed file, snapshot store (and with it its own spatial index, tables,
+    service areas and other derived structures), availability history and forecast. A request is routed to the
+    system whose station bounding box, widened by bounds_margin, holds its position; positions outside of every
+    box go to the system with the nearest center. The feeds of all systems are refreshed in parallel, so a slow
+    feed delays neither the others nor any request.
+
+    The systems are listed in a JSON file (BIKE_MAP_SYSTEMS, default systems.json), the first one is the
+    default of requests without a position:
+
+        [{"name": "metro-la", "feed_url": "https://bikeshare.metro.net/stations/json", "format": "metro",
+          "center": [34.04919, -118.24799]},
+         {"name": "citi-bike", "feed_url": "https://gbfs.citibikenyc.com/gbfs/2.3/gbfs.json", "format": "gbfs",
+          "center": [40.73, -73.99], "timezone": "America/New_York", "road_graph": "routes/nyc.osm"}]
+
+    'metro' is the feed format of bikeshare.metro.net; 'gbfs' a GBFS discovery file (gbfs.json, version 2 or 3)
+    whose station_information and station_status feeds are merged into a GeoJSON file of the same shape. A
+    system named like snapshot.default_system keeps the feed file, store and history of the single-system app,
+    which is also the only system without a systems file.
+
+    Opening hours and forecast slots are in the time zone of the system: its "timezone" in the systems file, else
+    the timezone of the GBFS system_information feed (stored next to the feed file, so a restart does not wait for
+    the first poll), else filters.station_timezone.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import zoneinfo
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import requests
+
+import metrics
+from columns import station_columns
+from filters import station_timezone
+from forecast import ForecastCache, availability_forecast
+from functions import feed_headers, feed_url, get_GeoJSON, store_feed
+from history import AvailabilityHistory, availability_history
+from snapshot import SnapshotStore, default_system, geo_data_file, station_store
+
+# JSON file listing the served systems
+systems_file = os.environ.get('BIKE_MAP_SYSTEMS', 'systems.json')
+# folder holding the feed file and the history of every system but the default one
+systems_folder = "data"
+# degrees the station bounding box of a system is widened by, positions just outside the outer stations
+# still belong to the system (0.05 degrees ~ 5 km)
+bounds_margin = 0.05
+# threads refreshing the feeds at the same time, fetching is I/O bound
+refresh_workers = 8
+# seconds to wait for a GBFS response
+gbfs_timeout = 30
+# preferred language of GBFS version 2 discovery files
+gbfs_language = 'en'
+# system names are folder names and URL parameters
+system_name_pattern = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+# default position of Metro Bike Share LA
+default_center = (34.04919, -118.24799)
+
+
+class BikeSystem:
+    """
+        One bike-share system: its feed and the stores built from it.
+
+        Args:
+            name (str): The system name, lowercase letters, digits, '-' and '_'.
+            feed_url (str): The URL of the station feed, the discovery file for 'gbfs'.
+            feed_format (str): 'metro' or 'gbfs' (default: 'metro').
+            center (tuple): (latitude, longitude) of the default position (default: None, the center of the
+                            stations).
+            data_file (str): The path the feed is stored at (default: None, data/<name>/geo_data.json).
+            store (SnapshotStore): The snapshot store of the feed (default: None, a new store of data_file).
+            history (AvailabilityHistory): The availability history of the system (default: None, a new history
+                                           in data/<name>/history).
+            forecast (ForecastCache): The forecast trained on the history (default: None, a new one).
+            road_graph_file (str): The road network of the service areas (default: None, none).
+            timezone (str): The IANA time zone of the stations (default: None, the one of the GBFS
+                            system_information feed, else station_timezone).
+        """
+
+    def __init__(self, name, feed_url, feed_format='metro', center=None, data_file=None, store=None, history=None,
+                 forecast=None, road_graph_file=None, timezone=None):
+        if not system_name_pattern.match(name):
+            raise ValueError(f"Invalid system name: {name!r}")
+        if feed_format not in ('metro', 'gbfs'):
+            raise ValueError(f"Unknown feed format of {name}: {feed_format!r}")
+        if timezone is not None and not valid_timezone(timezone):
+            raise ValueError(f"Unknown time zone of {name}: {timezone!r}")
+        self.name = name
+        self.feed_url = feed_url
+        self.feed_format = feed_format
+        self.configured_center = tuple(center) if center is not None else None
+        self.data_file = data_file or os.path.join(systems_folder, name, "geo_data.json")
+        self.configured_timezone = timezone
+        # system_information of a GBFS system, holding its time zone
+        self.information_file = os.path.join(os.path.dirname(self.data_file), f"{name}_system_information.json")
+        self.timezone = timezone or stored_timezone(self.information_file) or station_timezone
+        self.store = store or SnapshotStore(self.data_file, name)
+        self.history = history or AvailabilityHistory(os.path.join(systems_folder, name, "history"))
+        self.forecast = forecast or ForecastCache(self.history, timezone=self.timezone)
+        self.forecast.timezone = self.timezone
+        self.road_graph_file = road_graph_file
+        # validators of the last stored feed, see functions.get_GeoJSON()
+        self.validators = {'etag': None, 'last_modified': None, 'sha1': None}
+        # urls of the GBFS feeds by name, from the discovery file
+        self._gbfs_feeds = None
+
+    def __repr__(self):
+        return f"BikeSystem({self.name!r}, {self.feed_format})"
+
+    @property
+    def center(self):
+        """
+            The default position of the system.
+
+            Returns:
+                tuple: (latitude, longitude), the configured center or the center of the station bounds.
+            """
+        if self.configured_center is not None:
+            return self.configured_center
+        bounds = system_bounds(self.store.get())
+        return (bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2
+
+    def refresh(self):
+        """
+            Polls the feed of the system once.
+
+            Returns:
+                bool: True if new station data was stored.
+            """
+        if self.feed_format == 'metro':
+            return get_GeoJSON(self.feed_url, self.data_file, self.store, self.history, self.validators)
+        try:
+            payload = gbfs_payload(*self.fetch_gbfs())
+            return store_feed(payload, self.data_file, self.store, self.history, self.validators)
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            # the discovery file may have moved the feeds, look them up again on the next poll
+            self._gbfs_feeds = None
+            metrics.count('feed_polls_total', outcome='failed', system=self.name)
+            print(f"Refreshing {self.name} failed ({type(e).__name__}). Using stored data.")
+            return False
+
+    def fetch_gbfs(self):
+        """
+            Fetches the station information and the station status of a GBFS system.
+
+            Returns:
+                tuple: The station_information and the station_status documents.
+            """
+        if self._gbfs_feeds is None:
+            self._gbfs_feeds = gbfs_feeds(fetch_json(self.feed_url))
+            # the time zone once per discovery, it does not change between polls
+            if self.configured_timezone is None and 'system_information' in self._gbfs_feeds:
+                self.update_timezone(fetch_json(self._gbfs_feeds['system_information']))
+        return (fetch_json(self._gbfs_feeds['station_information']),
+                fetch_json(self._gbfs_feeds['station_status']))
+
+    def update_timezone(self, information):
+        """
+            Takes the time zone of the GBFS system_information document and stores the document.
+
+            Args:
+                information (dict): The system_information document.
+            """
+        timezone = information['data'].get('timezone')
+        if not valid_timezone(timezone):
+            return
+        if timezone != stored_timezone(self.information_file):
+            os.makedirs(os.path.dirname(self.information_file) or '.', exist_ok=True)
+            tmp_file = f"{self.information_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'w') as file:
+                json.dump(information, file)
+            os.replace(tmp_file, self.information_file)
+        self.timezone = timezone
+        self.forecast.timezone = timezone
+
+
+class SystemRouter:
+    """
+        Routes positions to the system holding them.
+
+        The widened station bounding boxes of all systems are kept as one array, rebuilt only when a system
+        loaded a new snapshot, so routing a position is one vectorized comparison however many systems are
+        served. The boxes are taken from the snapshots the stores already hold, a feed file is only read for a
+        system none was loaded for yet.
+
+        Args:
+            systems (list): The BikeSystems, the first one is the default.
+        """
+
+    def __init__(self, systems):
+        self.systems = list(systems)
+        self._key = None
+        self._areas = None
+        self._lock = threading.Lock()
+
+    def areas(self):
+        """
+            Returns the widened station bounding boxes and the centers of the systems.
+
+            Returns:
+                tuple: (min latitude, min longitude, max latitude, max longitude) per system, NaN for a system
+                       without stations, and (latitude, longitude) of the center per system.
+            """
+        snapshots = [system.store.peek() for system in self.systems]
+        key = tuple(snapshot.version if snapshot is not None else 0 for snapshot in snapshots)
+        if key == self._key:
+            return self._areas
+        with self._lock:
+            if key != self._key:
+                bounds = numpy.full((len(self.systems), 4), numpy.nan)
+                centers = numpy.full((len(self.systems), 2), numpy.nan)
+                for position, (system, snapshot) in enumerate(zip(self.systems, snapshots)):
+                    if snapshot is None and os.path.exists(system.data_file):
+                        snapshot = system.store.get()
+                    if snapshot is not None and len(snapshot.frame):
+                        bounds[position] = system_bounds(snapshot)
+                    box = bounds[position]
+                    centers[position] = system.configured_center or ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+                bounds += numpy.array([-bounds_margin, -bounds_margin, bounds_margin, bounds_margin])
+                self._areas = bounds, centers
+                self._key = key
+            return self._areas
+
+    def locate_many(self, latitudes, longitudes):
+        """
+            Routes positions to systems.
+
+            Args:
+                latitudes (ndarray): The latitudes of the positions.
+                longitudes (ndarray): The longitudes of the positions.
+
+            Returns:
+                ndarray: The position of the system of every position in self.systems.
+            """
+        latitudes = numpy.asarray(latitudes, dtype=numpy.float64)[:, None]
+        longitudes = numpy.asarray(longitudes, dtype=numpy.float64)[:, None]
+        bounds, centers = self.areas()
+        inside = (bounds[:, 0] <= latitudes) & (latitudes <= bounds[:, 2]) \
+            & (bounds[:, 1] <= longitudes) & (longitudes <= bounds[:, 3])
+        # outside of every box: the nearest center, longitudes shortened by the latitude
+        distances = (centers[:, 0] - latitudes) ** 2 \
+            + ((centers[:, 1] - longitudes) * numpy.cos(numpy.radians(latitudes))) ** 2
+        nearest = numpy.argmin(numpy.where(numpy.isnan(distances), numpy.inf, distances), axis=1)
+        return numpy.where(inside.any(axis=1), numpy.argmax(inside, axis=1), nearest)
+
+    def locate(self, latitude, longitude):
+        """
+            Returns the system of a position.
+
+            Args:
+                latitude (float): The latitude of the position, 0.0 for the default system.
+                longitude (float): The longitude of the position, 0.0 for the default system.
+
+            Returns:
+                BikeSystem: The system.
+            """
+        if len(self.systems) == 1 or not (latitude and longitude):
+            return self.systems[0]
+        return self.systems[int(self.locate_many([latitude], [longitude])[0])]
+
+
+def system_bounds(snapshot):
+    """
+        Returns the bounding box of the stations of a snapshot, computed once per snapshot.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+
+        Returns:
+            tuple: (min latitude, min longitude, max latitude, max longitude).
+        """
+
+    def build(snapshot):
+        columns = station_columns(snapshot)
+        return (float(columns.latitude.min()), float(columns.longitude.min()),
+                float(columns.latitude.max()), float(columns.longitude.max()))
+
+    return snapshot.derived('bounds', build)
+
+
+def valid_timezone(timezone):
+    # an IANA time zone name known to zoneinfo
+    if not isinstance(timezone, str) or not timezone:
+        return False
+    try:
+        zoneinfo.ZoneInfo(timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def stored_timezone(path):
+    # the time zone of a stored system_information document, None without a valid one
+    try:
+        with open(path) as file:
+            timezone = json.load(file)['data'].get('timezone')
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return timezone if valid_timezone(timezone) else None
+
+
+def fetch_json(url):
+    # a GBFS document
+    response = requests.get(url, headers=feed_headers, timeout=gbfs_timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def gbfs_feeds(discovery, language=gbfs_language):
+    """
+        Returns the feed urls of a GBFS discovery file.
+
+        Args:
+            discovery (dict): The gbfs.json document, version 3 (data.feeds) or 2 (data.<language>.feeds).
+            language (str): The preferred language of a version 2 file, else its first one (default: gbfs_language).
+
+        Returns:
+            dict: Feed name -> url.
+        """
+    data = discovery['data']
+    if 'feeds' not in data:
+        data = data.get(language) or next(iter(data.values()))
+    return {feed['name']: feed['url'] for feed in data['feeds']}
+
+
+def gbfs_text(value):
+    # a plain string (version 2) or a list of localized strings (version 3)
+    if isinstance(value, list):
+        return value[0]['text'] if value else None
+    return value
+
+
+def gbfs_kiosk_ids(station_ids):
+    """
+        Returns numeric kioskIds of GBFS station ids.
+
+        The station columns hold kioskIds as int32. Ids that are all decimal numbers in that range are used as
+        they are, other ids (e.g. UUIDs) are hashed to 31 bits, stable across polls and restarts.
+
+        Args:
+            station_ids (list): The station_id strings.
+
+        Returns:
+            list: The kioskIds.
+        """
+    if all(station_id.isdigit() and int(station_id) < 2 ** 31 for station_id in station_ids):
+        return [int(station_id) for station_id in station_ids]
+    return [int(hashlib.sha1(station_id.encode()).hexdigest()[:8], 16) & 0x7fffffff for station_id in station_ids]
+
+
+def gbfs_payload(information, status):
+    """
+        Merges the GBFS station information and status into a GeoJSON feed of the shape of the Metro feed.
+
+        Stations without a status are left out. GBFS has no opening hours, the stations count as always open.
+
+        Args:
+            information (dict): The station_information document.
+            status (dict): The station_status document.
+
+        Returns:
+            bytes: The GeoJSON FeatureCollection.
+        """
+    statuses = {str(station['station_id']): station for station in status['data']['stations']}
+    stations = [station for station in information['data']['stations'] if str(station['station_id']) in statuses]
+    station_ids = [str(station['station_id']) for station in stations]
+
+    features = []
+    for station_id, kiosk_id, station in zip(station_ids, gbfs_kiosk_ids(station_ids), stations):
+        state = statuses[station_id]
+        bikes = int(state.get('num_bikes_available', state.get('num_vehicles_available', 0)))
+        electric = int(state.get('num_ebikes_available', 0))
+        active = state.get('is_installed', True) and state.get('is_renting', True)
+        latitude, longitude = float(station['lat']), float(station['lon'])
+        features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+                         'properties': {
+                             'kioskId': kiosk_id, 'stationId': station_id, 'name': gbfs_text(station['name']),
+                             'addressStreet': station.get('address'), 'addressCity': None, 'addressState': None,
+                             'addressZipCode': station.get('post_code'), 'bikesAvailable': bikes,
+                             'classicBikesAvailable': bikes - electric, 'smartBikesAvailable': 0,
+                             'electricBikesAvailable': electric,
+                             'docksAvailable': int(state.get('num_docks_available', 0)),
+                             'totalDocks': station.get('capacity'),
+                             'kioskPublicStatus': 'Active' if active else 'Unavailable',
+                             'openTime': None, 'closeTime': None, 'latitude': latitude, 'longitude': longitude}})
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':')).encode()
+
+
+def load_systems(path=systems_file):
+    """
+        Reads the systems file.
+
+        Args:
+            path (str): The JSON file listing the systems (default: systems_file).
+
+        Returns:
+            list: The BikeSystems, Metro Bike Share LA alone if the file does not exist.
+
+        Raises:
+            ValueError: If the file lists no system, a system twice or an invalid one.
+        """
+    if not os.path.exists(path):
+        return [metro_la()]
+    with open(path) as file:
+        entries = json.load(file)
+
+    systems = []
+    for entry in entries:
+        if entry['name'] == default_system:
+            system = metro_la(entry.get('feed_url', feed_url), entry.get('center', default_center),
+                              entry.get('road_graph'), entry.get('timezone', station_timezone))
+        else:
+            system = BikeSystem(entry['name'], entry['feed_url'], entry.get('format', 'metro'),
+                                entry.get('center'), road_graph_file=entry.get('road_graph'),
+                                timezone=entry.get('timezone'))
+        systems.append(system)
+    names = [system.name for system in systems]
+    if not systems or len(set(names)) != len(names):
+        raise ValueError(f"{path} must list every system once, got {names}")
+    return systems
+
+
+def metro_la(url=feed_url, center=default_center, road_graph_file=None, timezone=station_timezone):
+    # the system of the single-system app, with the stores all modules use by default
+    return BikeSystem(default_system, url, 'metro', center, geo_data_file, station_store, availability_history,
+                      availability_forecast, road_graph_file, timezone)
+
+
+def refresh_systems(systems=None, workers=refresh_workers):
+    """
+        Polls the feeds of all systems once, in parallel.
+
+        Args:
+            systems (list): The BikeSystems (default: None, all served systems).
+            workers (int): The max number of feeds polled at the same time (default: refresh_workers).
+
+        Returns:
+            bool: True if any system stored new station data.
+        """
+    systems = list(bike_systems.values()) if systems is None else list(systems)
+    if len(systems) == 1 or workers <= 1:
+        return any([refresh_system(system) for system in systems])
+    # a pool per round, its threads do not outlive the poll (or a fork of the process)
+    with ThreadPoolExecutor(max_workers=min(workers, len(systems)), thread_name_prefix='feed-refresh') as pool:
+        return any(list(pool.map(refresh_system, systems)))
+
+
+def refresh_system(system):
+    # one failing system must not keep the others from being refreshed
+    try:
+        return system.refresh()
+    except Exception as e:
+        print(f"Refreshing {system.name} failed: {e}")
+        return False
+
+
+def system_named(name):
+    """
+        Returns a served system by name.
+
+        Args:
+            name (str): The system name, None for the default system.
+
+        Returns:
+            BikeSystem: The system.
+
+        Raises:
+            KeyError: If no system has that name.
+        """
+    return bike_systems[name] if name else system_router.systems[0]
+
+
+def system_for(latitude, longitude):
+    """
+        Returns the served system of a position.
+
+        Args:
+            latitude (float): The latitude of the position, 0.0 for the default system.
+            longitude (float): The longitude of the position, 0.0 for the default system.
+
+        Returns:
+            BikeSystem: The system.
+        """
+    return system_router.locate(latitude, longitude)
+
+
+# the served systems by name, in the order of the systems file
+bike_systems = {system.name: system for system in load_systems()}
+# router of the positions of all requests
+system_router = SystemRouter(bike_systems.values())
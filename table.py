@@ -0,0 +1,193 @@
+import html
+
+import numpy
+import pandas
+
+from cache import LRUCache
+from columns import station_columns
+
+# columns of the station table of a bike search
+bike_table_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                      'bikesAvailable', 'classicBikesAvailable', 'smartBikesAvailable', 'electricBikesAvailable',
+                      'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime', 'latitude', 'longitude']
+# columns of the station table of a dock search
+dock_table_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                      'bikesAvailable', 'docksAvailable', 'kioskPublicStatus', 'openTime', 'closeTime',
+                      'latitude', 'longitude']
+# columns of the station table of any other search
+station_table_columns = ['kioskId', 'name', 'addressStreet', 'addressCity', 'addressState', 'addressZipCode',
+                         'bikesAvailable', 'classicBikesAvailable', 'smartBikesAvailable', 'electricBikesAvailable',
+                         'docksAvailable', 'totalDocks', 'kioskPublicStatus', 'openTime', 'closeTime', 'latitude',
+                         'longitude']
+# table column -> StationColumns attribute holding its values
+column_attributes = {
+    'kioskId': 'kiosk_id', 'name': 'name', 'addressStreet': 'street', 'addressCity': 'city', 'addressState': 'state',
+    'addressZipCode': 'zip_code', 'bikesAvailable': 'bikes', 'classicBikesAvailable': 'classic_bikes',
+    'smartBikesAvailable': 'smart_bikes', 'electricBikesAvailable': 'electric_bikes', 'docksAvailable': 'docks',
+    'totalDocks': 'total_docks', 'kioskPublicStatus': 'status', 'openTime': 'open_minutes',
+    'closeTime': 'close_minutes', 'latitude': 'latitude', 'longitude': 'longitude',
+}
+# number of rendered tables kept, by system and snapshot version, columns and stations
+table_cache_size = 256
+
+# rendered tables of recent results
+station_tables = LRUCache(table_cache_size)
+
+
+class StationTable:
+    """
+        The rows of the station table of a snapshot, rendered once for every station.
+
+        Every row is kept as its finished <tr> markup, so a table of some stations is the header, the rows at
+        their positions and the footer joined together. The markup matches DataFrame.to_html() (class
+        "dataframe"), without the index and the geometry column.
+
+        Args:
+            columns (StationColumns): The typed station columns to render.
+            names (list): The table columns, keys of column_attributes.
+        """
+
+    def __init__(self, columns, names):
+        self.names = list(names)
+        self.kiosk_id = columns.kiosk_id
+        self.head = ('<table border="1" class="dataframe">\n<thead>\n<tr style="text-align: right;">'
+                     + ''.join(f'<th>{html.escape(name)}</th>' for name in self.names) + '</tr>\n</thead>\n<tbody>\n')
+        self.tail = '</tbody>\n</table>'
+        self.rows = self.render_rows(columns, numpy.arange(len(columns)))
+
+    def render_rows(self, columns, positions):
+        """
+            Renders the rows of stations.
+
+            Args:
+                columns (StationColumns): The typed station columns.
+                positions (ndarray): The positions of the stations.
+
+            Returns:
+                ndarray: The <tr> markup of every station, an object array.
+            """
+        rows = numpy.full(len(positions), '<tr>', dtype=object)
+        for name in self.names:
+            rows += '<td>' + cell_text(columns, name, positions) + '</td>'
+        return rows + '</tr>\n'
+
+    def patched(self, columns, positions):
+        """
+            Returns a copy of the table with the rows of some stations rendered again.
+
+            Args:
+                columns (StationColumns): The typed columns of the new snapshot, with the same stations in the
+                                          same order.
+                positions (ndarray): Positions of the changed stations.
+
+            Returns:
+                StationTable: The patched table.
+            """
+        patched = StationTable.__new__(StationTable)
+        patched.names, patched.head, patched.tail = self.names, self.head, self.tail
+        patched.kiosk_id = columns.kiosk_id
+        patched.rows = self.rows.copy()
+        patched.rows[positions] = self.render_rows(columns, positions)
+        return patched
+
+    def render(self, positions):
+        """
+            Renders the table of some stations, every kioskId once, in the order of its first occurrence.
+
+            Args:
+                positions (array-like): The positions of the stations.
+
+            Returns:
+                str: The HTML table.
+            """
+        return self.head + ''.join(self.rows[unique_stations(self.kiosk_id, positions)]) + self.tail
+
+
+def cell_text(columns, name, positions):
+    """
+        Returns the escaped cell texts of a table column.
+
+        Args:
+            columns (StationColumns): The typed station columns.
+            name (str): The table column.
+            positions (ndarray): The positions of the stations.
+
+        Returns:
+            ndarray: The texts, an object array; empty for missing values.
+        """
+    attribute = column_attributes[name]
+    if attribute in ('open_minutes', 'close_minutes'):
+        minutes = getattr(columns, attribute)[positions].astype(numpy.int64)
+        texts = numpy.char.add(numpy.char.add(numpy.char.zfill((minutes // 60).astype(str), 2), ':'),
+                               numpy.char.zfill((minutes % 60).astype(str), 2)).astype(object)
+        return numpy.where(minutes >= 0, texts, '')
+    if attribute == 'status':
+        values = columns.status_categories[columns.status_codes[positions]]
+    else:
+        values = getattr(columns, attribute, None)
+        if values is None:
+            return numpy.full(len(positions), '', dtype=object)
+        values = values[positions]
+    if values.dtype.kind in 'iuf':
+        return values.astype(str).astype(object)
+
+    # texts repeat (cities, states, status), escape every distinct value once
+    codes, uniques = pandas.factorize(values, use_na_sentinel=True)
+    escaped = numpy.array([html.escape(str(value)) for value in uniques] + [''], dtype=object)
+    return escaped[codes]
+
+
+def unique_stations(kiosk_ids, positions):
+    """
+        Drops the repeated stations of a list of positions, e.g. stations near both ends of a route.
+
+        Args:
+            kiosk_ids (ndarray): The kioskIds of all stations.
+            positions (array-like): The positions of the stations.
+
+        Returns:
+            ndarray: The positions of the first occurrence of every kioskId, in their original order.
+        """
+    positions = numpy.asarray(positions, dtype=numpy.intp)
+    _, first = numpy.unique(kiosk_ids[positions], return_index=True)
+    return positions[numpy.sort(first)]
+
+
+def station_table(snapshot, names=station_table_columns):
+    """
+        Returns the rendered rows of a station snapshot, building them once per snapshot and columns.
+
+        If only station counts or texts changed since the previous snapshot, the rows of the changed stations
+        are rendered again and the others are kept.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+            names (list): The table columns (default: station_table_columns).
+
+        Returns:
+            StationTable: The table of the snapshot's stations.
+        """
+    return snapshot.derived(('station_table', tuple(names)), lambda s: StationTable(station_columns(s), names),
+                            update=lambda table, s: table.patched(station_columns(s), s.diff.positions)
+                            if s.diff.same_layout else None)
+
+
+def render_station_table(snapshot, positions, names=station_table_columns):
+    """
+        Renders the table of some stations of a snapshot, every station once.
+
+        Args:
+            snapshot (StationSnapshot): The station snapshot.
+            positions (array-like): The row positions of the stations in the snapshot's frame.
+            names (list): The table columns (default: station_table_columns).
+
+        Returns:
+            str: The HTML table.
+        """
+    positions = numpy.asarray(positions, dtype=numpy.intp)
+    key = (snapshot.key, tuple(names), positions.tobytes())
+    table = station_tables.get(key)
+    if table is None:
+        table = station_table(snapshot, names).render(positions)
+        station_tables.put(key, table)
+    return table
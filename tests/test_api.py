@@ -0,0 +1,187 @@
+import os
+
+import numpy
+import pytest
+from flask import Flask
+
+import api
+import main
+import systems
+from functions import ORSBackend
+from benchmarks.synthetic import sample_feed_payload, synthetic_stations
+from history import AvailabilityHistory
+from snapshot import SnapshotStore
+from systems import BikeSystem, SystemRouter
+
+
+def write_feed(path, stations, mtime_ns=None):
+    # a feed file of the stations, optionally with a given modification time
+    with open(path, 'wb') as file:
+        file.write(sample_feed_payload(stations))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def city(tmp_path, name, latitude, longitude, stations=20):
+    # a system of synthetic stations around a position, its files in tmp_path
+    frame = synthetic_stations(stations, seed=len(name), spread=0.01)
+    frame['latitude'] += latitude - 34.05
+    frame['longitude'] += longitude + 118.25
+    (tmp_path / name).mkdir()
+    data_file = str(tmp_path / name / 'geo_data.json')
+    write_feed(data_file, frame, mtime_ns=1_000_000_000)
+    return BikeSystem(name, '', 'gbfs', data_file=data_file,
+                      history=AvailabilityHistory(str(tmp_path / name / 'history')))
+
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    # the API over two systems, Los Angeles the default one
+    served = [city(tmp_path, 'la', 34.05, -118.25), city(tmp_path, 'nyc', 40.73, -73.99)]
+    router = SystemRouter(served)
+    monkeypatch.setattr(systems, 'bike_systems', {system.name: system for system in served})
+    monkeypatch.setattr(systems, 'system_router', router)
+    monkeypatch.setattr(api, 'system_router', router)
+    # responses are cached by system name and snapshot version, the same for the systems of every test
+    api.api_responses.clear()
+    return served
+
+
+@pytest.fixture
+def client(served):
+    app = Flask(__name__)
+    app.register_blueprint(api.api_blueprint)
+    app.extensions['road_graph_file'] = None
+    app.extensions['route_backend'] = None
+    return app.test_client()
+
+
+def test_stations_of_the_default_and_a_named_system(client):
+    response = client.get('/api/stations')
+    assert response.status_code == 200
+    assert response.json['system'] == 'la' and response.json['count'] == 20
+
+    response = client.get('/api/stations?system=nyc&format=geojson')
+    assert response.json['system'] == 'nyc' and len(response.json['features']) == 20
+
+
+@pytest.mark.parametrize('query, status', [
+    ('/api/stations?format=xml', 400),
+    ('/api/stations?system=paris', 404),
+    ('/api/stations?min_bikes=many', 400),
+    ('/api/nearest?longitude=-118.25', 400),
+    ('/api/nearest?latitude=nan&longitude=-118.25', 400),
+    ('/api/nearest?latitude=34.05&longitude=-118.25&k=0', 400),
+    ('/api/nearest?latitude=34.05&longitude=-118.25&k=101', 400),
+    ('/api/route?latitude=34.05&longitude=-118.25', 400),
+    ('/api/reachable?latitude=34.05&longitude=-118.25&profile=driving-car', 400),
+    ('/api/reachable?latitude=34.05&longitude=-118.25&minutes=-1', 400),
+    # no road network for the default system of this app
+    ('/api/reachable?latitude=34.05&longitude=-118.25', 404),
+])
+def test_bad_requests(client, query, status):
+    response = client.get(query)
+    assert response.status_code == status
+    assert 'error' in response.json
+
+
+def test_nearest_stations_are_ordered_by_distance(client):
+    response = client.get('/api/nearest?latitude=40.73&longitude=-73.99&k=5')
+    assert response.status_code == 200
+    # the system of the position
+    assert response.json['system'] == 'nyc'
+    distances = response.json['distance']
+    assert len(distances) == 5 and distances == sorted(distances)
+
+
+def test_etag_answers_304_until_the_feed_changes(client, served):
+    response = client.get('/api/stations')
+    etag = response.headers['ETag']
+    assert client.get('/api/stations', headers={'If-None-Match': etag}).status_code == 304
+
+    # a new feed
+    write_feed(served[0].data_file, synthetic_stations(15, seed=7), mtime_ns=2_000_000_000)
+    response = client.get('/api/stations', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.json['count'] == 15
+    assert response.headers['ETag'] != etag
+
+
+def test_etag_does_not_depend_on_the_snapshot_version(client, served):
+    la = served[0]
+    etag = client.get('/api/stations').headers['ETag']
+
+    # another worker (or a restarted server) that numbered the same feed differently
+    with open(la.data_file, 'rb') as file:
+        payload = file.read()
+    other = SnapshotStore(la.data_file, 'la')
+    write_feed(la.data_file, synthetic_stations(3), mtime_ns=1_000_000_000)
+    other.get()
+    with open(la.data_file, 'wb') as file:
+        file.write(payload)
+    os.utime(la.data_file, ns=(1_000_000_000, 1_000_000_000))
+    assert other.get().version == 2
+    la.store = other
+    api.api_responses.clear()
+
+    response = client.get('/api/stations', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_batch_nearest_checks_its_body(client):
+    def post(**body):
+        return client.post('/api/nearest/batch', json=body)
+
+    assert post(latitude=[34.05], longitude=[]).status_code == 400
+    assert post(latitude=[None], longitude=[-118.25]).status_code == 400
+    for k in (0, -1, 101, 100000):
+        assert post(latitude=[34.05], longitude=[-118.25], k=k).status_code == 400
+    assert post(latitude=[34.05], longitude=[-118.25], system='paris').status_code == 404
+    assert post(latitude=[0.0] * (api.batch_points_max + 1),
+                longitude=[0.0] * (api.batch_points_max + 1)).status_code == 413
+
+
+def test_batch_nearest_answers_every_point_from_the_system_of_its_position(client, served):
+    response = client.post('/api/nearest/batch', json={'latitude': [34.05, 40.73, 34.06],
+                                                       'longitude': [-118.25, -73.99, -118.24], 'k': 3})
+    assert response.status_code == 200
+    assert response.json['system'] == ['la', 'nyc', 'la']
+    assert response.json['version'] == {'la': 1, 'nyc': 1}
+    kiosk_ids = {system.name: set(system.store.get().frame['kioskId'].tolist()) for system in served}
+    for system, ids, distances in zip(response.json['system'], response.json['kioskId'],
+                                      response.json['distance']):
+        assert len(ids) == 3 and set(ids) <= kiosk_ids[system]
+        assert distances == sorted(distances)
+
+    # a named system answers every point
+    response = client.post('/api/nearest/batch', json={'latitude': [34.05, 40.73], 'longitude': [-118.25, -73.99],
+                                                       'k': 2, 'system': 'nyc'})
+    assert response.json['system'] == 'nyc'
+    assert numpy.array(response.json['distance']).shape == (2, 2)
+
+
+class ErrorBackend:
+    # answers every leg with an error response of the routing service
+    name = 'error'
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def route(self, source_lat, source_long, dest_lat, dest_long, travel_type):
+        return ORSBackend.decode(b'{"error": {"code": 2099, "message": "failed"}}', travel_type, self.status_code)
+
+
+@pytest.mark.parametrize('status_code, status', [(404, 422), (400, 502), (429, 502), (500, 502)])
+def test_route_errors_of_the_routing_service(client, status_code, status):
+    client.application.extensions['route_backend'] = ErrorBackend(status_code)
+    response = client.get('/api/route?latitude=34.04&longitude=-118.26&dest_latitude=34.06&dest_longitude=-118.24')
+    assert response.status_code == status
+
+
+
+@pytest.mark.parametrize('status_code, status', [(404, 422), (429, 502)])
+def test_search_page_shows_route_errors_of_the_routing_service(served, status_code, status):
+    client = main.create_app(backend=ErrorBackend(status_code)).test_client()
+    response = client.post('/', data={'latitude': '34.04', 'longitude': '-118.26', 'destLat': '34.06',
+                                      'destLong': '-118.24', 'rankings': '3', 'searchBike': 'on',
+                                      'available_pieces': '1'})
+    assert response.status_code == status
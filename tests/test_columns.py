@@ -0,0 +1,70 @@
+import numpy
+import pandas
+import pytest
+
+from benchmarks.synthetic import sample_stations
+from columns import StationColumns, parse_minutes
+from functions import select_bikes, select_docks
+
+
+@pytest.fixture
+def stations():
+    return sample_stations()
+
+
+def test_columns_keep_the_values_of_the_frame_with_compact_dtypes(stations):
+    columns = StationColumns.from_frame(stations)
+    assert len(columns) == len(stations)
+    assert columns.kiosk_id.dtype == numpy.int32 and columns.bikes.dtype == numpy.int16
+    assert columns.kiosk_id.tolist() == stations['kioskId'].tolist()
+    assert columns.docks.tolist() == stations['docksAvailable'].tolist()
+    assert columns.status.tolist() == stations['kioskPublicStatus'].tolist()
+    assert columns.name.tolist() == stations['name'].tolist()
+
+
+def test_columns_of_a_feed_without_optional_columns(stations):
+    columns = StationColumns.from_frame(stations.drop(columns=['electricBikesAvailable', 'openTime']))
+    assert not columns.electric_bikes.any()
+    assert (columns.open_minutes == -1).all()
+
+
+def test_parse_minutes():
+    times = pandas.Series(['05:45:00', None, '23:59', 'closed', '00:00:00', '05:45:00'])
+    assert parse_minutes(times).tolist() == [345, -1, 1439, -1, 0, 345]
+    assert parse_minutes(pandas.Series([None, None])).tolist() == [-1, -1]
+    assert parse_minutes(pandas.Series([], dtype=object)).tolist() == []
+
+
+@pytest.mark.parametrize('drop_numbers', [0, 1, 5])
+def test_masks_keep_the_stations_of_the_row_filters(stations, drop_numbers):
+    columns = StationColumns.from_frame(stations)
+    assert stations.index[columns.bikes_mask(drop_numbers)].equals(select_bikes(stations, drop_numbers).index)
+    assert stations.index[columns.docks_mask(drop_numbers)].equals(select_docks(stations, drop_numbers).index)
+
+
+def test_status_mask_checks_every_category_once(stations):
+    columns = StationColumns.from_frame(stations)
+    expected = stations['kioskPublicStatus'].str.contains('Active').to_numpy()
+    numpy.testing.assert_array_equal(columns.status_mask('Active'), expected)
+    numpy.testing.assert_array_equal(columns.status_mask('Active', numpy.array([3, 1])), expected[[3, 1]])
+    assert not columns.status_mask('Closed').any()
+
+
+def test_patched_columns_equal_the_columns_of_the_new_frame(stations):
+    columns = StationColumns.from_frame(stations)
+    new = stations.copy()
+    new.loc[new.index[[2, 7]], 'bikesAvailable'] = [0, 17]
+    new.loc[new.index[7], 'kioskPublicStatus'] = 'Unavailable'
+
+    patched = columns.patched(new, numpy.array([2, 7]))
+    expected = StationColumns.from_frame(new)
+    assert patched.bikes.tolist() == expected.bikes.tolist()
+    assert patched.status.tolist() == expected.status.tolist()
+    # the columns of the previous snapshot are unchanged
+    assert columns.bikes[7] == stations['bikesAvailable'].iloc[7]
+
+
+def test_patch_with_an_unknown_status_needs_a_rebuild(stations):
+    new = stations.copy()
+    new.loc[new.index[0], 'kioskPublicStatus'] = 'Relocating'
+    assert StationColumns.from_frame(stations).patched(new, numpy.array([0])) is None
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from benchmarks.synthetic import sample_feed_payload, synthetic_stations
+from functions import store_feed
+from snapshot import SnapshotStore
+
+
+@pytest.fixture
+def feed(tmp_path):
+    data_file = str(tmp_path / 'data' / 'geo_data.json')
+    return data_file, SnapshotStore(data_file), {'etag': None, 'last_modified': None, 'sha1': None}
+
+
+def test_store_feed_saves_new_data_and_reloads_the_store(feed):
+    data_file, store, validators = feed
+    payload = sample_feed_payload(synthetic_stations(10))
+
+    assert store_feed(payload, data_file, store, None, validators)
+    with open(data_file, 'rb') as file:
+        assert file.read() == payload
+    assert validators['sha1'] is not None
+    assert len(store.peek().frame) == 10
+    # no temporary file is left behind
+    assert sorted(os.listdir(os.path.dirname(data_file))) == ['geo_data.json', 'geo_station_live.csv']
+
+
+def test_store_feed_skips_an_unchanged_payload(feed):
+    data_file, store, validators = feed
+    payload = sample_feed_payload(synthetic_stations(10))
+    store_feed(payload, data_file, store, None, validators)
+    mtime = os.stat(data_file).st_mtime_ns
+
+    assert not store_feed(payload, data_file, store, None, validators)
+    assert os.stat(data_file).st_mtime_ns == mtime
+    assert store.get().version == 1
+
+    assert store_feed(sample_feed_payload(synthetic_stations(12)), data_file, store, None, validators)
+    assert store.get().version == 2
+
+
+def test_store_feed_rejects_invalid_json(feed):
+    data_file, store, validators = feed
+    with pytest.raises(ValueError):
+        store_feed(b'{"type": "FeatureCollection", ', data_file, store, None, validators)
+    assert not os.path.exists(data_file)
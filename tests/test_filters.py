@@ -0,0 +1,83 @@
+import datetime
+
+import numpy
+import pytest
+
+from benchmarks.synthetic import synthetic_stations
+from columns import StationColumns
+from filters import AvailabilityIndex, StationFilter, local_minutes, open_mask
+
+
+@pytest.fixture(scope='module')
+def columns():
+    stations = synthetic_stations(2000, seed=3)
+    # a few stations with many electric bikes, so their threshold gathers from the sorted counts
+    stations.loc[stations.index[:5], 'electricBikesAvailable'] = 12
+    # opening hours of the day, overnight and unknown
+    stations.loc[stations.index[::3], ['openTime', 'closeTime']] = '06:00:00', '22:00:00'
+    stations.loc[stations.index[1::3], ['openTime', 'closeTime']] = '22:00:00', '02:00:00'
+    stations.loc[stations.index[2::3], 'openTime'] = None
+    return StationColumns.from_frame(stations)
+
+
+def test_open_mask_across_midnight():
+    open_minutes = numpy.array([360, 1320, -1, 600])
+    close_minutes = numpy.array([1320, 120, 1320, 600])
+    # 06:00-22:00, 22:00-02:00, unknown, same opening and closing time
+    assert open_mask(open_minutes, close_minutes, 23 * 60).tolist() == [False, True, True, True]
+    assert open_mask(open_minutes, close_minutes, 60).tolist() == [False, True, True, True]
+    assert open_mask(open_minutes, close_minutes, 3 * 60).tolist() == [False, False, True, True]
+    assert open_mask(open_minutes, close_minutes, 12 * 60).tolist() == [True, False, True, True]
+    assert open_mask(open_minutes, close_minutes, 22 * 60).tolist() == [True, True, True, True]
+
+
+@pytest.mark.parametrize('station_filter', [
+    StationFilter(),
+    StationFilter(min_bikes=3),
+    StationFilter(min_bikes=2, min_docks=4, active=True),
+    StationFilter(min_electric_bikes=10, min_docks=1),
+    StationFilter(min_electric_bikes=10, active=True, open_at=23 * 60),
+    StationFilter(min_classic_bikes=1, open_at=3 * 60),
+    StationFilter(min_smart_bikes=100),
+])
+def test_filter_with_an_availability_index_equals_the_fused_pass(columns, station_filter):
+    expected = numpy.ones(len(columns), dtype=bool)
+    for attribute, minimum in station_filter.thresholds.items():
+        expected &= getattr(columns, attribute) >= minimum
+    if station_filter.active:
+        expected &= columns.status_mask('Active')
+    if station_filter.open_at is not None:
+        expected &= open_mask(columns.open_minutes, columns.close_minutes, station_filter.open_at)
+
+    availability = AvailabilityIndex(columns)
+    numpy.testing.assert_array_equal(station_filter.evaluate(columns), expected)
+    numpy.testing.assert_array_equal(station_filter.evaluate(columns, availability), expected)
+    # again from the cached threshold masks
+    numpy.testing.assert_array_equal(station_filter.evaluate(columns, availability), expected)
+
+
+def test_availability_index_counts_and_positions(columns):
+    availability = AvailabilityIndex(columns)
+    assert availability.count_at_least('electric_bikes', 10) == int((columns.electric_bikes >= 10).sum())
+    assert sorted(availability.at_least('electric_bikes', 10).tolist()) == \
+        numpy.flatnonzero(columns.electric_bikes >= 10).tolist()
+    assert availability.count_at_least('bikes', 0) == len(columns)
+    assert availability.count_at_least('bikes', 10_000) == 0
+    assert not availability.at_least_mask('docks', 5).flags.writeable
+
+
+def test_combined_filter_keeps_the_stations_both_keep(columns):
+    first = StationFilter(min_bikes=2, min_docks=5)
+    second = StationFilter(min_bikes=4, active=True, open_at=60)
+    availability = AvailabilityIndex(columns)
+    numpy.testing.assert_array_equal((first & second).evaluate(columns, availability),
+                                     first.evaluate(columns) & second.evaluate(columns))
+    assert (first & second).key() == (second & first).key()
+    with pytest.raises(ValueError):
+        second & StationFilter(open_at=120)
+
+
+def test_local_minutes_in_the_time_zone_of_the_stations():
+    now = datetime.datetime(2024, 1, 15, 7, 30, tzinfo=datetime.timezone.utc)
+    assert local_minutes(now) == 23 * 60 + 30
+    assert local_minutes(now, timezone='America/New_York') == 2 * 60 + 30
@@ -0,0 +1,75 @@
+import datetime
+import zoneinfo
+
+import numpy
+import pytest
+
+from forecast import AvailabilityForecast, min_training_polls, slot_seconds, week_slot, week_slots
+from history import AvailabilityHistory, history_columns
+
+los_angeles = zoneinfo.ZoneInfo('America/Los_Angeles')
+
+
+def local_time(*args):
+    # unix time of a wall clock time in Los Angeles
+    return datetime.datetime(*args, tzinfo=los_angeles).timestamp()
+
+
+def test_week_slots_start_on_monday_midnight_local_time():
+    # Monday 2024-01-15 in winter time
+    monday = local_time(2024, 1, 15)
+    assert week_slot([monday, monday + 29 * 60, monday + 30 * 60]).tolist() == [0, 0, 1]
+    assert week_slot(monday - 1) == week_slots - 1
+    assert week_slot(local_time(2024, 1, 17, 13, 45)) == 2 * 48 + 27
+    # the same wall clock time in summer time, and the slot of a time zone further east
+    assert week_slot(local_time(2024, 7, 15)) == 0
+    assert week_slot(monday, timezone='America/New_York') == 6
+    assert week_slot(numpy.full((2, 3), monday)).shape == (2, 3)
+
+
+@pytest.fixture
+def polls():
+    # 4 weeks of polls every 15 minutes for 2 stations: the first one has 10 bikes from 8:00 to 18:00 and 2
+    # otherwise, the second one always 5; docks are the complement to 20
+    times = numpy.arange(local_time(2024, 1, 1), local_time(2024, 1, 29), 900)
+    hours = (week_slot(times) % 48) / 2
+    bikes = numpy.stack([numpy.where((8 <= hours) & (hours < 18), 10, 2), numpy.full(len(times), 5)], axis=1)
+    return times, {'bikes': bikes, 'docks': 20 - bikes}
+
+
+def test_trained_profiles_follow_the_time_of_week(polls):
+    times, counts = polls
+    model = AvailabilityForecast.train(times, counts, numpy.array([7, 3]))
+    monday = local_time(2024, 1, 29)
+    noon, night = week_slot(monday + 12 * 3600), week_slot(monday + 2 * 3600)
+    assert model.profiles['bikes'][noon].tolist() == pytest.approx([10, 5])
+    assert model.profiles['bikes'][night].tolist() == pytest.approx([2, 5])
+    assert model.profiles['docks'][noon].tolist() == pytest.approx([10, 15])
+    assert model.interval == 900
+
+
+def test_prediction_decays_from_the_current_count_to_the_profile(polls):
+    times, counts = polls
+    model = AvailabilityForecast.train(times, counts, numpy.array([7, 3]))
+    # Monday 7:00, the first station has 6 bikes more than usual
+    now = local_time(2024, 1, 29, 7)
+
+    assert model.predict('bikes', [7], [8], 0, now=now).tolist() == pytest.approx([8])
+    # 5 hours later it is expected at the midday profile, the unknown station keeps its count
+    later = model.predict('bikes', [7, 3, 99], [8, 5, 4], 5 * 3600, now=now)
+    assert later.tolist() == pytest.approx([10, 5, 4], abs=0.1)
+    # never below 0
+    assert model.predict('bikes', [7], [0], numpy.arange(0, 3600, slot_seconds), now=now).min() >= 0
+
+
+def test_no_model_from_a_short_history(tmp_path):
+    history = AvailabilityHistory(str(tmp_path))
+    start = int(local_time(2024, 1, 1))
+    for number in range(min_training_polls - 1):
+        poll = {column: numpy.full(2, number % 7) for column in history_columns}
+        history.append(start + 60 * number, [7, 3], poll)
+    assert AvailabilityForecast.from_history(history, now=start + 3600, days=1) is None
+
+    history.append(start + 3600, [7, 3], {column: numpy.full(2, 4) for column in history_columns})
+    model = AvailabilityForecast.from_history(history, now=start + 3600, days=1)
+    assert model.kiosk_ids.tolist() == [7, 3] and model.interval == 60
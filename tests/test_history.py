@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+
+import numpy
+
+from history import AvailabilityHistory, history_columns
+
+
+def counts(base, n):
+    # the counts of a poll of n stations, column c of station s is base + 10 * c + s
+    return {column: base + 10 * number + numpy.arange(n) for number, column in enumerate(history_columns)}
+
+
+def test_append_records_polls_in_time_order(tmp_path):
+    history = AvailabilityHistory(str(tmp_path))
+    assert history.append(100, [1, 2, 3], counts(0, 3))
+    assert history.append(160, [1, 2, 3], counts(1, 3))
+    # not newer than the last poll
+    assert not history.append(160, [1, 2, 3], counts(2, 3))
+
+    assert history.polls == 2 and len(history) == 6
+    assert history.stats()['layouts'] == 1
+    station = history.station(2)
+    assert station['time'].tolist() == [100, 160]
+    assert station['bikes'].tolist() == [1, 2]
+    # reopened from disk
+    assert AvailabilityHistory(str(tmp_path)).window()['kioskId'].tolist() == [1, 2, 3, 1, 2, 3]
+
+
+def test_append_truncates_an_uncommitted_tail(tmp_path):
+    history = AvailabilityHistory(str(tmp_path))
+    history.append(100, [1, 2], counts(0, 2))
+    # an append interrupted before meta.json was replaced
+    for name in ['polls.bin', 'bikes.bin']:
+        with open(os.path.join(tmp_path, name), 'ab') as file:
+            file.write(b'\x07' * 5)
+
+    reopened = AvailabilityHistory(str(tmp_path))
+    assert reopened.polls == 1
+    reopened.append(200, [1, 2], counts(5, 2))
+    assert os.path.getsize(os.path.join(tmp_path, 'bikes.bin')) == 4 * 2
+    assert reopened.station(1)['bikes'].tolist() == [0, 5]
+    assert reopened.station(2)['docks'].tolist() == [41, 46]
+
+
+def test_matrix_spans_a_layout_change(tmp_path):
+    history = AvailabilityHistory(str(tmp_path))
+    history.append(100, [1, 2, 3], counts(0, 3))
+    history.append(200, [1, 2, 3], counts(1, 3))
+    # station 2 removed, station 4 added
+    history.append(300, [1, 3, 4], counts(2, 3))
+    assert history.stats()['layouts'] == 2
+
+    times, matrices = history.matrix(['bikes', 'docks'], [4, 2, 1])
+    assert times.tolist() == [100, 200, 300]
+    assert matrices['bikes'].tolist() == [[-1, 1, 0], [-1, 2, 1], [4, -1, 2]]
+    assert matrices['docks'][2].tolist() == [44, -1, 42]
+
+    times, matrices = history.matrix(['bikes'], [3], start=200)
+    assert times.tolist() == [200, 300]
+    assert matrices['bikes'][:, 0].tolist() == [3, 3]
+
+
+def append_polls(folder, offset, polls):
+    # a writer process: polls of 3 stations, the counts hold the time of the poll
+    history = AvailabilityHistory(folder)
+    recorded = 0
+    for number in range(polls):
+        timestamp = 1000 + 4 * number + offset
+        recorded += history.append(timestamp, [1, 2, 3], {column: numpy.full(3, timestamp - 1000)
+                                                          for column in history_columns})
+    return recorded
+
+
+def test_appends_of_several_processes_do_not_interleave(tmp_path):
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        recorded = sum(pool.starmap(append_polls, [(str(tmp_path), offset, 50) for offset in range(4)]))
+
+    history = AvailabilityHistory(str(tmp_path))
+    assert history.polls == recorded and len(history) == 3 * recorded
+    window = history.window()
+    assert (window['bikes'] == window['time'] - 1000).all()
+    assert (window['docks'] == window['time'] - 1000).all()
+    assert numpy.all(numpy.diff(history.station(2)['time']) > 0)
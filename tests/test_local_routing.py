@@ -0,0 +1,69 @@
+import os
+
+import numpy
+import pytest
+
+from local_routing import BIKE, FOOT, LocalBackend, RoadGraph, load_geojson_graph
+from routing import NoRouteError
+
+test_graph_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'routes',
+                               'test_graph.geojson')
+
+
+@pytest.fixture(scope='module')
+def graph():
+    # parsed from the source, load_road_graph() would write its .npz cache into the repository
+    return load_geojson_graph(test_graph_file)
+
+
+@pytest.mark.parametrize('profile', ['foot-walking', 'cycling-regular'])
+def test_shortest_path_matches_dijkstra(graph, profile):
+    rng = numpy.random.default_rng(0)
+    indptr, indices, lengths, access = graph.adjacency()
+    for source, target in rng.integers(0, len(graph), (10, 2)).tolist():
+        path, length = graph.shortest_path(source, target, profile)
+        assert path[0] == source and path[-1] == target
+        assert length == pytest.approx(graph.travel_distances(source, profile, numpy.inf)[target])
+        # every step follows an edge
+        for node, neighbour in zip(path, path[1:]):
+            assert neighbour in indices[indptr[node]:indptr[node + 1]]
+
+
+def test_route_ends_at_the_requested_positions(graph):
+    coordinates = LocalBackend(graph).route(34.05, -118.25, 34.04, -118.26, 'foot-walking')
+    assert coordinates[0].tolist() == [34.05, -118.25]
+    assert coordinates[-1].tolist() == [34.04, -118.26]
+    # the nodes in between are (latitude, longitude) positions of the graph
+    nodes = {tuple(position) for position in graph.lonlat[:, ::-1].tolist()}
+    assert len(coordinates) > 2 and all(tuple(position) in nodes for position in coordinates[1:-1].tolist())
+
+
+def test_unreachable_pair_raises_no_route_error():
+    # a one-way street: bikes only from node 0 to node 1, pedestrians both ways
+    lonlat = [[-118.25, 34.05], [-118.25, 34.051]]
+    graph = RoadGraph.from_edges(lonlat, [0, 1], [1, 0], [FOOT | BIKE, FOOT])
+
+    assert graph.shortest_path(1, 0, 'foot-walking')[0] == [1, 0]
+    assert graph.shortest_path(0, 1, 'cycling-regular')[0] == [0, 1]
+    with pytest.raises(NoRouteError):
+        graph.shortest_path(1, 0, 'cycling-regular')
+    with pytest.raises(NoRouteError):
+        LocalBackend(graph).route(34.051, -118.25, 34.05, -118.25, 'cycling-regular')
+
+
+def test_failed_save_keeps_the_saved_graph(graph, tmp_path, monkeypatch):
+    path = str(tmp_path / 'graph.npz')
+    graph.save(path)
+
+    def partial_savez(file, **arrays):
+        file.write(b'PK partial')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(numpy, 'savez', partial_savez)
+    with pytest.raises(OSError):
+        graph.save(path)
+    monkeypatch.undo()
+
+    loaded = RoadGraph.load(path)
+    numpy.testing.assert_array_equal(loaded.lonlat, graph.lonlat)
+    numpy.testing.assert_array_equal(loaded.indices, graph.indices)
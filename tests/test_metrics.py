@@ -0,0 +1,29 @@
+import numpy
+
+from metrics import Registry, metric_prefix, sample
+
+
+def test_samples_keep_every_digit():
+    assert sample('requests_total', {}, 1234567) == f'{metric_prefix}requests_total 1234567'
+    assert sample('requests_total', {}, numpy.int64(2 ** 40)).endswith(' 1099511627776')
+    assert sample('span_seconds_sum', {'span': 'routing'}, 1234.56789012).endswith(' 1234.56789012')
+    assert sample('span_seconds_sum', {}, float('inf')).endswith(' +Inf')
+    assert sample('span_seconds_sum', {}, float('nan')).endswith(' NaN')
+
+
+def test_labels_are_escaped():
+    line = sample('requests_total', {'endpoint': 'a"b\\c\nd'}, 1)
+    assert line == f'{metric_prefix}requests_total{{endpoint="a\\"b\\\\c\\nd"}} 1'
+
+
+def test_registry_renders_counters_and_histograms():
+    registry = Registry()
+    registry.count('requests_total', 1000000, endpoint='index')
+    registry.observe('routing', 0.25)
+    registry.observe('routing', 1.5)
+    text = registry.render([('cache_hits_total', {'cache': 'maps'}, 3)])
+
+    assert f'{metric_prefix}requests_total{{endpoint="index"}} 1000000' in text
+    assert f'{metric_prefix}span_seconds_sum{{span="routing"}} 1.75' in text
+    assert f'{metric_prefix}span_seconds_count{{span="routing"}} 2' in text
+    assert f'{metric_prefix}cache_hits_total{{cache="maps"}} 3' in text
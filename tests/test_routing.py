@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+import numpy
+import pytest
+
+from routing import RouteCache, decode_route_coordinates, route_key
+
+# the sample ORS responses of the repository
+routes_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'routes')
+
+route = numpy.array([[34.05, -118.25], [34.06, -118.24], [34.07, -118.23]])
+
+
+def test_route_cache_expires_routes_in_memory_and_on_disk(tmp_path):
+    cache = RouteCache(str(tmp_path), ttl=0.2)
+    key = route_key('foot-walking', 34.05, -118.25, 34.07, -118.23)
+    cache.put(key, route)
+    numpy.testing.assert_array_equal(cache.get(key), route)
+
+    time.sleep(0.3)
+    assert cache.get(key) is None
+
+
+def test_route_cache_reads_routes_of_a_previous_process_from_disk(tmp_path):
+    key = route_key('cycling-regular', 34.05, -118.25, 34.07, -118.23)
+    RouteCache(str(tmp_path)).put(key, route)
+
+    cache = RouteCache(str(tmp_path))
+    numpy.testing.assert_array_equal(cache.get(key), route)
+    assert cache.stats()['disk_hits'] == 1
+    # expired on disk
+    path = cache._path(key)
+    os.utime(path, (0, 0))
+    assert RouteCache(str(tmp_path)).get(key) is None
+
+
+def test_route_cache_evicts_the_oldest_files_beyond_the_limit(tmp_path):
+    cache = RouteCache(str(tmp_path), max_files=10)
+    keys = [route_key('foot-walking', 34.0 + number / 100, -118.25, 34.07, -118.23) for number in range(11)]
+    now = time.time()
+    for number, key in enumerate(keys[:10]):
+        cache.put(key, route)
+        # written a minute ago, one second apart
+        os.utime(cache._path(key), (now - 60 + number, now - 60 + number))
+    cache.memory.clear()
+
+    cache.put(keys[10], route)
+    # shrunk to 90% of the limit, the oldest files went first
+    assert len(os.listdir(tmp_path)) == 9
+    assert not os.path.exists(cache._path(keys[0]))
+    assert os.path.exists(cache._path(keys[10]))
+    assert cache.stats()['disk_evicted'] == 2
+
+
+def sample_route(profile):
+    with open(os.path.join(routes_folder, f'geo_data_route_{profile}.json'), 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('profile', ['foot-walking', 'cycling-regular'])
+def test_decoded_route_equals_the_parsed_json(profile):
+    payload = sample_route(profile)
+    coordinates = json.loads(payload)['features'][0]['geometry']['coordinates']
+
+    decoded = decode_route_coordinates(payload)
+    assert decoded.shape == (len(coordinates), 2)
+    numpy.testing.assert_array_equal(decoded, numpy.array(coordinates)[:, ::-1])
+    # pretty printed the same
+    numpy.testing.assert_array_equal(decode_route_coordinates(json.dumps(json.loads(payload), indent=2).encode()),
+                                     decoded)
+
+
+def test_decoded_route_keeps_latitude_and_longitude_of_positions_with_elevation():
+    payload = json.dumps({'features': [{'geometry': {'coordinates': [[-118.25, 34.05, 80.5], [-118.24, 34.06, 82.0]],
+                                                     'type': 'LineString'}}]}).encode()
+    numpy.testing.assert_array_equal(decode_route_coordinates(payload), [[34.05, -118.25], [34.06, -118.24]])
+
+
+@pytest.mark.parametrize('coordinates', [b'[[-118.25, 34.05], [-118.24, ]]', b'[[-118.25, 34.05], [x, 34.06]]',
+                                         b'[[-118.25, 34.05], [-118.24, 34.06, 1.0]]',
+                                         b'[[-118.25, 34.05], [-118.24, 34.06, 1.0, 2.0]]'])
+def test_malformed_coordinates_are_rejected_instead_of_truncated(coordinates):
+    payload = b'{"features": [{"geometry": {"coordinates": ' + coordinates + b', "type": "LineString"}}]}'
+    with pytest.raises(ValueError):
+        decode_route_coordinates(payload)
+
+
+def test_error_response_has_no_route():
+    with pytest.raises(KeyError):
+        decode_route_coordinates(b'{"error": {"code": 2010, "message": "Could not find routable point"}}')
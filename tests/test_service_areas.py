@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import numpy
+import pytest
+
+from local_routing import load_geojson_graph
+from service_areas import ServiceAreas, build_service_areas, load_service_areas, profile_speeds
+from spatial import project_points
+
+test_graph_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'routes',
+                               'test_graph.geojson')
+
+
+@pytest.fixture(scope='module')
+def graph():
+    return load_geojson_graph(test_graph_file)
+
+
+@pytest.fixture(scope='module')
+def lonlat(graph):
+    # stations on 20 nodes of the graph
+    nodes = numpy.random.default_rng(5).choice(len(graph), 20, replace=False)
+    return graph.lonlat[nodes].copy()
+
+
+@pytest.fixture(scope='module')
+def areas(graph, lonlat):
+    return build_service_areas(graph, graph.reversed(), lonlat, 'foot-walking', workers=1)
+
+
+def expected_seconds(graph, areas, lonlat, lat, long):
+    # the travel time from the center of the cell of a position along the network to every station
+    cell = int(areas.cells(lat, long))
+    row, column = divmod(cell, areas.shape[1])
+    center = numpy.array(areas.origin) + (numpy.array([column, row]) + 0.5) * areas.cell
+    snap, node = graph.tree.query(center)
+    scale = 1 / numpy.cos(numpy.radians(numpy.mean(lonlat[:, 1])))
+    x, y = project_points(lonlat[:, 1], lonlat[:, 0])
+    _, station_nodes = graph.tree.query(numpy.column_stack((x, y)))
+    distances = graph.travel_distances(int(node), 'foot-walking', numpy.inf)
+    network = numpy.array([distances.get(int(station), numpy.inf) for station in station_nodes])
+    return (snap / scale + network) / profile_speeds['foot-walking']
+
+
+@pytest.mark.parametrize('position', [(34.05, -118.25), (34.04, -118.26), (34.065, -118.235)])
+def test_reachable_stations_are_ordered_by_their_travel_time(graph, lonlat, areas, position):
+    stations, seconds = areas.reachable(*position, 15)
+    assert len(stations) and numpy.all(numpy.diff(seconds.astype(int)) >= 0)
+
+    expected = expected_seconds(graph, areas, lonlat, *position)
+    numpy.testing.assert_allclose(seconds, expected[stations], atol=1.0)
+    # every station within the time is listed
+    assert set(stations.tolist()) == set(numpy.flatnonzero(expected <= 15 * 60).tolist())
+
+
+def test_reachable_within_less_time_is_a_prefix(areas):
+    stations, seconds = areas.reachable(34.04, -118.26, 15)
+    fewer, fewer_seconds = areas.reachable(34.04, -118.26, 5)
+    assert 0 < len(fewer) < len(stations)
+    assert fewer.tolist() == stations[:len(fewer)].tolist()
+    assert fewer_seconds.max(initial=0) <= 300 < seconds[len(fewer):].min(initial=301)
+
+
+def test_no_station_is_reachable_from_outside_the_grid(areas):
+    stations, seconds = areas.reachable(40.73, -73.99, 15)
+    assert len(stations) == 0 and len(seconds) == 0
+
+
+def test_areas_are_cached_on_disk(tmp_path, lonlat, areas):
+    # a copy of the graph, its .npz cache is written next to it
+    graph_file = str(tmp_path / 'graph.geojson')
+    shutil.copy(test_graph_file, graph_file)
+    folder = str(tmp_path / 'service_areas')
+
+    built = load_service_areas(graph_file, lonlat, 'foot-walking', folder=folder, workers=1)
+    assert os.listdir(folder) and not any(name.endswith('.tmp') for name in os.listdir(folder))
+    loaded = ServiceAreas.load(os.path.join(folder, os.listdir(folder)[0]))
+    assert loaded.matches(lonlat) and loaded.shape == built.shape == areas.shape
+    numpy.testing.assert_array_equal(loaded.stations, areas.stations)
+    numpy.testing.assert_array_equal(loaded.seconds, areas.seconds)
+    # other stations get other areas
+    load_service_areas(graph_file, lonlat[:10], 'foot-walking', folder=folder, workers=1)
+    assert len(os.listdir(folder)) == 2
@@ -0,0 +1,102 @@
+import os
+
+import numpy
+import pandas
+import pytest
+
+from benchmarks.synthetic import sample_feed_payload, synthetic_stations
+from snapshot import SnapshotStore, diff_frames
+
+
+def write_feed(path, stations, mtime_ns=None):
+    # a feed file of the stations, optionally with a given modification time
+    with open(path, 'wb') as file:
+        file.write(sample_feed_payload(stations))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def stations():
+    return synthetic_stations(20, seed=1)
+
+
+def test_store_returns_cached_snapshot_while_the_file_is_unchanged(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations)
+    store = SnapshotStore(path, 'test')
+
+    first = store.get()
+    assert store.get() is first
+    assert first.version == 1 and first.key == ('test', 1) and first.diff is None
+    assert store.stats()['misses'] == 1 and store.stats()['hits'] == 1
+
+
+def test_store_reloads_when_the_mtime_changes(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations, mtime_ns=1_000_000_000)
+    store = SnapshotStore(path)
+    first = store.get()
+
+    # same content and size, newer file
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    second = store.get()
+    assert second is not first
+    assert second.version == 2 and store.stats()['reloads'] == 1
+    assert len(second.diff.changed) == 0 and second.diff.same_layout
+
+
+def test_store_reloads_when_the_size_changes(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations, mtime_ns=1_000_000_000)
+    store = SnapshotStore(path)
+    store.get()
+
+    # a station less, written with the same mtime
+    write_feed(path, stations.iloc[1:], mtime_ns=1_000_000_000)
+    second = store.get()
+    assert second.version == 2
+    assert second.diff.removed.tolist() == [stations['kioskId'].iloc[0]]
+    # the diff is published to the clients of the change stream
+    assert [diff.version for diff in store.changes.since(1, timeout=0)] == [2]
+
+
+def test_diff_of_equal_frames_is_empty(stations):
+    diff = diff_frames(stations, stations.copy(), 1, 2, 'test')
+    assert (diff.base_version, diff.version, diff.system) == (1, 2, 'test')
+    assert len(diff.changed) == len(diff.added) == len(diff.removed) == len(diff.moved) == 0
+    assert diff.same_layout and len(diff.rows) == 0
+
+
+def test_diff_finds_changed_added_removed_and_moved_stations(stations):
+    new = stations.copy()
+    ids = stations['kioskId'].tolist()
+    new.loc[new.index[2], 'bikesAvailable'] += 1
+    new.loc[new.index[3], 'latitude'] += 0.001
+    # the first station removed, a new one appended
+    added = new.iloc[[5]].assign(kioskId=999999)
+    new = pandas.concat([new.iloc[1:], added], ignore_index=True)
+
+    diff = diff_frames(stations, new)
+    assert sorted(diff.changed.tolist()) == [ids[2], ids[3]]
+    assert diff.moved.tolist() == [ids[3]]
+    assert diff.added.tolist() == [999999]
+    assert diff.removed.tolist() == [ids[0]]
+    assert not diff.same_layout
+    # the new rows of the changed and added stations, in the order of the new frame
+    assert diff.rows['kioskId'].tolist() == [ids[2], ids[3], 999999]
+    assert diff.positions.tolist() == [1, 2, len(new) - 1]
+
+
+def test_diff_treats_missing_values_as_equal(stations):
+    old = stations.copy()
+    old['openTime'] = None
+    new = old.copy()
+    new.loc[new.index[4], 'totalDocks'] = numpy.nan
+    old.loc[old.index[4], 'totalDocks'] = numpy.nan
+
+    diff = diff_frames(old, new)
+    assert len(diff.changed) == 0 and diff.same_layout
+
+    new.loc[new.index[6], 'openTime'] = '06:00'
+    assert diff_frames(old, new).changed.tolist() == [stations['kioskId'].iloc[6]]
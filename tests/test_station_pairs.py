@@ -0,0 +1,83 @@
+import os
+
+import numpy
+import pytest
+from shapely.geometry import Point
+
+import station_pairs
+from benchmarks.synthetic import sample_feed_payload, synthetic_stations
+from snapshot import SnapshotStore
+from spatial import station_index
+from station_pairs import RideTimeMatrix, choose_station_pair, ride_time_matrix, ride_times
+
+
+def write_feed(path, stations, mtime_ns):
+    # a feed file of the stations with a given modification time
+    with open(path, 'wb') as file:
+        file.write(sample_feed_payload(stations))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def stations():
+    return synthetic_stations(50, seed=2, spread=0.02)
+
+
+def test_matrix_matches_the_ride_times_of_the_candidates(stations):
+    lonlat = stations[['longitude', 'latitude']].to_numpy()
+    starts, ends = numpy.array([3, 7, 1]), numpy.array([0, 9, 4, 7])
+    matrix = RideTimeMatrix(lonlat)
+    assert matrix.matrix is not None
+    numpy.testing.assert_allclose(matrix.times(starts, ends), ride_times(lonlat, starts, ends), rtol=1e-5)
+
+
+def test_matrix_of_a_large_feed_computes_rows_on_demand(monkeypatch, stations):
+    monkeypatch.setattr(station_pairs, 'matrix_max_stations', 10)
+    monkeypatch.setattr(station_pairs, 'matrix_cached_rows', 2)
+    lonlat = stations[['longitude', 'latitude']].to_numpy()
+    matrix = RideTimeMatrix(lonlat)
+    assert matrix.matrix is None
+
+    starts, ends = numpy.array([5, 2, 5]), numpy.array([1, 2, 3])
+    numpy.testing.assert_allclose(matrix.times(starts, ends), ride_times(lonlat, starts, ends), rtol=1e-5)
+    # only the most recent rows are kept
+    matrix.times(numpy.array([8]), ends)
+    assert len(matrix.rows) == 2
+
+
+def test_matrix_is_kept_until_a_station_moves(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations, 1_000_000_000)
+    store = SnapshotStore(path)
+    first = store.get()
+    matrix = ride_time_matrix(first, station_index(first))
+
+    # new counts, same positions
+    changed = stations.copy()
+    changed['bikesAvailable'] += 1
+    write_feed(path, changed, 2_000_000_000)
+    second = store.get()
+    assert ride_time_matrix(second, station_index(second)) is matrix
+
+    # a station moved
+    moved_to = changed.geometry.iloc[4].y + 0.01
+    changed.loc[changed.index[4], 'latitude'] = moved_to
+    changed.loc[changed.index[4], 'geometry'] = Point(changed.geometry.iloc[4].x, moved_to)
+    write_feed(path, changed, 3_000_000_000)
+    third = store.get()
+    moved = ride_time_matrix(third, station_index(third))
+    assert moved is not matrix
+    assert moved.matches(station_index(third).lonlat)
+
+
+def test_pair_of_the_cached_matrix_equals_the_computed_pair(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations, 1_000_000_000)
+    snapshot = SnapshotStore(path).get()
+    df, index = snapshot.frame, station_index(snapshot)
+    trip = (34.04, -118.26, 34.06, -118.24)
+
+    start, end, seconds = choose_station_pair(df, index, *trip, now=0, snapshot=snapshot)
+    assert start != end
+    assert choose_station_pair(df, index, *trip, now=0)[:2] == (start, end)
+    assert seconds == pytest.approx(choose_station_pair(df, index, *trip, now=0)[2], rel=1e-5)
@@ -0,0 +1,33 @@
+import pytest
+
+from benchmarks.bench_map import icon_color
+from benchmarks.synthetic import sample_stations
+from functions import station_styles
+
+
+@pytest.fixture
+def stations():
+    df = sample_stations()
+    # every rule: counts at the thresholds and a status the rules do not know
+    df.loc[df.index[0], ['bikesAvailable', 'docksAvailable']] = 6, 6
+    df.loc[df.index[1], ['bikesAvailable', 'docksAvailable']] = 5, 6
+    df.loc[df.index[2], ['bikesAvailable', 'docksAvailable']] = 2, 2
+    df.loc[df.index[3], ['bikesAvailable', 'docksAvailable']] = 1, 9
+    df.loc[df.index[4], 'kioskPublicStatus'] = 'Decommissioned'
+    return df
+
+
+@pytest.mark.parametrize('nearest', [0, 10, 223])
+def test_station_styles_match_the_rules_of_a_single_row(stations, nearest):
+    df_nearest = stations.iloc[::3].head(nearest)
+    styles = station_styles(stations, df_nearest['kioskId'])
+
+    expected = [icon_color(row, df_nearest) for _, row in stations.iterrows()]
+    assert list(zip(styles['color'], styles['icon'])) == expected
+    assert styles.index.equals(stations.index)
+
+
+def test_station_styles_without_nearest_stations_use_the_plain_colors(stations):
+    styles = station_styles(stations)
+    assert not styles['color'].str.startswith('dark').any()
+    assert set(styles['color']) == {'green', 'blue', 'red', 'gray'}
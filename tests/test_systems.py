@@ -0,0 +1,100 @@
+import json
+
+import numpy
+import pytest
+
+from benchmarks.synthetic import gbfs_documents, sample_feed_payload, synthetic_stations
+from history import AvailabilityHistory
+from systems import BikeSystem, SystemRouter, gbfs_feeds, gbfs_payload
+
+
+def city(tmp_path, name, latitude, longitude, stations=20):
+    # a system of synthetic stations around a position, its files in tmp_path
+    frame = synthetic_stations(stations, seed=len(name), spread=0.01)
+    frame['latitude'] += latitude - 34.05
+    frame['longitude'] += longitude + 118.25
+    data_file = str(tmp_path / name / 'geo_data.json')
+    (tmp_path / name).mkdir()
+    with open(data_file, 'wb') as file:
+        file.write(sample_feed_payload(frame))
+    return BikeSystem(name, '', 'gbfs', data_file=data_file,
+                      history=AvailabilityHistory(str(tmp_path / name / 'history')))
+
+
+def test_gbfs_feeds_of_version_2_and_3_discovery_files():
+    feeds = [{'name': 'station_information', 'url': 'https://example.com/info.json'},
+             {'name': 'station_status', 'url': 'https://example.com/status.json'}]
+    version_3 = {'version': '3.0', 'data': {'feeds': feeds}}
+    version_2 = {'version': '2.3', 'data': {'fr': {'feeds': []}, 'en': {'feeds': feeds}}}
+
+    expected = {'station_information': 'https://example.com/info.json',
+                'station_status': 'https://example.com/status.json'}
+    assert gbfs_feeds(version_3) == expected
+    assert gbfs_feeds(version_2) == expected
+    # without the preferred language, the first one
+    assert gbfs_feeds(version_2, 'de') == {}
+
+
+def test_gbfs_payload_of_version_2_documents():
+    documents = gbfs_documents(synthetic_stations(5))
+    # a station without a status is left out
+    documents['station_status']['data']['stations'].pop()
+    documents['station_status']['data']['stations'][0].update(num_ebikes_available=2, is_renting=False)
+
+    features = json.loads(gbfs_payload(documents['station_information'], documents['station_status']))['features']
+    assert len(features) == 4
+    first = features[0]['properties']
+    information = documents['station_information']['data']['stations'][0]
+    status = documents['station_status']['data']['stations'][0]
+    assert first['kioskId'] == int(information['station_id'])
+    assert first['electricBikesAvailable'] == 2
+    assert first['classicBikesAvailable'] == status['num_bikes_available'] - 2
+    assert first['kioskPublicStatus'] == 'Unavailable'
+    assert features[0]['geometry']['coordinates'] == [information['lon'], information['lat']]
+
+
+def test_gbfs_payload_of_version_3_documents():
+    information = {'data': {'stations': [
+        {'station_id': 'a1b2', 'name': [{'text': 'Main St', 'language': 'en'}], 'lat': 40.7, 'lon': -74.0,
+         'capacity': 10}]}}
+    status = {'data': {'stations': [
+        {'station_id': 'a1b2', 'num_vehicles_available': 4, 'num_docks_available': 6}]}}
+
+    properties = json.loads(gbfs_payload(information, status))['features'][0]['properties']
+    assert properties['name'] == 'Main St'
+    assert properties['bikesAvailable'] == 4 and properties['docksAvailable'] == 6
+    # non-numeric ids are hashed to a stable 31-bit kioskId
+    assert 0 <= properties['kioskId'] < 2 ** 31
+    assert properties['stationId'] == 'a1b2'
+
+
+def test_router_locates_positions_inside_and_outside_the_boxes(tmp_path):
+    la = city(tmp_path, 'la', 34.05, -118.25)
+    nyc = city(tmp_path, 'nyc', 40.73, -73.99)
+    router = SystemRouter([la, nyc])
+
+    positions = numpy.array([[34.05, -118.25], [40.73, -73.99],
+                             # outside both boxes: the nearest center
+                             [37.77, -122.42], [42.36, -71.06]])
+    assert router.locate_many(positions[:, 0], positions[:, 1]).tolist() == [0, 1, 0, 1]
+    assert router.locate(40.73, -73.99) is nyc
+    # without a position, the default system
+    assert router.locate(0.0, 0.0) is la
+
+
+def test_system_takes_the_time_zone_of_its_information_feed(tmp_path):
+    system = city(tmp_path, 'nyc', 40.73, -73.99)
+    assert system.timezone == 'America/Los_Angeles'
+
+    system.update_timezone({'data': {'timezone': 'America/New_York'}})
+    assert system.timezone == system.forecast.timezone == 'America/New_York'
+    # stored next to the feed file for the next start
+    assert city_timezone(tmp_path, 'nyc') == 'America/New_York'
+    with pytest.raises(ValueError):
+        BikeSystem('mars', '', 'gbfs', timezone='Mars/Olympus_Mons')
+
+
+def city_timezone(tmp_path, name):
+    # the time zone of a system restarted from the files in tmp_path
+    return BikeSystem(name, '', 'gbfs', data_file=str(tmp_path / name / 'geo_data.json'),
+                      history=AvailabilityHistory(str(tmp_path / name / 'history'))).timezone
@@ -0,0 +1,77 @@
+import os
+
+import numpy
+import pytest
+
+from benchmarks.synthetic import sample_feed_payload, synthetic_stations
+from columns import StationColumns
+from snapshot import SnapshotStore
+from table import StationTable, bike_table_columns, station_table, unique_stations
+
+
+def write_feed(path, stations, mtime_ns):
+    # a feed file of the stations with a given modification time
+    with open(path, 'wb') as file:
+        file.write(sample_feed_payload(stations))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def stations():
+    return synthetic_stations(30, seed=4)
+
+
+def test_rows_hold_the_cells_of_the_stations(stations):
+    stations.loc[stations.index[1], 'name'] = 'Main & 5th <North>'
+    stations.loc[stations.index[1], 'openTime'] = '06:05:00'
+    stations.loc[stations.index[1], 'closeTime'] = None
+    table = StationTable(StationColumns.from_frame(stations), bike_table_columns)
+
+    html = table.render([1])
+    assert html.startswith('<table border="1" class="dataframe">\n<thead>\n<tr style="text-align: right;">'
+                           '<th>kioskId</th><th>name</th>')
+    assert html.endswith('</tbody>\n</table>')
+    row = stations.iloc[1]
+    assert (f"<tr><td>{row['kioskId']}</td><td>Main &amp; 5th &lt;North&gt;</td><td>{row['addressStreet']}</td>"
+            in html)
+    assert f"<td>{row['bikesAvailable']}</td>" in html
+    assert '<td>06:05</td><td></td>' in html
+
+
+def test_table_of_stations_lists_every_station_once(stations):
+    table = StationTable(StationColumns.from_frame(stations), bike_table_columns)
+    assert unique_stations(table.kiosk_id, [4, 2, 4, 9, 2]).tolist() == [4, 2, 9]
+    assert table.render([4, 2, 4]) == table.head + table.rows[4] + table.rows[2] + table.tail
+
+
+def test_rows_of_unchanged_stations_are_reused_by_the_next_snapshot(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations, 1_000_000_000)
+    store = SnapshotStore(path)
+    first = station_table(store.get(), bike_table_columns)
+
+    changed = stations.copy()
+    changed.loc[changed.index[[3, 11]], 'bikesAvailable'] += 1
+    write_feed(path, changed, 2_000_000_000)
+    snapshot = store.get()
+    second = station_table(snapshot, bike_table_columns)
+
+    assert second is not first
+    unchanged = [position for position in range(len(stations)) if position not in (3, 11)]
+    assert all(second.rows[position] is first.rows[position] for position in unchanged)
+    # the rows of the changed stations equal the rows of a table built from scratch
+    rebuilt = StationTable(StationColumns.from_frame(snapshot.frame), bike_table_columns)
+    assert second.rows.tolist() == rebuilt.rows.tolist()
+    assert second.rows[3] != first.rows[3]
+
+
+def test_table_is_rebuilt_when_stations_are_added(tmp_path, stations):
+    path = str(tmp_path / 'geo_data.json')
+    write_feed(path, stations.iloc[:20], 1_000_000_000)
+    store = SnapshotStore(path)
+    first = station_table(store.get(), bike_table_columns)
+
+    write_feed(path, stations, 2_000_000_000)
+    second = station_table(store.get(), bike_table_columns)
+    assert len(second.rows) == len(stations)
+    assert second.rows[0] is not first.rows[0] and second.rows[0] == first.rows[0]
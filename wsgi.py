@@ -0,0 +1,59 @@
+"""
+    Production entry point of the map viewer, for a multi-worker WSGI server:
+
+        gunicorn -c gunicorn.conf.py wsgi:app
+
+    Importing the module fetches the station feeds of all systems once (in parallel), loads their snapshots,
+    builds their derived structures and renders their default pages. With gunicorn's preload_app this happens
+    once in the master process, and the workers forked from it share the loaded data copy-on-write. A single
+    feed poller process (started by gunicorn.conf.py) keeps the feed files up to date; every worker reloads a
+    snapshot when its file changes. The Flask debugger, reloader and browser window are only used by main.py
+    in development.
+"""
+import gc
+import os
+
+from columns import station_columns
+from filters import availability_index
+from api import system_road_graph
+from main import create_app
+from service_areas import service_area_minutes, service_areas
+from spatial import station_index
+from systems import bike_systems, refresh_systems, system_router
+from table import bike_table_columns, dock_table_columns, station_table, station_table_columns
+
+
+def warm_up(app):
+    """
+        Loads the current snapshot of every system with its derived structures and renders the default pages
+        once.
+
+        Args:
+            app (Flask): The application to warm up.
+        """
+    for name, system in bike_systems.items():
+        if not os.path.exists(system.data_file):
+            print(f"No station data of {name}.")
+            continue
+        snapshot = system.store.get()
+        station_index(snapshot)
+        station_columns(snapshot)
+        availability_index(snapshot)
+        for names in (station_table_columns, bike_table_columns, dock_table_columns):
+            station_table(snapshot, names)
+        graph_file = system_road_graph(system, app)
+        if graph_file is not None and os.path.exists(graph_file):
+            for profile in service_area_minutes:
+                service_areas(snapshot, profile, graph_file)
+        with app.test_client() as client:
+            client.get('/', query_string={'system': name})
+    # the station bounding boxes the requests are routed by
+    system_router.areas()
+
+
+refresh_systems()
+app = create_app()
+warm_up(app)
+# everything loaded so far is shared with the workers, keep the garbage collector from touching (and so
+# copying) its pages in every worker
+gc.freeze()